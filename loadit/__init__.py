@@ -2,7 +2,8 @@ from loadit.gui.main import launch_app
 from loadit.database import get_dataframe, write_query
 from loadit.client import Client
 from loadit.server import CentralServer, start_node
+from loadit.results_cache import ResultsCache
 import loadit.log as log
 
 # version format: {major version}.{minor version}.{database version}.{network version}
-__version__ = '0.1.0.0'
+__version__ = '0.1.4.1'
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class ArrayIndex(object):
+    """
+    Position of each key (i.e. LIDs or IDs) within an array.
+
+    Keys are kept sorted along with their positions (a permutation), so lookups are
+    vectorized binary searches and far less memory is needed than with a dict.
+    Duplicated keys resolve to their last position (as with a dict).
+    """
+
+    def __init__(self, keys, dtype=None):
+        """
+        Initialize an ArrayIndex instance.
+
+        Parameters
+        ----------
+        keys : array_like
+            Keys (in array order).
+        dtype : str, optional
+            Keys type. By default it is inferred from `keys`.
+        """
+        keys = np.asarray(keys, dtype=dtype)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, key):
+        return bool(self.find([key])[1][0])
+
+    def __getitem__(self, key):
+        positions, found = self.find([key])
+
+        if not found[0]:
+            raise KeyError(key)
+
+        return int(positions[0])
+
+    def find(self, keys):
+        """
+        Look up several keys at once.
+
+        Parameters
+        ----------
+        keys : array_like
+            Keys to be found.
+
+        Returns
+        -------
+        numpy.ndarray
+            Position of each key (-1 if missing).
+        numpy.ndarray
+            Whether each key is found or not.
+        """
+        keys = np.asarray(keys)
+
+        if not len(self._sorted_keys):
+            return np.full(keys.shape, -1, dtype=np.int64), np.zeros(keys.shape, dtype=bool)
+
+        i = np.searchsorted(self._sorted_keys, keys, side='right') - 1 # Last occurrence
+        i_valid = np.maximum(i, 0)
+        found = (i >= 0) & (self._sorted_keys[i_valid] == keys)
+        return np.where(found, self._order[i_valid], -1), found
+
+    def get_positions(self, keys):
+        """
+        Get the position of several keys (all of them must be found).
+
+        Parameters
+        ----------
+        keys : array_like
+            Keys to be found.
+
+        Returns
+        -------
+        numpy.ndarray
+            Position of each key.
+        """
+        positions, found = self.find(keys)
+
+        if not found.all():
+            raise KeyError(np.asarray(keys)[~found][0].item())
+
+        return positions
+
+    def missing(self, keys):
+        """
+        Get the keys not found.
+
+        Parameters
+        ----------
+        keys : array_like
+            Keys to be found.
+
+        Returns
+        -------
+        numpy.ndarray
+            Keys not found.
+        """
+        keys = np.asarray(keys)
+        return keys[~self.find(keys)[1]]
+
+    def add(self, keys):
+        """
+        Add keys (placed after the current ones).
+
+        Parameters
+        ----------
+        keys : array_like
+            New keys.
+        """
+        keys = np.asarray(keys, dtype=self._sorted_keys.dtype)
+        order = np.argsort(keys, kind='stable')
+        positions = np.arange(len(self), len(self) + len(keys))[order]
+        i = np.searchsorted(self._sorted_keys, keys[order], side='right') # After equal keys
+        self._sorted_keys = np.insert(self._sorted_keys, i, keys[order])
+        self._order = np.insert(self._order, i, positions)
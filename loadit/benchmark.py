@@ -0,0 +1,361 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import numpy as np
+from loadit.read_results import tables_in_file
+from loadit.tables_specs import get_tables_specs
+from loadit.database_creation import create_tables, create_transpose, create_table_header
+import logging
+
+
+log = logging.getLogger()
+
+
+def write_pch(file, tables_specs=None, n_subcases=10, n_IDs=1000, seed=0):
+    """
+    Write a synthetic .pch file (all the tables for each subcase).
+
+    Parameters
+    ----------
+    file : str
+        .pch file path.
+    tables_specs : dict, optional
+        Tables specifications. By default all supported tables are written.
+    n_subcases : int, optional
+        Number of subcases.
+    n_IDs : int, optional
+        Number of element IDs of each table.
+    seed : int, optional
+        Random seed.
+
+    Returns
+    -------
+    list of str
+        Tables written.
+    """
+
+    if not tables_specs:
+        tables_specs = get_tables_specs()
+
+    random = np.random.RandomState(seed)
+    tables = list()
+
+    for name, table_specs in tables_specs.items():
+        match = re.match(r'(.+) - (\S+) \((\d+)\)$', name)
+
+        if not match:
+            log.warning(f"WARNING: '{name}' cannot be written (unexpected table name)")
+            continue
+
+        # Record fields (except subcase and element ID)
+        fields = [dtype for row in table_specs['pch_format'] for _, dtype in row][2:]
+        tables.append((name, match.groups(), fields))
+
+    IDs = np.arange(1, n_IDs + 1) * 10
+    n_lines = 0
+
+    def line(string):
+        nonlocal n_lines
+        n_lines += 1
+        return f'{string[:72]:72}{n_lines:8}\n'
+
+    with open(file, 'w') as f:
+
+        for subcase in range(1, n_subcases + 1):
+
+            for name, (table_type, element_type, element_number), fields in tables:
+                f.write(line(f'$TITLE   = SYNTHETIC RESULTS (SUBCASE {subcase})') +
+                        line('$SUBTITLE=') +
+                        line('$LABEL   =') +
+                        line(f'${table_type}') +
+                        line('$REAL OUTPUT') +
+                        line(f'$SUBCASE ID = {subcase:12}') +
+                        line(f'$ELEMENT TYPE ={element_number:>12}  {element_type}'))
+                values = random.uniform(-1e4, 1e4, (n_IDs, len(fields)))
+                records = list()
+
+                for ID, record_values in zip(IDs, values):
+                    record = [f'{int(value):18}' if dtype.startswith('i') else f'{value:18.6E}' for
+                              value, dtype in zip(record_values, fields)]
+                    records.append(line(f'{ID:10}        ' + ''.join(record[:3])))
+
+                    for i in range(3, len(record), 3):
+                        records.append(line('-CONT-            ' + ''.join(record[i:i + 3])))
+
+                f.writelines(records)
+
+    return [name for name, _, _ in tables]
+
+
+# Words of each OEF row (after the element ID) of each element type: 'f' for values,
+# 'g' for grid IDs and 's' for station distances. Along with the number of rows (stations)
+# of each element.
+OEF_LAYOUTS = {
+    1: ('ff', 1), # AF, TRQ
+    2: ('gsfffffff' * 11, 1), # 11 stations: GRID, SD, BM1, BM2, TS1, TS2, AF, TTRQ, WTRQ
+    11: ('f', 1), # F
+    12: ('f', 1),
+    13: ('f', 1),
+    14: ('f', 1),
+    33: ('ffffffff', 1), # MX, MY, MXY, BMX, BMY, BMXY, TX, TY
+    34: ('ffffffff', 1), # BM1A, BM2A, BM1B, BM2B, TS1, TS2, AF, TRQ
+    74: ('ffffffff', 1), # MX, MY, MXY, BMX, BMY, BMXY, TX, TY
+    100: ('sffffff', 2), # Each station: SD, BM1, BM2, TS1, TS2, AF, TRQ
+    102: ('ffffff', 1), # FX, FY, FZ, MX, MY, MZ
+}
+
+
+def write_op2(file, tables_specs=None, n_subcases=10, n_IDs=1000, seed=0, byteorder='<'):
+    """
+    Write a synthetic .op2 file (an element forces table, OEF1X, with all the element
+    types for each subcase). Records follow the OEF word layout of each element type
+    (see `OEF_LAYOUTS`).
+
+    Parameters
+    ----------
+    file : str
+        .op2 file path.
+    tables_specs : dict, optional
+        Tables specifications. By default all supported tables are written.
+    n_subcases : int, optional
+        Number of subcases.
+    n_IDs : int, optional
+        Number of element IDs of each table.
+    seed : int, optional
+        Random seed.
+    byteorder : {'<', '>'}, optional
+        Byte order.
+
+    Returns
+    -------
+    list of str
+        Tables written.
+    """
+
+    if not tables_specs:
+        tables_specs = get_tables_specs()
+
+    random = np.random.RandomState(seed)
+    tables = list()
+
+    for name in tables_specs:
+        match = re.match(r'(.+) - (\S+) \((\d+)\)$', name)
+
+        if not match or int(match.group(3)) not in OEF_LAYOUTS:
+            log.warning(f"WARNING: '{name}' cannot be written (unexpected table name)")
+            continue
+
+        tables.append((name, int(match.group(3))))
+
+    IDs = np.arange(1, n_IDs + 1) * 10
+    int32 = np.dtype(byteorder + 'i4')
+
+    def record(payload):
+        nbytes = np.array([len(payload)], dtype=int32).tobytes()
+        return nbytes + payload + nbytes
+
+    def marker(value):
+        return record(np.array([value], dtype=int32).tobytes())
+
+    with open(file, 'wb') as f:
+        f.write(marker(3))
+        f.write(record(b'OEF1X   ') + marker(-1))
+        f.write(marker(-2) + record(b'OEF1X   ' + np.zeros(5, dtype=int32).tobytes()))
+        record_number = 3
+
+        for subcase in range(1, n_subcases + 1):
+
+            for name, element_code in tables:
+                layout, n_stations = OEF_LAYOUTS[element_code]
+                n_words = 1 + len(layout)
+
+                # IDENT record
+                ident = np.zeros(146, dtype=int32)
+                ident[:4] = [11, 4, element_code, subcase] # Approach, table, element type and subcase codes
+                ident[8:10] = [1, n_words] # Real format and number of words per row
+                text = f'SYNTHETIC RESULTS (SUBCASE {subcase})'.ljust(384).encode('latin-1')
+                ident.view(np.uint8)[200:] = np.frombuffer(text, dtype=np.uint8)
+                f.write(marker(-record_number) + record(ident.tobytes()))
+
+                # DATA record (station rows of each element one after another)
+                words = np.empty((n_IDs, n_stations, n_words), dtype=int32)
+                words[:, :, 0] = IDs[:, None] * 10 + 1 # Device code
+                station_distances = np.linspace(0.0, 1.0, layout.count('s') * n_stations)
+
+                for i, kind in enumerate(layout, 1):
+
+                    if kind == 'g':
+                        words[:, :, i] = random.randint(1, 10**6, (n_IDs, n_stations))
+                    elif kind == 's':
+                        k = layout[:i].count('s') - 1 # Station within the row
+                        words[:, :, i] = station_distances[k::layout.count('s')].astype(byteorder + 'f4').view(int32)
+                    else:
+                        words[:, :, i] = random.uniform(-1e4, 1e4, (n_IDs, n_stations)).astype(byteorder + 'f4').view(int32)
+
+                f.write(marker(-record_number - 1) + record(words.tobytes()))
+                record_number += 2
+
+        f.write(marker(-record_number) + marker(0))
+
+    return [name for name, _ in tables]
+
+
+def run_benchmark(n_subcases=10, n_IDs=1000, n_workers=1, max_memory=1e9,
+                  hash_function='sha256', path=None, seed=0, file_format='pch'):
+    """
+    Benchmark the ingestion of a synthetic result file (.pch or .op2).
+
+    Each stage is timed separately: parsing (`tables_in_file`), writing the
+    LID-major tables (`create_tables`, parsing included), transposing them
+    (`create_transpose`) and hashing them (`create_table_header`).
+
+    Parameters
+    ----------
+    n_subcases : int, optional
+        Number of subcases.
+    n_IDs : int, optional
+        Number of element IDs of each table.
+    n_workers : int, optional
+        Number of parser processes.
+    max_memory : int, optional
+        Memory limit (in bytes) used for transposing.
+    hash_function : str, optional
+        Hash function.
+    path : str, optional
+        Working directory. By default a temporary one is used (and removed afterwards).
+    seed : int, optional
+        Random seed.
+    file_format : {'pch', 'op2'}, optional
+        Synthetic file format.
+
+    Returns
+    -------
+    dict
+        Benchmark results (throughput of each stage in MB/s and subcases/s).
+    """
+    temp_path = None
+
+    if not path:
+        path = temp_path = tempfile.mkdtemp(prefix='loadit_benchmark_')
+
+    try:
+        tables_specs = get_tables_specs()
+        if file_format not in ('pch', 'op2'):
+            raise ValueError(f"Not supported file format: '{file_format}'")
+
+        file = os.path.join(path, f'benchmark.{file_format}')
+        database_path = os.path.join(path, 'benchmark_database')
+        shutil.rmtree(database_path, ignore_errors=True)
+        os.mkdir(database_path)
+
+        start_time = time.perf_counter()
+        tables = (write_pch if file_format == 'pch' else write_op2)(file, tables_specs, n_subcases, n_IDs, seed)
+        file_size = os.path.getsize(file)
+        log.info(f'Synthetic file written in {time.perf_counter() - start_time:.2f} seconds')
+
+        stages = dict()
+
+        def add_stage(stage, elapsed_time, size):
+            stages[stage] = {
+                'seconds': elapsed_time,
+                'MB': size / 1e6,
+                'MB/s': size / 1e6 / elapsed_time if elapsed_time else None,
+                'subcases/s': n_subcases / elapsed_time if elapsed_time else None,
+            }
+
+        # Parsing
+        start_time = time.perf_counter()
+
+        for table in tables_in_file(file, tables_specs, n_workers=n_workers):
+            pass
+
+        add_stage(f'tables_in_{file_format}', time.perf_counter() - start_time, file_size)
+
+        # Writing (LID-major)
+        headers = dict()
+        start_time = time.perf_counter()
+        create_tables(database_path, [file], headers, tables_specs, n_workers=n_workers)
+        add_stage('create_tables', time.perf_counter() - start_time, file_size)
+        data_size = sum(len(header['LIDs']) * len(header['IDs']) * np.dtype(dtype).itemsize for
+                        header in headers.values() for _, dtype in header['columns'][2:])
+
+        # Transposing (ID-major)
+        start_time = time.perf_counter()
+
+        for header in headers.values():
+            create_transpose(header, max_memory)
+
+        add_stage('create_transpose', time.perf_counter() - start_time, data_size)
+
+        # Hashing
+        start_time = time.perf_counter()
+
+        for header in headers.values():
+            create_table_header(header, 'benchmark', hash_function)
+
+        add_stage('create_table_header', time.perf_counter() - start_time, 2 * data_size)
+
+    finally:
+
+        if temp_path:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    from loadit.__init__ import __version__
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'parameters': {
+            'n_subcases': n_subcases,
+            'n_IDs': n_IDs,
+            'n_workers': n_workers,
+            'max_memory': max_memory,
+            'hash_function': hash_function,
+            'seed': seed,
+            'file_format': file_format,
+        },
+        'tables': tables,
+        'file_size': file_size,
+        'stages': stages,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion of a synthetic result file')
+    parser.add_argument('--subcases', dest='n_subcases', type=int, default=10,
+                        help='number of subcases (10 by default)')
+    parser.add_argument('--ids', dest='n_IDs', type=int, default=1000,
+                        help='number of element IDs of each table (1000 by default)')
+    parser.add_argument('--workers', dest='n_workers', type=int, default=1,
+                        help='number of parser processes (1 by default)')
+    parser.add_argument('--max-memory', dest='max_memory', type=float, default=1e9,
+                        help='memory limit in bytes (1e9 by default)')
+    parser.add_argument('--hash', dest='hash_function', default='sha256',
+                        help="hash function ('sha256' by default)")
+    parser.add_argument('--format', dest='file_format', choices=['pch', 'op2'], default='pch',
+                        help="synthetic file format ('pch' by default)")
+    parser.add_argument('--path', dest='path', default=None,
+                        help='working directory (a temporary one by default)')
+    parser.add_argument('--output', dest='output', default=None,
+                        help='JSON output file (printed to screen by default)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.n_subcases, args.n_IDs, args.n_workers, args.max_memory,
+                            args.hash_function, args.path, file_format=args.file_format)
+
+    if args.output:
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -6,7 +6,7 @@ import time
 import pyarrow as pa
 from loadit.database import DatabaseHeader, Database, create_database, parse_query
 from loadit.connection import Connection
-from loadit.connection_tools import send_tables
+from loadit.connection_tools import send_tables, send_arrays
 from loadit.misc import get_hash, humansize
 import logging
 
@@ -79,6 +79,8 @@ class BaseClient(object):
         Request something to the server.
         """
         connection = Connection(self.server_address)
+        connection.progress_callback = kwargs.pop('callback', None)
+        tables = kwargs.pop('tables', None) # Sent apart (not as part of the request)
 
         try:
             # Authentication
@@ -119,6 +121,9 @@ class BaseClient(object):
             elif kwargs['request_type'] == 'new_batch':
                 send_tables(connection, kwargs['files'], data)
                 data = connection.recv()
+            elif kwargs['request_type'] == 'new_batch_from_arrays':
+                send_arrays(connection, tables, data)
+                data = connection.recv()
             elif kwargs['request_type'] == 'query':
                 reader = pa.RecordBatchStreamReader(pa.BufferReader(connection.recv().getbuffer()))
                 log.info('Done!')
@@ -169,16 +174,22 @@ class DatabaseClient(BaseClient):
     def read_only(self):
         return not jwt.decode(self._authentication, verify=False)['is_admin']
 
-    def check(self):
+    def check(self, max_nbytes=None):
         """
         Check database integrity.
 
+        Parameters
+        ----------
+        max_nbytes : int, optional
+            Maximum number of bytes of field files to be read (each call resumes where
+            the previous one stopped).
+
         Returns
         -------
         list of str
             List of corrupted files.
         """
-        return self._request(request_type='check')['corrupted_files']
+        return self._request(request_type='check', max_nbytes=max_nbytes)['corrupted_files']
 
     def add_attachment(self, file):
         """
@@ -215,20 +226,68 @@ class DatabaseClient(BaseClient):
         """
         self._request(request_type='download_attachment', name=name, output_path=path)
 
-    def new_batch(self, files, batch_name, comment=''):
+    def new_batch(self, files, batch_name, comment='', callback=None):
         """
         Append new batch to database. This operation is reversible.
 
         Parameters
         ----------
         files : list of str
-            List of .pch files.
+            List of result files (.pch or .op2).
         batch_name : str
             Batch name.
         comment : str
             Batch comment.
+        callback : callable, optional
+            Function called with each progress event streamed by the server (see `BatchMetrics`).
+
+        Returns
+        -------
+        dict
+            Ingestion metrics.
         """
-        self._request(request_type='new_batch', files=files, batch=batch_name, comment=comment)
+        return self._new_batch(callback, request_type='new_batch', files=files, batch=batch_name, comment=comment)
+
+    def new_batch_from_arrays(self, tables, batch_name, comment='', callback=None):
+        """
+        Append new batch to database from arrays (no result files involved).
+        This operation is reversible.
+
+        Parameters
+        ----------
+        tables : dict of str: dict, pyarrow.Table or pandas.DataFrame
+            Values of each table (see `tables_in_arrays`).
+        batch_name : str
+            Batch name.
+        comment : str
+            Batch comment.
+        callback : callable, optional
+            Function called with each progress event streamed by the server (see `BatchMetrics`).
+
+        Returns
+        -------
+        dict
+            Ingestion metrics.
+        """
+        return self._new_batch(callback, request_type='new_batch_from_arrays', tables=tables,
+                               batch=batch_name, comment=comment)
+
+    def _new_batch(self, callback, **kwargs):
+        """
+        Request a new batch (keeping the metrics reported at the end).
+        """
+        metrics = dict()
+
+        def progress_callback(event):
+
+            if event['event'] == 'batch':
+                metrics.update(event['metrics'])
+
+            if callback:
+                callback(event)
+
+        self._request(callback=progress_callback, **kwargs)
+        return metrics
 
     def restore(self, batch_name):
         """
@@ -48,6 +48,7 @@ class Connection(object):
         self.nbytes_in = 0
         self.nbytes_out = 0
         self.waiting = False
+        self.progress_callback = None
 
     def connect(self, peer_address):
         """
@@ -95,17 +96,20 @@ class Connection(object):
         ----------
         msg : bytes, dict or str
             Message to be sended.
-        msg_type : {'bytes', 'buffer', 'json',
+        msg_type : {'bytes', 'buffer', 'json', 'progress',
                     'debug_log', 'info_log', 'warning_log',
                     'error_log', 'critical_log', 'exception'}, optional
             Message type. It can be raw bytes, a dict (encoded as json),
-            a log entry or an exception descriptor (both of them of type str).
+            a progress event (a dict), a log entry or an exception descriptor
+            (both of them of type str).
         """
-        type_encoding = {'bytes': 'b', 'buffer': 'B', 'json': 'j',
+        type_encoding = {'bytes': 'b', 'buffer': 'B', 'json': 'j', 'progress': 'p',
                          'debug_log': 'd', 'info_log': 'i', 'warning_log': 'w',
                          'error_log': 'e', 'critical_log': 'c', 'exception': 'E'}
 
-        if type(msg) is dict:
+        if msg_type == 'progress': # No confirmation required (as log entries)
+            bytes = json.dumps(msg).encode()
+        elif type(msg) is dict:
             self.wait()
             msg_type = 'json'
             bytes = json.dumps(msg).encode()
@@ -154,6 +158,11 @@ class Connection(object):
                 return buffer
             elif data_type == 'j': # json message
                 return json.loads(buffer.getvalue())
+            elif data_type == 'p': # progress event
+
+                if self.progress_callback:
+                    self.progress_callback(json.loads(buffer.getvalue()))
+
             elif data_type == 'd': # debug log record
                 log.debug(buffer.getvalue().decode())
             elif data_type == 'i': # info log record
@@ -2,8 +2,9 @@ import os
 from io import BytesIO
 import socket
 import numpy as np
+import pyarrow as pa
 from loadit.misc import humansize
-from loadit.read_results import tables_in_pch, ResultsTable
+from loadit.read_results import tables_in_file, ResultsTable
 import logging
 
 
@@ -16,7 +17,7 @@ def send_tables(connection, files, tables_specs):
     for i, file in enumerate(files):
         log.info(f"Transferring file {i + 1} of {len(files)} ({humansize(os.path.getsize(file))}): '{os.path.basename(file)}'...")
 
-        for table in tables_in_pch(file, tables_specs):
+        for table in tables_in_file(file, tables_specs):
 
             if table.name not in tables_specs:
 
@@ -48,6 +49,64 @@ def recv_tables(connection):
         yield table
 
 
+def send_arrays(connection, tables, tables_specs):
+    """
+    Send tables given as arrays (as Arrow streams, a row for each LID/ID pair).
+
+    Parameters
+    ----------
+    connection : Connection
+        Connection to peer.
+    tables : dict of str: dict, pyarrow.Table or pandas.DataFrame
+        Values of each table (see `tables_in_arrays`).
+    tables_specs : dict
+        Tables specifications.
+    """
+
+    n_tables = f' of {len(tables)}' if isinstance(tables, dict) else ''
+
+    for i, (name, arrays) in enumerate(tables.items() if isinstance(tables, dict) else tables):
+
+        if name not in tables_specs:
+            raise ValueError(f"'{name}' is not supported!")
+
+        if isinstance(arrays, dict): # Flatten 2-D field arrays (a row for each LID/ID pair)
+            LID_label, ID_label = tables_specs[name]['columns'][:2]
+            LIDs = np.asarray(arrays[LID_label]).reshape(-1)
+            IDs = np.asarray(arrays[ID_label]).reshape(-1)
+            columns = {LID_label: np.repeat(LIDs, len(IDs)), ID_label: np.tile(IDs, len(LIDs))}
+            columns.update({field: np.asarray(array).reshape(-1) for field, array in arrays.items() if
+                            field not in columns})
+            arrays = pa.Table.from_arrays([pa.array(array) for array in columns.values()], list(columns))
+        elif isinstance(arrays, pa.RecordBatch):
+            arrays = pa.Table.from_batches([arrays])
+        elif not isinstance(arrays, pa.Table): # Index (i.e. of filtered DataFrames) left out
+            arrays = pa.Table.from_pandas(arrays, preserve_index=False)
+
+        sink = pa.BufferOutputStream()
+        writer = pa.RecordBatchStreamWriter(sink, arrays.schema)
+        writer.write_table(arrays)
+        writer.close()
+        buffer = sink.getvalue()
+        log.info(f"Transferring table {i + 1}{n_tables} ({humansize(buffer.size)}): '{name}'...")
+        connection.send({'name': name})
+        connection.send(buffer, 'buffer')
+
+    connection.send(b'END')
+
+
+def recv_arrays(connection):
+
+    while True:
+        data = connection.recv()
+
+        if data == b'END':
+            break
+
+        reader = pa.RecordBatchStreamReader(pa.BufferReader(connection.recv().getbuffer()))
+        yield data['name'], reader.read_all()
+
+
 def get_ip():
     """
     Get ip address of localhost.
@@ -3,25 +3,48 @@ import re
 from pathlib import Path
 import csv
 import json
+import copy
 import zlib
+import hashlib
+import zipfile
 import binascii
 import shutil
+import socket
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pyarrow as pa
 import pyarrow.parquet as pq
 from loadit.table_data import TableData
-from loadit.tables_specs import get_tables_specs
-from loadit.database_creation import create_tables, assembly_database, open_table, create_database_header
-from loadit.misc import humansize, get_hasher, hash_bytestr
+from loadit.array_index import ArrayIndex
+from loadit.read_results import tables_in_arrays, watch_tables
+from loadit.metrics import BatchMetrics
+from loadit.tables_specs import get_tables_specs, get_registry_version
+from loadit.database_creation import (create_tables, assembly_database, open_table, create_database_header,
+                                      write_journal, remove_journal, get_journal, rollback_journal,
+                                      get_segments_end, get_table_quantization, BLOCK_SIZE)
+from loadit.misc import humansize, get_hasher, hash_bytestr, hash_files, get_merkle_root, LazyDict
 import logging
 
 
 log = logging.getLogger()
 
+# Binary cache of the table headers (see `write_catalog`)
+CATALOG_FILE = '##catalog.npz'
+
+# Chunks already checked of each field file by incremental checks (see `Database.check`)
+CHECK_FILE = '##check.json'
+
+# Databases with a batch running in the current process (real paths)
+_running_batches = set()
+
 
 class DatabaseHeader(object):
     """
     Store database metadata.
+
+    Table headers (LIDs and IDs included, as arrays) are loaded on first access,
+    either from the catalog (if it matches the database header) or from the table
+    files otherwise.
     """
 
     def __init__(self, path=None, header=None):
@@ -40,8 +63,10 @@ class DatabaseHeader(object):
         else: # Load header from path
 
             # Load database header
-            with open(os.path.join(path, '##header.json')) as f:
-                self.__dict__ = json.load(f)
+            with open(os.path.join(path, '##header.json'), 'rb') as f:
+                content = f.read()
+
+            self.__dict__ = json.loads(content)
 
             # Check database version
             from loadit.__init__ import __version__
@@ -49,43 +74,143 @@ class DatabaseHeader(object):
             if self.version.split('.')[-2] != __version__.split('.')[-2]:
                 raise ValueError(f"Not supported version!")
 
-            # Load tables headers
-            from loadit.queries import query_functions, query_geometry
             self.name = os.path.basename(path)
-            self.nbytes = 0
-            self.tables = dict()
+            self._path = path
+            self._hash = hashlib.sha256(content).hexdigest()
+            self._catalog = get_catalog(path, self._hash)
+            self.tables = LazyDict(self.table_hashes, self._load_table)
 
-            for name in self.table_hashes:
+    def _load_table(self, name):
+        """
+        Load a table header.
 
-                # Load table header
-                with open(os.path.join(os.path.join(path, name), '#header.json')) as f:
-                    self.tables[name] = json.load(f)
+        Parameters
+        ----------
+        name : str
+            Table name.
 
-                self.tables[name]['nbytes'] = 0
+        Returns
+        -------
+        dict
+            Table header.
+        """
+        from loadit.queries import query_functions, query_geometry
+        table = None
 
-                # Load LIDs & EIDs and calculate total size in bytes
-                for i, (field_name, dtype) in enumerate(self.tables[name]['columns']):
-                    file = os.path.join(path, name, field_name + '.bin')
-                    self.tables[name]['nbytes'] += os.path.getsize(file)
+        if self._catalog and name in self._catalog:
+            table = read_catalog_table(self._path, self._hash, *self._catalog[name])
 
-                    if i == 0:
-                        self.tables[name]['LIDs'] = np.fromfile(file, dtype=dtype).tolist()
-                    elif i == 1:
-                        self.tables[name]['IDs'] = np.fromfile(file, dtype=dtype).tolist()
+        if table is None: # Not in catalog (or catalog outdated)
+            table = read_table_header(self._path, name)
 
-                self.nbytes += self.tables[name]['nbytes']
+        # Load query functions
+        try:
+            table['query_functions'] = list(query_functions[name])
+        except:
+            table['query_functions'] = list()
 
-                # Load query functions
-                try:
-                    self.tables[name]['query_functions'] = list(query_functions[name])
-                except:
-                    self.tables[name]['query_functions'] = list()
+        # Load query geometry
+        try:
+            table['query_geometry'] = list(query_geometry[name])
+        except:
+            table['query_geometry'] = list()
 
-                # Load query geometry
-                try:
-                    self.tables[name]['query_geometry'] = list(query_geometry[name])
-                except:
-                    self.tables[name]['query_geometry'] = list()
+        return table
+
+    @property
+    def nbytes(self):
+        """
+        Total size (in bytes) of the table files.
+        """
+
+        if 'nbytes' not in self.__dict__:
+
+            if self._catalog:
+                self.__dict__['nbytes'] = sum(nbytes for _, nbytes in self._catalog.values())
+            else:
+                self.__dict__['nbytes'] = sum(table['nbytes'] for table in self.tables.values())
+
+        return self.__dict__['nbytes']
+
+    def get_table_columns(self, name):
+        """
+        Get the columns of a table along with its quantization settings (unlike
+        `tables`, neither LIDs nor IDs are loaded).
+
+        Parameters
+        ----------
+        name : str
+            Table name.
+
+        Returns
+        -------
+        list of (str, str)
+            Field name and type of each column.
+        dict
+            Quantization settings of each quantized field.
+        """
+        table = self.tables.loaded().get(name)
+
+        if table is None and self._catalog and name in self._catalog:
+            table = read_catalog_table(self._path, self._hash, *self._catalog[name], arrays=False)
+
+        if table is None: # Not in catalog (or catalog outdated)
+
+            with open(os.path.join(self._path, name, '#header.json')) as f:
+                table = json.load(f)
+
+        return table['columns'], table.get('quantization', dict())
+
+    def get_table_indexes(self, name):
+        """
+        Get the LID and ID indexes of a table (built only once for each table header,
+        and reused when appending to the table).
+
+        Parameters
+        ----------
+        name : str
+            Table name.
+
+        Returns
+        -------
+        ArrayIndex
+            LID index.
+        ArrayIndex
+            ID index.
+        """
+        table = self.tables[name]
+
+        if 'LIDs_index' not in table:
+            table['LIDs_index'] = ArrayIndex(table['LIDs'], dtype=table['columns'][0][1])
+
+        if 'IDs_index' not in table:
+            table['IDs_index'] = ArrayIndex(table['IDs'])
+
+        return table['LIDs_index'], table['IDs_index']
+
+    def write_catalog(self):
+        """
+        Write the catalog of the database (all table headers are loaded).
+        """
+        write_catalog(self._path, self._hash, self.tables)
+        self._catalog = get_catalog(self._path, self._hash)
+
+    def to_dict(self):
+        """
+        Get the database header as a JSON serializable dict (all table headers are loaded).
+
+        Returns
+        -------
+        dict
+            Database header.
+        """
+        header = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+        header['nbytes'] = self.nbytes
+        header['tables'] = {name: {key: value for key, value in dict(table, LIDs=np.asarray(table['LIDs']).tolist(),
+                                                                      IDs=np.asarray(table['IDs']).tolist()).items() if
+                                   key not in ('LIDs_index', 'IDs_index')} for
+                            name, table in self.tables.items()}
+        return header
 
     def get_query_header(self):
         return {'database': self.name, 'hash': self.batches[-1][1]}
@@ -216,7 +341,194 @@ class DatabaseHeader(object):
         return size
 
 
-def create_database(database_path, overwrite=False):
+def read_table_header(database_path, name):
+    """
+    Load a table header from the table files.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    name : str
+        Table name.
+
+    Returns
+    -------
+    dict
+        Table header (LIDs, IDs and total size of the table files included).
+    """
+
+    with open(os.path.join(database_path, name, '#header.json')) as f:
+        table = json.load(f)
+
+    table['nbytes'] = 0
+
+    # Load LIDs & EIDs and calculate total size in bytes
+    for i, (field_name, dtype) in enumerate(table['columns']):
+        file = os.path.join(database_path, name, field_name + '.bin')
+        table['nbytes'] += os.path.getsize(file)
+
+        if i == 0:
+            table['LIDs'] = np.fromfile(file, dtype=dtype)
+        elif i == 1:
+            table['IDs'] = np.fromfile(file, dtype=dtype)
+
+    return table
+
+
+def write_catalog(database_path, header_hash, tables):
+    """
+    Write the catalog of a database: a single binary file holding all the table
+    headers (LIDs and IDs as arrays), so a database is opened reading just one file.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    header_hash : str
+        Hash of the database header file (the catalog is only valid for it).
+    tables : dict of str: dict
+        Table headers.
+    """
+    arrays = {'hash': np.array(header_hash),
+              'tables': np.array(json.dumps([[name, table['nbytes']] for name, table in tables.items()]))}
+
+    for i, table in enumerate(tables.values()):
+        header = {key: value for key, value in table.items() if
+                  key not in ('LIDs', 'IDs', 'nbytes', 'query_functions', 'query_geometry', 'LIDs_index', 'IDs_index')}
+        arrays[f'header{i}'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+        arrays[f'LIDs{i}'] = np.asarray(table['LIDs'])
+        arrays[f'IDs{i}'] = np.asarray(table['IDs'])
+
+    catalog_file = os.path.join(database_path, CATALOG_FILE)
+    temp_file = f'{catalog_file}.{os.getpid()}.tmp'
+
+    with open(temp_file, 'wb') as f:
+        np.savez(f, **arrays)
+
+    os.replace(temp_file, catalog_file)
+
+
+def get_catalog(database_path, header_hash):
+    """
+    Get the contents of the catalog of a database.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    header_hash : str
+        Hash of the database header file.
+
+    Returns
+    -------
+    dict of str: (int, int)
+        Index and total size of the files (in bytes) of each table. None if there is
+        no catalog or it does not match the database header.
+    """
+
+    try:
+
+        with np.load(os.path.join(database_path, CATALOG_FILE)) as catalog:
+
+            if str(catalog['hash']) != header_hash:
+                return None
+
+            return {name: (i, nbytes) for i, (name, nbytes) in enumerate(json.loads(str(catalog['tables'])))}
+
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def read_catalog_table(database_path, header_hash, index, nbytes, arrays=True):
+    """
+    Load a table header from the catalog of a database.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    header_hash : str
+        Hash of the database header file.
+    index : int
+        Table index within the catalog.
+    nbytes : int
+        Total size of the table files (in bytes).
+    arrays : bool, optional
+        Whether to load LIDs and IDs or not.
+
+    Returns
+    -------
+    dict
+        Table header. None if the catalog does not match the database header (anymore).
+    """
+
+    try:
+
+        with np.load(os.path.join(database_path, CATALOG_FILE)) as catalog:
+
+            if str(catalog['hash']) != header_hash:
+                return None
+
+            table = json.loads(catalog[f'header{index}'].tobytes())
+            table['nbytes'] = nbytes
+
+            if arrays:
+                table['LIDs'] = catalog[f'LIDs{index}']
+                table['IDs'] = catalog[f'IDs{index}']
+
+            return table
+
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def get_check_cursor(database_path):
+    """
+    Get the number of chunks already checked of each field file (see `Database.check`).
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+
+    Returns
+    -------
+    dict of str: int
+        Number of chunks already checked of each field file ('{table}/{field}.bin').
+    """
+
+    try:
+
+        with open(os.path.join(database_path, CHECK_FILE)) as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return dict()
+
+
+def write_check_cursor(database_path, cursor):
+    """
+    Write the number of chunks already checked of each field file.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    cursor : dict of str: int
+        Number of chunks already checked of each field file ('{table}/{field}.bin').
+    """
+    check_file = os.path.join(database_path, CHECK_FILE)
+    temp_file = f'{check_file}.{os.getpid()}.tmp'
+
+    with open(temp_file, 'w') as f:
+        json.dump(cursor, f)
+
+    os.replace(temp_file, check_file)
+
+
+def create_database(database_path, overwrite=False, hash_function='sha256', compression=None, shuffle=True,
+                    quantization=None):
     """
     Create a new database from .pch files.
 
@@ -226,10 +538,52 @@ def create_database(database_path, overwrite=False):
         Database path.
     overwrite : bool, optional
         Whether to rewrite or not an already existing database.
+    hash_function : {'sha256', 'blake2b', 'sha1', 'md5'}, optional
+        Hash function used for integrity checks ('blake2b' is faster).
+    compression : {None, 'lz4', 'zstd'}, optional
+        Field files compression codec. Compressed field files are smaller (so less data
+        is read from disk) at the cost of some CPU time. By default no compression is used.
+    shuffle : bool, optional
+        Whether to byte-shuffle field values before compressing them (usually a better
+        compression ratio is achieved).
+    quantization : dict of str: str or dict, optional
+        Lossy storage of the float fields of new tables. For each table, either a
+        storage type for all its float fields or a dict with the storage type of
+        each field:
+
+            'f2': float16 (maximum error: 2**-11 of the largest absolute value of each
+                  batch, which is also the relative error of each value unless it is
+                  much smaller than the largest one).
+            'i2': scaled 16-bit integers (maximum error: 1.5e-5 of the largest absolute
+                  value of each batch).
+            'i1': scaled 8-bit integers (maximum error: 3.9e-3 of the largest absolute
+                  value of each batch).
+
+        Maximum errors are recorded in table headers. By default values are stored as parsed.
     """
+
+    if compression:
+
+        if compression not in ('lz4', 'zstd') or not pa.Codec.is_available(compression):
+            raise ValueError(f"Not supported compression: '{compression}'")
+
+        compression = {'codec': compression, 'shuffle': shuffle, 'block_size': BLOCK_SIZE}
+
+    if quantization:
+        tables_specs = get_tables_specs()
+
+        for table, storage in quantization.items(): # Check settings beforehand
+
+            if table not in tables_specs:
+                raise ValueError(f"Not supported table: '{table}'")
+
+            get_table_quantization([(field, tables_specs[table]['dtypes'][field]) for
+                                    field in tables_specs[table]['columns']], storage)
+
     Path(database_path).mkdir(parents=True, exist_ok=overwrite)
     (Path(database_path) / '.attachments').mkdir(exist_ok=overwrite)
-    assembly_database(database_path, dict(), list())
+    assembly_database(database_path, dict(), list(), hash_function=hash_function, compression=compression,
+                      quantization=quantization)
     log.info(f"Database '{os.path.basename(database_path)}' created")
     database = Database(database_path)
     database.load()
@@ -240,7 +594,7 @@ class Database(object):
     Handle a local database.
     """
 
-    def __init__(self, path=None, max_memory=1e9):
+    def __init__(self, path=None, max_memory=1e9, n_workers=None, cache=None, n_read_threads=8):
         """
         Initialize a Database instance.
 
@@ -250,32 +604,99 @@ class Database(object):
             Database path.
         max_memory : int, optional
             Memory limit (in bytes).
+        n_workers : int, optional
+            Number of processes used to parse result files (several files are parsed
+            ahead in parallel, and large .pch files in chunks). By default result files
+            are parsed one after another within the current process. Parser processes
+            require the calling script to be guarded by `if __name__ == '__main__':` on
+            platforms spawning processes (i.e. Windows).
+        cache : ResultsCache, optional
+            Parsed results cache (result files already parsed are not parsed again).
+        n_read_threads : int, optional
+            Number of threads used to read the fields of a query concurrently. If 1,
+            fields are read one after another.
         """
         self.path = path
         self.max_memory = int(max_memory)
+        self.n_workers = n_workers
+        self.n_read_threads = n_read_threads
+        self.cache = cache
+        self._tables_specs = None
         self.load()
 
     def load(self):
         """
-        Load the database.
+        Load the database (rolling back any unfinished batch first).
         """
 
         if self.path:
+            journal = get_journal(self.path)
+
+            if journal:
+
+                if journal['host'] == socket.gethostname() and journal['pid'] == os.getpid():
+                    running = os.path.realpath(self.path) in _running_batches # i.e. another Database instance
+                else:
+                    running = is_running(journal['host'], journal['pid'])
+
+                if running:
+                    log.warning(f"WARNING: Batch '{journal['batch']}' is still running!")
+                else: # Left behind by a killed process
+                    rollback_journal(self.path)
+                    journal = None
+
             # Load database header
             self.header = DatabaseHeader(self.path)
 
-            # Load tables
-            self.tables = dict()
+            if self.header._catalog is None and not journal: # Catalog outdated (not while a batch is running)
 
-            for name, header in self.header.tables.items():
-                fields = [(field_name, dtype, os.path.join(self.path, name, field_name + '.bin')) for
-                          field_name, dtype in header['columns'][2:]]
-                self.tables[name] = TableData(fields, header['LIDs'], header['IDs'])
+                try:
+                    self.header.write_catalog()
+                except OSError as e: # i.e. read-only database
+                    log.debug(f'Catalog not written: {e}')
+
+            # Load tables (on first access)
+            self.tables = LazyDict(self.header.tables, self._load_table)
+
+    def _load_table(self, name):
+        """
+        Load a table.
+
+        Parameters
+        ----------
+        name : str
+            Table name.
 
-    def check(self):
+        Returns
+        -------
+        TableData
+            Table data.
+        """
+        header = self.header.tables[name]
+        fields = [(field_name, dtype, os.path.join(self.path, name, field_name + '.bin')) for
+                  field_name, dtype in header['columns'][2:]]
+        return TableData(fields, header['LIDs'], header['IDs'],
+                         [n_LIDs for _, n_LIDs, _ in header['batches']],
+                         header.get('compression'), header.get('index'),
+                         header.get('quantization'))
+
+    def check(self, tables=None, max_nbytes=None):
         """
         Check database integrity.
 
+        Field files are checked chunk by chunk. If `max_nbytes` is provided, the check
+        is incremental: each call resumes where the previous one stopped (so successive
+        calls end up checking the whole database, even from different processes). The
+        number of chunks already checked of each field file is kept in the database
+        directory, so calls checking different tables do not interfere.
+
+        Parameters
+        ----------
+        tables : list of str, optional
+            Tables to be checked. By default all tables (and attachments) are checked.
+        max_nbytes : int, optional
+            Maximum number of bytes of field files to be read.
+
         Returns
         -------
         list of str
@@ -283,35 +704,76 @@ class Database(object):
         """
         log.info('Checking database integrity...')
         files_corrupted = list()
+        files = list()
+        chunks = list()
 
         # Check tables integrity
-        for name, header in self.header.tables.items():
+        for name in (self.header.tables if tables is None else tables):
+            header = self.header.tables[name]
+            chunk_size = header['chunks']['size']
 
-            # Check table fields integrity
-            for filename, hash in header['batches'][-1][2].items():
+            # Check table fields integrity (chunk hashes must match the Merkle roots)
+            for filename, merkle_root in header['batches'][-1][2].items():
                 field_file = os.path.join(self.path, name, filename)
+                size, chunk_hashes = header['chunks']['files'][filename]
 
-                with open(field_file, 'rb') as f:
+                if (merkle_root != get_merkle_root(chunk_hashes, self.header.hash_function) or
+                    size != os.path.getsize(field_file)):
+                    files_corrupted.append(field_file)
+                    continue
 
-                    if hash != hash_bytestr(f, get_hasher(self.header.hash_function)):
-                        files_corrupted.append(field_file)
+                for i, chunk_hash in enumerate(chunk_hashes):
+                    offset = i * chunk_size
+                    chunks.append((field_file, offset, min(chunk_size, size - offset), chunk_hash,
+                                   f'{name}/{filename}', i))
 
             # Check table header integrity
             header_file = os.path.join(self.path, name, '#header.json')
+            files.append((header_file, 0, None, self.header.table_hashes[header['name']]))
+
+        # Check field files chunks
+        if max_nbytes is not None: # Resume previous check
+            cursor = get_check_cursor(self.path)
+            pending = [chunk for chunk in chunks if chunk[5] >= cursor.get(chunk[4], 0)]
+
+            if not pending: # Every chunk already checked (start over)
+                cursor.update({key: 0 for _, _, _, _, key, _ in chunks})
+                pending = chunks
+
+            chunks = list()
+            nbytes = 0
 
-            with open(header_file, 'rb') as f:
+            for chunk in pending:
+                _, _, chunk_size, _, key, i = chunk
+                nbytes += chunk_size
 
-                if self.header.table_hashes[header['name']] != hash_bytestr(f, get_hasher(self.header.hash_function)):
-                    files_corrupted.append(header_file)
+                if nbytes > max_nbytes and chunks:
+                    break
+
+                chunks.append(chunk)
+                cursor[key] = i + 1
+
+            try:
+                write_check_cursor(self.path, cursor)
+            except OSError as e: # i.e. read-only database
+                log.debug(f'Check cursor not written: {e}')
+
+        chunks = [(file, offset, size, hash) for file, offset, size, hash, _, _ in chunks]
 
         # Check attachments
-        for attachment in self.header.attachments:
-            attachment_file = os.path.join(self.path, '.attachments', attachment)
+        if tables is None:
+            files += [(os.path.join(self.path, '.attachments', attachment), 0, None, hash) for
+                      attachment, (hash, _) in self.header.attachments.items()]
 
-            with open(attachment_file, 'rb') as f:
+        # Hash all files at once
+        files += chunks
+        hashes = hash_files([(file, offset, size) for file, offset, size, _ in files],
+                            self.header.hash_function, progress=True)
 
-                if self.header.attachments[attachment][0] != hash_bytestr(f, get_hasher(self.header.hash_function)):
-                    files_corrupted.append(attachment_file)
+        for (file, _, _, hash), hash_calculated in zip(files, hashes):
+
+            if hash != hash_calculated and file not in files_corrupted:
+                files_corrupted.append(file)
 
         # Summary
         if files_corrupted:
@@ -331,37 +793,55 @@ class Database(object):
         Close tables.
         """
 
-        for table in self.tables.values():
+        for table in self.tables.loaded().values():
             table.close()
 
-    def _get_tables_specs(self):
+    def _get_tables_specs(self, tables=None):
         """
-        Get tables specifications.
+        Get tables specifications (built only once for each database header and set of
+        registered tables specifications).
+
+        Parameters
+        ----------
+        tables : list of str, optional
+            Tables needed. By default all supported tables are included.
 
         Returns
         -------
         dict
             Tables specifications.
         """
-        tables_specs = get_tables_specs()
+        key = (self.header._hash, get_registry_version())
 
-        for name, header in self.header.tables.items():
-            tables_specs[name]['columns'] = [field for field, _ in header['columns']]
-            tables_specs[name]['dtypes'] = {field: dtype for field, dtype in header['columns']}
-            tables_specs[name]['pch_format'] = [[(field, tables_specs[name]['dtypes'][field] if
-                                                  field in tables_specs[name]['dtypes'] else
-                                                  dtype) for field, dtype in row] for row in
-                                                tables_specs[name]['pch_format']]
+        if self._tables_specs is None or self._tables_specs[0] != key:
+            tables_specs = get_tables_specs()
+
+            for name in self.header.tables:
+                columns, quantization = self.header.get_table_columns(name) # Quantized fields are parsed as usual
+                tables_specs[name]['columns'] = [field for field, _ in columns]
+                tables_specs[name]['dtypes'] = {field: quantization[field]['dtype'] if field in quantization else
+                                                dtype for field, dtype in columns}
+                tables_specs[name]['pch_format'] = [[(field, tables_specs[name]['dtypes'][field] if
+                                                      field in tables_specs[name]['dtypes'] else
+                                                      dtype) for field, dtype in row] for row in
+                                                    tables_specs[name]['pch_format']]
+
+            self._tables_specs = (key, tables_specs)
+
+        tables_specs = self._tables_specs[1]
 
-        return tables_specs
+        if tables is not None:
+            tables_specs = {name: tables_specs[name] for name in tables if name in tables_specs}
 
+        return copy.deepcopy(tables_specs)
 
     def _write_header(self):
         """
         Write database header file.
         """
         create_database_header(self.path, self.header.tables, self.header.batches, self.header.hash_function,
-                               self.header.attachments, self.header.table_hashes)
+                               self.header.attachments, self.header.table_hashes, self.header.compression,
+                               self.header.quantization)
 
     def add_attachment(self, file, copy=True):
         """
@@ -430,46 +910,138 @@ class Database(object):
                         os.path.join(path))
         log.info(f"Attachment '{name}' downloaded")
 
-    def new_batch(self, files, batch_name, comment='', table_generator=None):
+    def new_batch(self, files, batch_name, comment='', table_generator=None, callback=None, metrics=None):
         """
         Append new batch to database. This operation is reversible.
 
         Parameters
         ----------
         files : list of str
-            List of .pch files.
+            List of result files (.pch or .op2).
         batch_name : str
             Batch name.
         comment : str
             Batch comment.
         table_generator : generator, optional
             A generator which yields tables.
+        callback : callable, optional
+            Function called with each progress event (see `BatchMetrics`).
+        metrics : BatchMetrics, optional
+            Ingestion metrics to be filled in (i.e. already shared with `table_generator`).
+            If provided, `callback` is ignored.
+
+        Returns
+        -------
+        BatchMetrics
+            Ingestion metrics.
         """
 
+        if metrics is None:
+            metrics = BatchMetrics(callback)
+
         if batch_name in {batch[0] for batch in self.header.batches}:
             raise ValueError(f"'{batch_name}' already exists!")
 
         self._close()
-
-        for header in self.header.tables.values():
-            header['path'] = os.path.join(self.path, header['name'])
-            header['IDs'] = np.array(header['IDs'], dtype=header['columns'][1][1])
-            open_table(header, new_table=False)
+        tables_specs = self._get_tables_specs()
+        write_journal(self.path, batch_name, [name for name in tables_specs if name not in self.header.tables])
+        _running_batches.add(os.path.realpath(self.path))
 
         try:
-            create_tables(self.path, files, self.header.tables, self._get_tables_specs(),
-                          table_generator=table_generator)
-        except Exception as e: # Restore database if something unexpected happens
+
+            for header in self.header.tables.values():
+                header['path'] = os.path.join(self.path, header['name'])
+                header['LIDs'] = np.asarray(header['LIDs']).tolist()
+                header['IDs'] = np.array(header['IDs'], dtype=header['columns'][1][1])
+                open_table(header, new_table=False)
+
+            with metrics.phase('tables'):
+                create_tables(self.path, files, self.header.tables, tables_specs, table_generator=table_generator,
+                              n_workers=self.n_workers, cache=self.cache, metrics=metrics,
+                              compression=self.header.compression, quantization=self.header.quantization)
+
+            log.info('Assembling database...')
+            self.header.batches.append([batch_name, None, None, [os.path.basename(file) for file in files], comment])
+            assembly_database(self.path, self.header.tables, self.header.batches, self.max_memory,
+                              self.header.hash_function, self.header.attachments, metrics, self.header.compression,
+                              self.header.quantization)
+        except BaseException: # Roll back database if something unexpected happens (interruptions included)
+            rollback_journal(self.path)
+            raise
+        else:
+            remove_journal(self.path)
+        finally:
+            _running_batches.discard(os.path.realpath(self.path))
             self.load()
-            self.restore(self.header.batches[-1][0])
-            raise e
 
-        log.info('Assembling database...')
-        self.header.batches.append([batch_name, None, None, [os.path.basename(file) for file in files], comment])
-        assembly_database(self.path, self.header.tables, self.header.batches,
-                          self.max_memory, self.header.hash_function, self.header.attachments)
-        self.load()
         log.info(f"Batch '{batch_name}' created")
+        metrics.done()
+        return metrics
+
+    def new_batch_from_arrays(self, tables, batch_name, comment='', callback=None):
+        """
+        Append new batch to database from arrays (no result files involved).
+        This operation is reversible.
+
+        Parameters
+        ----------
+        tables : dict of str: dict, pyarrow.Table or pandas.DataFrame
+            Values of each table (see `tables_in_arrays`).
+        batch_name : str
+            Batch name.
+        comment : str
+            Batch comment.
+        callback : callable, optional
+            Function called with each progress event (see `BatchMetrics`).
+
+        Returns
+        -------
+        BatchMetrics
+            Ingestion metrics.
+        """
+        return self.new_batch(list(), batch_name, comment,
+                              table_generator=tables_in_arrays(tables, self._get_tables_specs(
+                                  list(tables) if isinstance(tables, dict) else None)),
+                              callback=callback)
+
+    def watch(self, path, batch_name, comment='', pattern='*.pch', poll_interval=1.0,
+              idle_timeout=60.0, stop_file=None, callback=None):
+        """
+        Append new batch to database while its .pch files are still being written
+        (the batch is committed once the run is finished). This operation is reversible.
+
+        Parameters
+        ----------
+        path : str
+            .pch file or drop directory path (see `watch_tables`).
+        batch_name : str
+            Batch name.
+        comment : str
+            Batch comment.
+        pattern : str, optional
+            File name pattern (only for drop directories).
+        poll_interval : float, optional
+            Time (in seconds) between checks for new data.
+        idle_timeout : float, optional
+            Time (in seconds) without new data after which a file (or the run, once no
+            file is pending) is considered finished (not counted until a file is found).
+        stop_file : str, optional
+            File created once the run is finished (if provided, `idle_timeout` is ignored).
+        callback : callable, optional
+            Function called with each progress event (see `BatchMetrics`).
+
+        Returns
+        -------
+        BatchMetrics
+            Ingestion metrics.
+        """
+        files = list() # Filled in as files are found
+        metrics = BatchMetrics(callback)
+        return self.new_batch(files, batch_name, comment,
+                              table_generator=watch_tables(path, self._get_tables_specs(), files, pattern,
+                                                           poll_interval, idle_timeout, stop_file,
+                                                           metrics=metrics),
+                              metrics=metrics)
 
     def restore(self, batch_name):
         """
@@ -501,9 +1073,17 @@ class Database(object):
                 truncate_file(os.path.join(self.path, name, 'LID.bin'),
                               position * np.dtype(header['columns'][0][1]).itemsize)
 
+                if header.get('compression'):
+
+                    for field in header['index']:
+                        header['index'][field] = header['index'][field][:index + 1]
+
+                for quantization in header.get('quantization', dict()).values():
+                    quantization['scales'] = quantization['scales'][:index + 1]
+
                 for field, dtype in header['columns'][2:]:
                     truncate_file(os.path.join(self.path, name, field + '.bin'),
-                                  position * np.dtype(dtype).itemsize * len(header['IDs']))
+                                  get_segments_end(header, field, dtype))
 
                 header['path'] = os.path.join(self.path, name)
 
@@ -514,7 +1094,8 @@ class Database(object):
         batch_hash_old = self.header.batches[batch_index][1]
         assembly_database(self.path, {name: self.header.tables[name] for name in self.tables},
                           self.header.batches[:batch_index + 1], self.max_memory,
-                          self.header.hash_function, self.header.attachments)
+                          self.header.hash_function, self.header.attachments,
+                          compression=self.header.compression, quantization=self.header.quantization)
         self.load()
 
         if self.header.batches[-1][1] != batch_hash_old:
@@ -562,7 +1143,8 @@ class Database(object):
         Returns
         -------
         pyarrow.RecordBatch
-            Data queried.
+            Data queried. The layout read for each segment of each field ('LID' or 'ID')
+            is included in its metadata (b'layouts' key) for diagnostics.
         """
         from loadit.queries import query_functions
         log.info('Processing query...')
@@ -589,9 +1171,8 @@ class Database(object):
         # Group data pre-processing
         if groups:
             IDs = sorted({ID for IDs in groups.values() for ID in IDs})
-            iIDs = {ID: i for i, ID in enumerate(IDs)}
-            indexes_by_group = {group: np.array([iIDs[ID] for ID in group_IDs], dtype=np.int64) for
-                                group, group_IDs in groups.items()}
+            iIDs = ArrayIndex(IDs, dtype=np.int64)
+            indexes_by_group = {group: iIDs.get_positions(group_IDs) for group, group_IDs in groups.items()}
 
             if weights:
                 weights_by_group = {group: np.array([weights[ID] for ID in group_IDs], dtype=np.int64) for
@@ -630,6 +1211,8 @@ class Database(object):
                                     len(LIDs2read) + len(LIDs_combined_used) if LID_combinations else None)
 
         # Process batches
+        layouts = dict() # Layout read for each field segment (for diagnostics)
+
         for batch_index, batch_slice in enumerate(mem_handler.batches):
             # Process batch information
             read_fields = True
@@ -658,6 +1241,16 @@ class Database(object):
             else:
                 LIDs_queried_batch = np.array(LIDs_queried, dtype=np.int64)
 
+            # Read all basic fields at once
+            if read_fields and self.n_read_threads > 1:
+                basic_fields = get_basic_fields([field for field, level in mem_handler.field_seq if level == 0],
+                                                self.tables[table], query_functions, geometry)
+
+                if len(basic_fields) > 1:
+                    read_fields_concurrently(basic_fields, self.tables[table], mem_handler, batch_index,
+                                             LIDs2read_batch, IDs, self.n_read_threads, layouts)
+                    read_fields = False
+
             # Process fields
             fields_processed = set()
 
@@ -669,7 +1262,7 @@ class Database(object):
                         basic_field, is_absolute = is_abs(field)
                         process_field(field, basic_field, self.tables[table], query_functions, geometry,
                                       mem_handler, fields_processed, read_fields,
-                                      batch_index, LIDs2read_batch, IDs ,LID_combinations_batch)
+                                      batch_index, LIDs2read_batch, IDs ,LID_combinations_batch, layouts)
                     else: # Field aggregation
                         aggregation, is_absolute = is_abs(field.split('-')[-1])
                         array = mem_handler.get('-'.join(field.split('-')[:-1]), batch_index)
@@ -718,20 +1311,122 @@ class Database(object):
             data = {field: mem_handler.get(field).ravel() for field in columns}
             arrays = [pa.array(data[field]) for field in data]
 
+        log.debug(f'Layouts read: {layouts}')
         log.info('Done!')
         query = {'table': table, 'fields': fields, 'LIDs': LIDs, 'IDs': IDs, 'groups': groups,
                  'geometry':geometry, 'sort_by_LID': sort_by_LID, 'double_precision': double_precision}
         return pa.RecordBatch.from_arrays(arrays, columns,
                                           metadata={b'index_names': json.dumps(index_names).encode(),
-                                                    b'index': json.dumps(index).encode(),
+                                                    b'index': json.dumps([np.asarray(labels).tolist() for
+                                                                          labels in index]).encode(),
                                                     b'sorted_by': b'0' if sort_by_LID else b'1',
                                                     b'header': json.dumps(self.header.get_query_header()).encode(),
-                                                    b'query': zlib.compress(json.dumps(query).encode())})
+                                                    b'query': zlib.compress(json.dumps(query).encode()),
+                                                    b'layouts': json.dumps(layouts).encode()})
+
+
+def get_basic_fields(fields, table, query_functions, geometry):
+    """
+    Get the basic fields needed by a query (i.e. stored in the table).
+
+    Parameters
+    ----------
+    fields : list of str
+        Requested fields (not aggregated).
+    table : TableData
+        Table.
+    query_functions : dict
+        Derived fields of the table.
+    geometry : dict
+        Geometric parameters.
+
+    Returns
+    -------
+    list of str
+        Basic fields.
+    """
+    basic_fields = dict() # Keeping request order
+
+    def add_field(field):
+
+        if field in basic_fields or geometry and field in geometry:
+            return
+
+        if field in table:
+            basic_fields[field] = None
+        elif query_functions and field in query_functions: # Derived field
+
+            for arg in query_functions[field][1]:
+                add_field(arg)
+
+    for field in fields:
+        add_field(is_abs(field)[0])
+
+    return list(basic_fields)
+
+
+def read_fields_concurrently(fields, table, mem_handler, batch_index, LIDs, IDs, n_threads, layouts):
+    """
+    Read several basic fields concurrently (field files are independent, and
+    reading mapped files releases the GIL most of the time).
+
+    Parameters
+    ----------
+    fields : list of str
+        Basic fields.
+    table : TableData
+        Table.
+    mem_handler : MemoryHandler
+        Query memory handler.
+    batch_index : int
+        Memory batch index.
+    LIDs : list of int
+        Requested LIDs (None for all of them).
+    IDs : list of int
+        Requested IDs (None for all of them).
+    n_threads : int
+        Maximum number of threads.
+    layouts : dict of str: list of str
+        Layout read for each segment of each field (updated in place).
+    """
+
+    for field in fields:
+
+        if field not in mem_handler:
+            mem_handler.add(field)
+
+    with ThreadPoolExecutor(min(n_threads, len(fields))) as executor:
+        futures = [(field, executor.submit(table[field].read, mem_handler.get(field, batch_index, True), LIDs, IDs)) for
+                   field in fields]
+
+        for field, future in futures:
+            add_layouts(layouts, field, future.result())
+
+
+def add_layouts(layouts, field, field_layouts):
+    """
+    Account for the layouts read of a field (see `FieldData.read`).
+
+    Parameters
+    ----------
+    layouts : dict of str: list of str
+        Layout read for each segment of each field.
+    field : str
+        Field name.
+    field_layouts : list of str
+        Layout read for each segment ('LID', 'ID' or None if not read).
+    """
+
+    if field in layouts:
+        field_layouts = [layout or previous_layout for layout, previous_layout in
+                         zip(field_layouts, layouts[field])]
+
+    layouts[field] = field_layouts
 
 
 def process_field(field, basic_field, table, query_functions, geometry,
                   mem_handler, fields_processed, read_fields,
-                  batch_index, LIDs2read_batch, IDs ,LID_combinations_batch):
+                  batch_index, LIDs2read_batch, IDs ,LID_combinations_batch, layouts):
 
     if basic_field not in fields_processed:
 
@@ -741,7 +1436,9 @@ def process_field(field, basic_field, table, query_functions, geometry,
         if basic_field in table: # Basic field
 
             if read_fields:
-                table[basic_field].read(mem_handler.get(basic_field, batch_index, True), LIDs2read_batch, IDs)
+                add_layouts(layouts, basic_field,
+                            table[basic_field].read(mem_handler.get(basic_field, batch_index, True),
+                                                    LIDs2read_batch, IDs))
 
             if LID_combinations_batch:
                 combine_load_cases(mem_handler.get(basic_field, batch_index, True),
@@ -765,7 +1462,8 @@ def process_field(field, basic_field, table, query_functions, geometry,
                         if arg in table: # Basic field
 
                             if read_fields:
-                                table[arg].read(mem_handler.get(arg, batch_index, True), LIDs2read_batch, IDs)
+                                add_layouts(layouts, arg, table[arg].read(mem_handler.get(arg, batch_index, True),
+                                                                          LIDs2read_batch, IDs))
 
                             if LID_combinations_batch:
                                 combine_load_cases(mem_handler.get(arg, batch_index, True),
@@ -773,7 +1471,7 @@ def process_field(field, basic_field, table, query_functions, geometry,
                         else: # Derived field
                             process_field(arg, arg, table, query_functions, geometry,
                                           mem_handler, fields_processed, read_fields,
-                                          batch_index, LIDs2read_batch, IDs ,LID_combinations_batch)
+                                          batch_index, LIDs2read_batch, IDs ,LID_combinations_batch, layouts)
 
                         fields_processed.add(arg)
 
@@ -1167,6 +1865,43 @@ def write_query(record_batch, output_file):
     log.info('Done!')
 
 
+def is_running(host, pid):
+    """
+    Check whether a process is still running or not.
+
+    Processes of other hosts are assumed to be running. Processes of the current
+    host are assumed not to be running in platforms where this cannot be checked.
+
+    Parameters
+    ----------
+    host : str
+        Host name.
+    pid : int
+        Process ID.
+
+    Returns
+    -------
+    bool
+        Whether the process is running or not.
+    """
+
+    if host != socket.gethostname():
+        return True
+    elif pid == os.getpid():
+        return True
+    elif os.name != 'posix':
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
 def truncate_file(file, offset):
 
     with open(file, 'rb+') as f:
@@ -1250,17 +1985,19 @@ def parse_query(query, parse_files=False):
 
 
 def check_query(query, database_header):
-    assertions = {name: {'fields': {field for field, _ in table['columns'][2:]},
-                         'query_functions': set(table['query_functions']),
-                         'query_geometry': {'weigths'} | set(table['query_geometry']),
-                         'LIDs': set(table['LIDs']),
-                         'IDs': set(table['IDs'])} for name, table in
-                  database_header.tables.items()}
 
     # table checking
-    if query['table'] not in assertions:
+    if query['table'] not in database_header.tables:
         raise ValueError('Invalid table: {}'.format(query['table']))
 
+    table = database_header.tables[query['table']] # Only the table queried is loaded
+    LIDs_index, IDs_index = database_header.get_table_indexes(query['table'])
+    assertions = {query['table']: {'fields': {field for field, _ in table['columns'][2:]},
+                                   'query_functions': set(table['query_functions']),
+                                   'query_geometry': {'weigths'} | set(table['query_geometry']),
+                                   'LIDs': LIDs_index,
+                                   'IDs': IDs_index}}
+
     # fields checking
     if query['fields']:
         check_aggregation_options(query['fields'], query['groups'])
@@ -1299,7 +2036,7 @@ def check_query(query, database_header):
                 raise ValueError(f'Missing LID: {new_LID}')
 
     elif query['LIDs']:
-        missing_LIDs = {str(LID) for LID in query['LIDs'] if LID not in assertions[query['table']]['LIDs']}
+        missing_LIDs = {str(LID) for LID in assertions[query['table']]['LIDs'].missing(list(query['LIDs']))}
 
         if missing_LIDs:
             raise ValueError('Missing {}/s: {}'.format(database_header.tables[query['table']]['columns'][0][0],
@@ -1317,13 +2054,13 @@ def check_query(query, database_header):
         IDs2read = query['IDs']
 
     if IDs2read:
-        missing_IDs = {str(ID) for ID in IDs2read if ID not in assertions[query['table']]['IDs']}
+        missing_IDs = {str(ID) for ID in assertions[query['table']]['IDs'].missing(list(IDs2read))}
 
         if missing_IDs:
             raise ValueError('Missing {}/s: {}'.format(database_header.tables[query['table']]['columns'][1][0],
                                                        ', '.join(missing_IDs)))
     else:
-        IDs2read = assertions[query['table']]['IDs']
+        IDs2read = np.asarray(table['IDs']).tolist()
 
     # geometry checking
     if query['geometry']:
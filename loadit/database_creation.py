@@ -1,33 +1,69 @@
 import os
 import json
+import time
+import shutil
+import socket
 import datetime
 import numpy as np
-from loadit.read_results import tables_in_pch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from multiprocessing import Process, Queue, cpu_count
+from loadit.read_results import tables_in_file
 from loadit.tables_specs import get_tables_specs
-from loadit.misc import get_hasher, hash_bytestr, humansize
+from loadit.metrics import BatchMetrics
+from loadit.array_index import ArrayIndex
+from loadit.field_data import (get_rows_per_block, compress_block, get_quantization_scale, quantize,
+                               QUANTIZATION_ERRORS)
+from loadit.misc import get_hasher, hash_chunks, hash_files, get_merkle_root, humansize
 import logging
 
 
 log = logging.getLogger()
 
+# Field files are hashed in chunks of this size (in bytes)
+CHUNK_SIZE = 2**26
 
-def create_tables(database_path, files, headers, tables_specs=None,
-                  table_generator=None):
+# Compressed field files are split into blocks of about this size (in bytes, before compression)
+BLOCK_SIZE = 2**20
+
+# Write-ahead journal of the batch being created (see `write_journal`)
+JOURNAL_FILE = '#journal.json'
+
+
+def create_tables(database_path, files, headers, tables_specs=None, table_generator=None,
+                  n_workers=None, queue_size=8, cache=None, metrics=None, compression=None, quantization=None):
 
     if not tables_specs:
         tables_specs = get_tables_specs()
 
+    if not metrics:
+        metrics = BatchMetrics()
+
+    if not n_workers: # Sequential parsing (parser processes only on request)
+        n_workers = 1
+
     if not table_generator:
 
-        def table_generator(files, tables_specs):
+        if n_workers > 1 and len(files) > 1:
+            table_generator = pipelined_table_generator(files, tables_specs, n_workers, queue_size, cache, metrics)
+        else:
+
+            def table_generator(files, tables_specs):
+
+                for i, file in enumerate(files):
+                    log.info(f"Processing file {i + 1} of {len(files)} ({humansize(os.path.getsize(file))}): '{os.path.basename(file)}'...")
+                    metrics.add_file(os.path.basename(file), os.path.getsize(file), i, len(files))
 
-            for i, file in enumerate(files):
-                log.info(f"Processing file {i + 1} of {len(files)} ({humansize(os.path.getsize(file))}): '{os.path.basename(file)}'...")
+                    if cache:
+                        tables = cache.tables(file, tables_specs, n_workers=n_workers)
+                    else:
+                        tables = tables_in_file(file, tables_specs, n_workers=n_workers)
 
-                for table in tables_in_pch(file, tables_specs):
-                    yield table
+                    for table in tables:
+                        yield table
 
-        table_generator = table_generator(files, tables_specs)
+            table_generator = table_generator(files, tables_specs)
 
     ignored_tables = set()
 
@@ -44,18 +80,29 @@ def create_tables(database_path, files, headers, tables_specs=None,
                 continue
 
             if table.name not in headers:
+                columns = [(field, tables_specs[table.name]['dtypes'][field]) for field in
+                           tables_specs[table.name]['columns']]
+                table_quantization = get_table_quantization(columns, (quantization or dict()).get(table.name))
                 headers[table.name] = {
                     'name': table.name,
                     'path': os.path.join(database_path, table.name),
-                    'columns': [(field, tables_specs[table.name]['dtypes'][field]) for field in
-                                tables_specs[table.name]['columns']],
+                    'columns': [(field, table_quantization[field]['storage'] if field in table_quantization else
+                                 dtype) for field, dtype in columns],
                     'batches': list(),
                     'LIDs': list(),
-                    'IDs': None
+                    'IDs': None,
+                    'compression': compression,
+                    'quantization': table_quantization,
                 }
                 open_table(headers[table.name], new_table=True)
 
-            append_to_table(table, headers[table.name])
+            header = headers[table.name]
+            start_time = time.perf_counter()
+
+            if append_to_table(table, header):
+                nbytes = len(header['IDs']) * sum(np.dtype(dtype).itemsize for _, dtype in header['columns'][2:])
+                metrics.add_subcase(table.name, nbytes, time.perf_counter() - start_time)
+
     finally:
 
         for header in headers.values():
@@ -66,6 +113,117 @@ def create_tables(database_path, files, headers, tables_specs=None,
         header['IDs'].tofile(os.path.join(header['path'], header['columns'][1][0] + '.bin'))
 
 
+def pipelined_table_generator(files, tables_specs, n_workers, queue_size=8, cache=None, metrics=None,
+                              poll_interval=1.0):
+    """
+    Parse several files at the same time (one process per file).
+
+    Tables are yielded in the same order as a sequential parsing. Each parser
+    process feeds its own bounded queue, so parsers running ahead of the writer
+    are blocked once `queue_size` tables are waiting (limiting memory usage).
+
+    Parameters
+    ----------
+    files : list of str
+        List of result files (.pch or .op2).
+    tables_specs : dict
+        Tables specifications.
+    n_workers : int
+        Maximum number of parser processes running at the same time.
+    queue_size : int, optional
+        Maximum number of parsed tables waiting to be written (per parser).
+    cache : ResultsCache, optional
+        Parsed results cache.
+    metrics : BatchMetrics, optional
+        Batch metrics.
+    poll_interval : float, optional
+        Time (in seconds) between checks of whether the parser being waited for is
+        still running (an exception is raised if it died without finishing its file).
+
+    Yields
+    ------
+    ResultsTable
+        Table parsed.
+    """
+    parsers = list()
+
+    try:
+
+        for i, file in enumerate(files):
+
+            # Keep up to n_workers parsers running ahead
+            while len(parsers) < min(i + n_workers, len(files)):
+                queue = Queue(queue_size)
+                parser = Process(target=put_tables, args=(files[len(parsers)], tables_specs, queue, cache),
+                                 daemon=True)
+                parser.start()
+                parsers.append((parser, queue))
+
+            log.info(f"Processing file {i + 1} of {len(files)} ({humansize(os.path.getsize(file))}): '{os.path.basename(file)}'...")
+
+            if metrics:
+                metrics.add_file(os.path.basename(file), os.path.getsize(file), i, len(files))
+
+            parser, queue = parsers[i]
+
+            while True:
+
+                try:
+                    table = queue.get(timeout=poll_interval)
+                except Empty:
+
+                    if parser.is_alive():
+                        continue
+
+                    try: # Catch up with tables put before exiting
+                        table = queue.get(timeout=poll_interval)
+                    except Empty:
+                        raise RuntimeError(f"Parser process of '{os.path.basename(file)}' died "
+                                           f"(exit code: {parser.exitcode})") from None
+
+                if table is None: # End of file
+                    break
+                elif isinstance(table, Exception):
+                    raise table
+
+                yield table
+
+            parser.join()
+
+    finally:
+
+        for parser, _ in parsers:
+
+            if parser.is_alive():
+                parser.terminate()
+
+
+def put_tables(file, tables_specs, queue, cache=None):
+    """
+    Parse a file and put its tables into a queue (a None item is put at the end).
+
+    Parameters
+    ----------
+    file : str
+        .pch file.
+    tables_specs : dict
+        Tables specifications.
+    queue : multiprocessing.Queue
+        Output queue.
+    cache : ResultsCache, optional
+        Parsed results cache.
+    """
+
+    try:
+
+        for table in (cache.tables(file, tables_specs) if cache else tables_in_file(file, tables_specs)):
+            queue.put(table)
+
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)
+
+
 def open_table(header, new_table=False):
 
     if not os.path.exists(header['path']):
@@ -78,7 +236,8 @@ def open_table(header, new_table=False):
             f = open(file, 'wb')
         else:
             f = open(file, 'rb+')
-            f.seek(len(header['LIDs']) * len(header['IDs']) * np.dtype(dtype).itemsize)
+            f.seek(get_segments_end(header, field, dtype))
+            f.truncate()
 
         if 'files' not in header:
             header['files'] = dict()
@@ -92,7 +251,10 @@ def append_to_table(table, header):
 
     LID = table.data[LID_label][0]
 
-    if LID in header['LIDs']:
+    if 'LIDs_index' not in header: # LID index (computed only once per table and batch)
+        header['LIDs_index'] = ArrayIndex(header['LIDs'], dtype=header['columns'][0][1])
+
+    if LID in header['LIDs_index']:
         log.warning("WARNING: Subcase already in the database! It will be skipped (LID: {}, table: '{}')".format(LID, header['name']))
         return False
 
@@ -101,32 +263,125 @@ def append_to_table(table, header):
     if header['IDs'] is None:
         header['IDs'] = IDs
 
-    if 'iIDs' not in header:
-        header['iIDs'] = {ID: i for i, ID in enumerate(header['IDs'])}
-
     if np.array_equal(header['IDs'], IDs):
 
         for field, dtype in header['columns'][2:]:
             table.data[field].tofile(header['files'][field])
 
     else:
-        indexes = {header['iIDs'][ID]: i for i, ID in enumerate(IDs) if ID in header['iIDs']}
+        index0, index1 = get_alignment(header, IDs)
+        n_matches = np.count_nonzero(np.bincount(index0, minlength=len(header['IDs'])))
 
-        if len(indexes) < len(header['IDs']) or len(IDs) != len(header['IDs']):
+        if n_matches < len(header['IDs']) or len(IDs) != len(header['IDs']):
             log.warning("WARNING: Inconsistent {}/s (LID: {}, table: '{}')".format(ID_label, LID, header['name']))
 
         for field, dtype in header['columns'][2:]:
-            field_array = np.full(len(header['IDs']), np.nan, dtype=dtype)
-
-            for index0, index1 in indexes.items():
-                field_array[index0] = table.data[field][index1]
-
+            field_array = np.full(len(header['IDs']), np.nan, dtype=table.data[field].dtype) # Quantized afterwards
+            field_array[index0] = table.data[field][index1]
             field_array.tofile(header['files'][field])
 
     header['LIDs'].append(LID)
+    header['LIDs_index'].add([LID])
     return True
 
 
+def get_table_quantization(columns, storage):
+    """
+    Get the quantization settings of a new table.
+
+    Parameters
+    ----------
+    columns : list of (str, str)
+        Table columns (field name and type).
+    storage : str or dict of str: str
+        Storage type ('f2', 'i2' or 'i1') of all the float fields, or of each field.
+
+    Returns
+    -------
+    dict of str: dict
+        Quantization settings of each quantized field: type as parsed ('dtype'),
+        storage type ('storage'), maximum error ('max_error') and scale factor of
+        each segment ('scales').
+    """
+
+    if not storage:
+        return dict()
+
+    if isinstance(storage, str):
+        storage = {field: storage for field, dtype in columns[2:] if np.dtype(dtype).kind == 'f'}
+
+    dtypes = dict(columns[2:])
+    quantization = dict()
+
+    for field, storage_dtype in storage.items():
+        storage_dtype = '<' + storage_dtype
+
+        if field not in dtypes:
+            raise ValueError(f"Unknown field: '{field}'")
+
+        if storage_dtype not in QUANTIZATION_ERRORS or np.dtype(dtypes[field]).kind != 'f':
+            raise ValueError(f"'{field}' cannot be quantized as '{storage_dtype[1:]}'")
+
+        quantization[field] = {'dtype': dtypes[field], 'storage': storage_dtype,
+                               'max_error': QUANTIZATION_ERRORS[storage_dtype], 'scales': list()}
+
+    return quantization
+
+
+def get_alignment(header, IDs):
+    """
+    Match the IDs of a subcase against the table ones.
+
+    Parameters
+    ----------
+    header : dict
+        Table header.
+    IDs : numpy.ndarray
+        Subcase IDs.
+
+    Returns
+    -------
+    numpy.ndarray
+        Table indexes of the matching IDs.
+    numpy.ndarray
+        Subcase indexes of the matching IDs.
+    """
+
+    if 'IDs_index' not in header: # ID index (computed only once per table)
+        header['IDs_index'] = ArrayIndex(header['IDs'])
+
+    positions, found = header['IDs_index'].find(IDs)
+    index1 = np.flatnonzero(found)
+    return positions[index1], index1
+
+
+def get_segments_end(header, field, dtype):
+    """
+    Get the size of a field file up to the end of the last segment committed.
+
+    Parameters
+    ----------
+    header : dict
+        Table header.
+    field : str
+        Field name.
+    dtype : str
+        Field type.
+
+    Returns
+    -------
+    int
+        Position (in bytes) where the segment of a new batch starts.
+    """
+
+    if header.get('compression'):
+        index = header.get('index', dict()).get(field)
+        return index[-1][1][-1] if index else 0
+
+    n_LIDs = header['batches'][-1][1] if header['batches'] else 0
+    return 2 * n_LIDs * len(header['IDs']) * np.dtype(dtype).itemsize # Both layouts
+
+
 def close_table(header):
 
     try:
@@ -141,48 +396,415 @@ def close_table(header):
 
 
 def assembly_database(database_path, headers, batches, max_chunk_size=None,
-                      hash_function='sha256', attachments=None):
+                      hash_function='sha256', attachments=None, metrics=None, compression=None,
+                      quantization=None):
+
+    if not metrics:
+        metrics = BatchMetrics()
+
+    if any(header.get('quantization') for header in headers.values()):
+
+        with metrics.phase('quantize'):
+
+            for name, header in headers.items():
+                quantize_table(header, batches[-1][0], max_chunk_size)
+
+    nbytes = 0
+    start_time = time.perf_counter()
+
+    with metrics.phase('transpose'):
+
+        for name, header in headers.items():
+            nbytes += create_transpose(header, max_chunk_size)
+
+    elapsed_time = time.perf_counter() - start_time
+
+    if nbytes:
+        log.info(f'{humansize(nbytes)} transposed ({nbytes / 1e6 / elapsed_time:.1f} MB/s)')
+
+    if any(header.get('compression') for header in headers.values()):
+
+        with metrics.phase('compress'):
 
-    for name, header in headers.items():
-        create_transpose(header, max_chunk_size)
-        create_table_header(header, batches[-1][0], hash_function)
+            for name, header in headers.items():
+                compress_table(header, batches[-1][0])
 
-    create_database_header(database_path, headers, batches, hash_function, attachments)
+    with metrics.phase('hash'):
 
+        for name, header in headers.items():
+            create_table_header(header, batches[-1][0], hash_function)
 
-def create_transpose(header, max_chunk_size):
+        create_database_header(database_path, headers, batches, hash_function, attachments,
+                               compression=compression, quantization=quantization)
+
+
+def quantize_table(header, batch_name, max_chunk_size=None):
+    """
+    Quantize the segment of the last batch of each quantized field (in place, before
+    being transposed).
+
+    Values are written as parsed (see `append_to_table`), so each segment is read
+    twice: first to get its largest absolute value (which sets its scale factor)
+    and then to quantize it.
+
+    Parameters
+    ----------
+    header : dict
+        Table header.
+    batch_name : str
+        Batch name.
+    max_chunk_size : int, optional
+        Memory limit (in bytes).
+
+    Returns
+    -------
+    int
+        Number of bytes quantized (before quantization).
+    """
+    nbytes = 0
+
+    if not header.get('quantization') or header['batches'] and header['batches'][-1][0] == batch_name:
+        return nbytes
+
+    n_IDs = len(header['IDs'])
+    i_LID0 = header['batches'][-1][1] if header['batches'] else 0
+    n_LIDs = len(header['LIDs']) - i_LID0
+
+    for field, dtype in header['columns'][2:]:
+
+        if field not in header['quantization']:
+            continue
+
+        quantization = header['quantization'][field]
+        scale = 1.0
+
+        if n_LIDs and n_IDs:
+            scale = quantize_segment(os.path.join(header['path'], field + '.bin'),
+                                     get_segments_end(header, field, dtype), (n_LIDs, n_IDs),
+                                     quantization['dtype'], dtype, max_chunk_size)
+            nbytes += n_LIDs * n_IDs * np.dtype(quantization['dtype']).itemsize
+
+        quantization['scales'].append(scale)
+
+    return nbytes
+
+
+def quantize_segment(file, offset, shape, dtype, storage_dtype, max_memory=None):
+    """
+    Quantize an array at the end of a file (in place).
+
+    Parameters
+    ----------
+    file : str
+        File path.
+    offset : int
+        Array position within the file (in bytes).
+    shape : (int, int)
+        Array shape.
+    dtype : str
+        Array type.
+    storage_dtype : str
+        Quantized array type.
+    max_memory : int, optional
+        Memory limit (in bytes). By default 1 GB.
+
+    Returns
+    -------
+    float
+        Scale factor.
+    """
+    n_rows, n_cols = shape
+    itemsize = np.dtype(dtype).itemsize
+    storage_itemsize = np.dtype(storage_dtype).itemsize
+
+    if not max_memory:
+        max_memory = 1e9
+
+    rows_per_block = max(1, int(max_memory // (4 * n_cols * itemsize))) # Allow for temporary arrays
+    blocks = [(row0, min(row0 + rows_per_block, n_rows)) for row0 in range(0, n_rows, rows_per_block)]
+    max_value = 0.0
+
+    with open(file, 'rb+') as f:
+        f.seek(offset)
+
+        for row0, row1 in blocks: # Largest absolute value
+            block = np.empty((row1 - row0, n_cols), dtype)
+            read_into(f, block)
+            block = np.abs(block[np.isfinite(block)])
+
+            if block.size:
+                max_value = max(max_value, float(block.max()))
+
+        scale = get_quantization_scale(max_value, storage_dtype)
+
+        for row0, row1 in blocks: # Stored values only take up the space already read
+            block = np.empty((row1 - row0, n_cols), dtype)
+            f.seek(offset + row0 * n_cols * itemsize)
+            read_into(f, block)
+            f.seek(offset + row0 * n_cols * storage_itemsize)
+            f.write(quantize(block, scale, storage_dtype).tobytes())
+
+        f.truncate(offset + n_rows * n_cols * storage_itemsize)
+
+    return scale
+
+
+def create_transpose(header, max_chunk_size, n_threads=None):
+    """
+    Append the ID-ordered segment of the last batch to each field file.
+
+    Field files are a sequence of segments (one for each batch). Each segment is
+    stored first LID-ordered and then ID-ordered, so only the LIDs added since the
+    previous batch are transposed.
+
+    Parameters
+    ----------
+    header : dict
+        Table header.
+    max_chunk_size : int
+        Memory limit (in bytes).
+    n_threads : int, optional
+        Number of threads (see `transpose`).
+
+    Returns
+    -------
+    int
+        Number of bytes transposed.
+    """
+    n_IDs = len(header['IDs'])
+    i_LID0 = header['batches'][-1][1] if header['batches'] else 0
+    n_LIDs = len(header['LIDs']) - i_LID0
+    nbytes = 0
+
+    if not n_LIDs or not n_IDs:
+        return nbytes
 
     for field, dtype in header['columns'][2:]:
         field_file = os.path.join(header['path'], field + '.bin')
-        n_LIDs = len(header['LIDs'])
-        n_IDs = len(header['IDs'])
-        field_array = np.memmap(field_file, dtype=dtype, shape=(n_LIDs, n_IDs), mode='r')
-        n_IDs_per_chunk = int(max_chunk_size // (n_LIDs * np.dtype(dtype).itemsize))
-        n_chunks = int(n_IDs // n_IDs_per_chunk)
-        n_IDs_last_chunk = int(n_IDs % n_IDs_per_chunk)
-
-        if n_IDs != n_IDs_per_chunk * n_chunks + n_IDs_last_chunk:
+        itemsize = np.dtype(dtype).itemsize
+        offset = get_segments_end(header, field, dtype)
+
+        if os.path.getsize(field_file) != offset + n_LIDs * n_IDs * itemsize:
             raise ValueError(f"Inconsistency found! (table: '{header['name']}', field: '{field}')")
 
-        chunks = list()
+        transpose(field_file, offset, (n_LIDs, n_IDs), dtype, max_chunk_size, n_threads)
+        nbytes += n_LIDs * n_IDs * itemsize
+
+    return nbytes
+
+
+def transpose(file, offset, shape, dtype, max_memory=None, n_threads=None, tile_size=512):
+    """
+    Append to a file the transpose of an array stored within it (out-of-core).
+
+    The array is split into column bands. Each band is read (one contiguous run
+    for each row, or a single run if the band spans all the columns), transposed
+    tile by tile (so each tile fits in cache) and written sequentially. Bands are
+    read and transposed by a pool of threads while the previous ones are being
+    written.
+
+    Parameters
+    ----------
+    file : str
+        File path.
+    offset : int
+        Array position within the file (in bytes).
+    shape : (int, int)
+        Array shape.
+    dtype : str
+        Array type.
+    max_memory : int, optional
+        Memory limit (in bytes) for all the bands in flight. By default 1 GB.
+    n_threads : int, optional
+        Number of threads. By default up to 4 (depending on the number of CPUs).
+    tile_size : int, optional
+        Tile size (in rows and columns).
+
+    Returns
+    -------
+    float
+        Throughput achieved (in MB/s).
+    """
+    start_time = time.perf_counter()
+    n_rows, n_cols = shape
+    itemsize = np.dtype(dtype).itemsize
+
+    if not max_memory:
+        max_memory = 1e9
+
+    if not n_threads:
+        n_threads = min(4, cpu_count())
+
+    # Each band in flight takes twice its size (before and after being transposed)
+    n_cols_per_band = int(max_memory // (2 * (n_threads + 1) * n_rows * itemsize))
+    n_cols_per_band = min(n_cols_per_band, max(2**20 // itemsize, -(-n_cols // (2 * n_threads))))
+    n_cols_per_band = max(1, min(n_cols_per_band, n_cols))
+
+    def transpose_band(col0, col1):
+        band = np.empty((n_rows, col1 - col0), dtype)
+
+        with open(file, 'rb', buffering=0) as f:
+
+            if col1 - col0 == n_cols: # Single contiguous read
+                f.seek(offset)
+                read_into(f, band)
+            else:
+
+                for i in range(n_rows):
+                    f.seek(offset + (i * n_cols + col0) * itemsize)
+                    read_into(f, band[i])
+
+        band_T = np.empty((col1 - col0, n_rows), dtype)
+
+        for i in range(0, n_rows, tile_size):
+
+            for j in range(0, col1 - col0, tile_size):
+                band_T[j:j + tile_size, i:i + tile_size] = band[i:i + tile_size, j:j + tile_size].T
+
+        return band_T
+
+    with ThreadPoolExecutor(n_threads) as executor, open(file, 'ab') as f:
+        bands = deque()
+
+        for col0 in range(0, n_cols, n_cols_per_band):
+            bands.append(executor.submit(transpose_band, col0, min(col0 + n_cols_per_band, n_cols)))
 
-        if n_chunks:
-            chunk = np.empty((n_IDs_per_chunk, n_LIDs), dtype)
-            chunks += [(chunk, n_IDs_per_chunk)] * n_chunks
+            if len(bands) > n_threads:
+                bands.popleft().result().tofile(f)
 
-        if n_IDs_last_chunk:
-            last_chunk = np.empty((n_IDs_last_chunk, n_LIDs), dtype)
-            chunks.append((last_chunk, n_IDs_last_chunk))
+        while bands:
+            bands.popleft().result().tofile(f)
 
-        with open(field_file, 'ab') as f:
-            i0 = 0
-            i1 = 0
+    elapsed_time = time.perf_counter() - start_time
+    throughput = n_rows * n_cols * itemsize / 1e6 / elapsed_time if elapsed_time else float('inf')
+    log.debug(f"'{os.path.basename(file)}' transposed ({throughput:.1f} MB/s)")
+    return throughput
 
-            for chunk, n_IDs_per_chunk in chunks:
-                i1 += n_IDs_per_chunk
-                chunk = field_array[:, i0:i1].T
-                chunk.tofile(f)
-                i0 += n_IDs_per_chunk
+
+def compress_table(header, batch_name):
+    """
+    Compress the segment of the last batch of each field file (only for compressed tables).
+
+    Both arrays of the segment (LID-ordered and ID-ordered) are split into blocks of
+    whole rows, which are compressed separately. Block offsets are kept in the table
+    header, so queries only read (and decompress) the blocks they need.
+
+    Parameters
+    ----------
+    header : dict
+        Table header.
+    batch_name : str
+        Batch name.
+
+    Returns
+    -------
+    int
+        Number of bytes compressed (before compression).
+    """
+    nbytes = 0
+
+    if not header.get('compression') or header['batches'] and header['batches'][-1][0] == batch_name:
+        return nbytes
+
+    if 'index' not in header:
+        header['index'] = {field: list() for field, _ in header['columns'][2:]}
+
+    n_IDs = len(header['IDs'])
+    i_LID0 = header['batches'][-1][1] if header['batches'] else 0
+    n_LIDs = len(header['LIDs']) - i_LID0
+
+    for field, dtype in header['columns'][2:]:
+        field_file = os.path.join(header['path'], field + '.bin')
+        offset = get_segments_end(header, field, dtype)
+
+        if n_LIDs and n_IDs:
+            blocks = compress_segment(field_file, offset, (n_LIDs, n_IDs), dtype, header['compression'])
+            nbytes += 2 * n_LIDs * n_IDs * np.dtype(dtype).itemsize
+        else: # Empty segment
+            blocks = [[offset], [offset]]
+
+        header['index'][field].append(blocks)
+
+    return nbytes
+
+
+def compress_segment(file, offset, shape, dtype, compression):
+    """
+    Replace a segment of a field file (an array followed by its transpose) with
+    its compressed blocks.
+
+    Parameters
+    ----------
+    file : str
+        Field file path.
+    offset : int
+        Segment position within the file (in bytes). The segment must be at the end of the file.
+    shape : (int, int)
+        Shape of the LID-ordered array.
+    dtype : str
+        Array type.
+    compression : dict
+        Compression settings ('codec', 'shuffle' and 'block_size').
+
+    Returns
+    -------
+    [list of int, list of int]
+        Block offsets (LID-ordered blocks and ID-ordered ones).
+    """
+    n_rows, n_cols = shape
+    itemsize = np.dtype(dtype).itemsize
+    temp_file = file + '.tmp'
+    position = offset
+    offsets = list()
+
+    with open(file, 'rb', buffering=0) as f, open(temp_file, 'wb') as f_out:
+        f.seek(offset)
+
+        for rows, cols in [(n_rows, n_cols), (n_cols, n_rows)]: # Both layouts
+            rows_per_block = get_rows_per_block(cols, itemsize, compression['block_size'])
+            block_offsets = [position]
+
+            for row0 in range(0, rows, rows_per_block):
+                block = np.empty((min(rows_per_block, rows - row0), cols), dtype)
+                read_into(f, block)
+                data = compress_block(block, compression)
+                f_out.write(data)
+                position += len(data)
+                block_offsets.append(position)
+
+            offsets.append(block_offsets)
+
+    with open(file, 'rb+') as f, open(temp_file, 'rb') as f_in:
+        f.truncate(offset)
+        f.seek(offset)
+        shutil.copyfileobj(f_in, f)
+
+    os.remove(temp_file)
+    log.debug(f"'{os.path.basename(file)}' compressed ({(position - offset) / (2 * n_rows * n_cols * itemsize):.1%})")
+    return offsets
+
+
+def read_into(f, array):
+    """
+    Fill an array reading from a file (raising an error if the end of the file is reached).
+
+    Parameters
+    ----------
+    f : file object
+        Unbuffered binary file.
+    array : numpy.ndarray
+        C-contiguous array to be filled.
+    """
+    buffer = memoryview(array).cast('B')
+    position = 0
+
+    while position < len(buffer):
+        nbytes = f.readinto(buffer[position:])
+
+        if not nbytes:
+            raise EOFError(f"Unexpected end of file: '{f.name}'")
+
+        position += nbytes
 
 
 def create_table_header(header, batch_name, hash_function):
@@ -195,39 +817,53 @@ def create_table_header(header, batch_name, hash_function):
     if not check:
         header['batches'].append([batch_name, len(header['LIDs']), dict()])
 
-    for field, _ in header['columns']:
+    # Hash field files (only chunks modified since last time are hashed)
+    if 'chunks' not in header:
+        header['chunks'] = {'size': CHUNK_SIZE, 'files': dict()}
 
-        with open(os.path.join(header['path'], field + '.bin'), 'rb') as f:
+    filenames = [field + '.bin' for field, _ in header['columns']]
+    files = [os.path.join(header['path'], filename) for filename in filenames]
+    known_chunks = [header['chunks']['files'].get(filename, (0, None)) for filename in filenames]
+    files_chunk_hashes = hash_chunks([(file, chunk_hashes, size) for file, (size, chunk_hashes) in
+                                      zip(files, known_chunks)], hash_function, header['chunks']['size'])
 
-            if check:
+    for filename, file, chunk_hashes in zip(filenames, files, files_chunk_hashes):
+        header['chunks']['files'][filename] = [os.path.getsize(file), chunk_hashes]
+        merkle_root = get_merkle_root(chunk_hashes, hash_function)
 
-                if header['batches'][-1][2][field + '.bin'] != hash_bytestr(f, get_hasher(hash_function)):
-                    log.error(f"ERROR: '{os.path.join(header['path'], field + '.bin')} is corrupted!'")
+        if check:
 
-            else:
-                header['batches'][-1][2][field + '.bin'] = hash_bytestr(f, get_hasher(hash_function))
+            if header['batches'][-1][2][filename] != merkle_root:
+                log.error(f"ERROR: '{file} is corrupted!'")
+
+        else:
+            header['batches'][-1][2][filename] = merkle_root
 
     # Write table header
     table_header = {
         'name': header['name'],
         'columns': header['columns'],
-        'batches': header['batches']
+        'batches': header['batches'],
+        'chunks': header['chunks'],
     }
 
+    if header.get('compression'):
+        table_header['compression'] = header['compression']
+        table_header['index'] = header['index']
+
+    if header.get('quantization'):
+        table_header['quantization'] = header['quantization']
+
     with open(os.path.join(header['path'], '#header.json'), 'w') as f:
         json.dump(table_header, f)
 
 
 def create_database_header(database_path, headers, batches, hash_function,
-                           attachments=None, table_hashes=None):
+                           attachments=None, table_hashes=None, compression=None, quantization=None):
     # Get table hashes
     if not table_hashes:
-        table_hashes = dict()
-
-        for table in headers:
-
-            with open(os.path.join(database_path, table, '#header.json'), 'rb') as f:
-                table_hashes[table] = hash_bytestr(f, get_hasher(hash_function))
+        table_hashes = dict(zip(headers, hash_files([os.path.join(database_path, table, '#header.json') for
+                                                     table in headers], hash_function)))
 
     # Get hash of current batch
     if batches and batches[-1][1] is None:
@@ -248,6 +884,8 @@ def create_database_header(database_path, headers, batches, hash_function,
     database_header = {
         'version': __version__,
         'hash_function': hash_function,
+        'compression': compression,
+        'quantization': quantization,
         'table_hashes': table_hashes,
         'batches': batches,
         'attachments': dict() if attachments is None else attachments
@@ -255,3 +893,138 @@ def create_database_header(database_path, headers, batches, hash_function,
 
     with open(os.path.join(database_path, '##header.json'), 'w') as f:
         json.dump(database_header, f)
+
+
+def write_journal(database_path, batch_name, new_tables):
+    """
+    Write the journal of a new batch (before modifying the database).
+
+    The journal holds the size of every table file and a copy of every header,
+    so the database can be rolled back in no time if the batch is not completed.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    batch_name : str
+        Batch name.
+    new_tables : list of str
+        Tables which may be created by the batch.
+    """
+    with open(os.path.join(database_path, '##header.json')) as f:
+        database_header = f.read()
+
+    journal = {
+        'batch': batch_name,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'new_tables': list(new_tables),
+        'files': dict(),
+        'headers': {'##header.json': database_header},
+    }
+
+    for table in json.loads(database_header)['table_hashes']:
+
+        for filename in os.listdir(os.path.join(database_path, table)):
+            file = os.path.join(table, filename)
+
+            if filename == '#header.json':
+
+                with open(os.path.join(database_path, file)) as f:
+                    journal['headers'][file] = f.read()
+
+            else:
+                journal['files'][file] = os.path.getsize(os.path.join(database_path, file))
+
+    journal_file = os.path.join(database_path, JOURNAL_FILE)
+
+    with open(journal_file + '.tmp', 'w') as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(journal_file + '.tmp', journal_file)
+
+
+def remove_journal(database_path):
+    """
+    Remove the journal of a new batch (once completed).
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    """
+    os.remove(os.path.join(database_path, JOURNAL_FILE))
+
+
+def get_journal(database_path):
+    """
+    Get the journal of an unfinished batch.
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+
+    Returns
+    -------
+    dict
+        Batch journal (None if there is no unfinished batch).
+    """
+
+    try:
+
+        with open(os.path.join(database_path, JOURNAL_FILE)) as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return None
+
+
+def rollback_journal(database_path):
+    """
+    Undo an unfinished batch (truncating table files and reinstating headers).
+
+    Parameters
+    ----------
+    database_path : str
+        Database path.
+    """
+    journal = get_journal(database_path)
+
+    if journal is None:
+        return
+
+    log.warning(f"WARNING: Rolling back unfinished batch '{journal['batch']}'...")
+
+    # Remove tables created by the batch
+    for table in journal['new_tables']:
+        shutil.rmtree(os.path.join(database_path, table), ignore_errors=True)
+
+    # Truncate table files (and remove those created by the batch)
+    tables = {os.path.dirname(file) for file in journal['headers'] if file != '##header.json'}
+
+    for table in tables:
+
+        for filename in os.listdir(os.path.join(database_path, table)):
+            file = os.path.join(table, filename)
+
+            if file in journal['headers']:
+                continue
+            elif file in journal['files']:
+
+                with open(os.path.join(database_path, file), 'rb+') as f:
+                    f.truncate(journal['files'][file])
+
+            else:
+                os.remove(os.path.join(database_path, file))
+
+    # Reinstate headers
+    for file, header in journal['headers'].items():
+
+        with open(os.path.join(database_path, file), 'w') as f:
+            f.write(header)
+
+    remove_journal(database_path)
+    log.info(f"Batch '{journal['batch']}' rolled back")
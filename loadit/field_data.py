@@ -1,9 +1,20 @@
+import mmap
+from functools import lru_cache
 import numpy as np
+import pyarrow as pa
 
 
+# Quantized storage types: maximum error of each one (relative to the largest absolute
+# value of each segment). Relative errors of float16 values are 2**-11 at most, except
+# for values far smaller than the largest one (subnormal after scaling, or flushed to 0)
+QUANTIZATION_ERRORS = {'<f2': 2**-11, '<i2': 1 / (2 * 32767), '<i1': 1 / (2 * 127)}
+
+PAGE_SIZE = mmap.PAGESIZE
+
 class FieldData(object):
 
-    def __init__(self, name, dtype, file, LIDs, IDs, iLIDs, iIDs):
+    def __init__(self, name, dtype, file, LIDs, IDs, iLIDs, iIDs, segments=None, compression=None, index=None,
+                 quantization=None):
         """
         Initialize a FieldData instance.
 
@@ -19,10 +30,23 @@ class FieldData(object):
             List of LIDs.
         IDs : list of int
             List of IDs.
-        iLIDs : dict of int: int
-            Dict of LID indexes.
-        iIDs : dict of int: int
-            Dict of ID indexes.
+        iLIDs : ArrayIndex
+            LID indexes.
+        iIDs : ArrayIndex
+            ID indexes.
+        segments : list of (int, int), optional
+            LID index range of each segment (one for each batch). Each segment is stored
+            twice (first LID-ordered and then ID-ordered), one after another. By default
+            a single segment is assumed.
+        compression : dict, optional
+            Compression settings ('codec', 'shuffle' and 'block_size'). By default the
+            field file is not compressed.
+        index : list of [list of int, list of int], optional
+            Block offsets of each segment (LID-ordered blocks and ID-ordered ones).
+            Only for compressed field files.
+        quantization : dict, optional
+            Quantization settings ('dtype', 'max_error' and 'scales'). Values are stored
+            quantized (`dtype` is the storage type) and scaled by a factor for each segment.
         """
         self.name = name
         self.dtype = dtype
@@ -34,7 +58,19 @@ class FieldData(object):
         self._data_by_ID = None
         self._iLIDs = iLIDs
         self._iIDs = iIDs
-        self._offset = len(LIDs) * len(IDs) * np.dtype(dtype).itemsize
+        self._compression = compression
+        self._file = None
+
+        if segments is None:
+            segments = [(0, len(LIDs))]
+
+        if index is None:
+            index = [None] * len(segments)
+
+        scales = [None] * len(segments) if quantization is None else quantization['scales']
+        self._segments = [(i0, i1) for i0, i1 in segments if i1 > i0]
+        self._index = [blocks for (i0, i1), blocks in zip(segments, index) if i1 > i0]
+        self._scales = [scale for (i0, i1), scale in zip(segments, scales) if i1 > i0]
 
     @property
     def LIDs(self):
@@ -51,10 +87,17 @@ class FieldData(object):
         self._data_by_LID = None
         self._data_by_ID = None
 
+        if self._file:
+            self._file.close()
+            self._file = None
+
     def read(self, out, LIDs=None, IDs=None):
         """
         Returns requested field values.
 
+        Each segment is read from its LID-ordered copy or from its ID-ordered one,
+        whichever is estimated to touch fewer pages (see `estimate_pages`).
+
         Parameters
         ----------
         LIDs : list of int or dict of int: [float, int, float, int,...], optional
@@ -76,34 +119,431 @@ class FieldData(object):
 
         Returns
         -------
-        numpy.ndarray
-            Field values requested.
+        list of str
+            Layout read for each segment ('LID', 'ID' or None if not needed).
+        """
+        iLIDs = None if LIDs is None else self._iLIDs.get_positions(LIDs)
+        iIDs = None if IDs is None else self._iIDs.get_positions(IDs)
+        n_IDs = self.shape[1] if IDs is None else len(iIDs)
+        layouts = list()
+
+        for k, (i0, i1) in enumerate(self._segments):
+
+            if LIDs is None:
+                index, rows = slice(i0, i1), None
+            else: # Requested LIDs within the segment
+                index = np.flatnonzero((iLIDs >= i0) & (iLIDs < i1))
+
+                if not len(index):
+                    layouts.append(None)
+                    continue
+
+                rows = iLIDs[index] - i0
+
+            # Pick the layout touching fewer pages (in case of a tie, the one with fewer disk seeks)
+            pages_by_LID = self._estimate_pages(k, rows, iIDs, by_ID=False)
+            pages_by_ID = self._estimate_pages(k, rows, iIDs, by_ID=True)
+            by_ID = (pages_by_ID < pages_by_LID or
+                     pages_by_ID == pages_by_LID and (i1 - i0 if rows is None else len(rows)) >= n_IDs)
+            layouts.append('ID' if by_ID else 'LID')
+
+            if self._compression: # Read compressed blocks
+                self._read_blocks(out, k, index, rows, iIDs, by_ID)
+                continue
+
+            # Open mapped files (if not already open)
+            if by_ID and self._data_by_ID is None:
+                self._data_by_ID = self._open_segments(by_ID=True)
+            elif not by_ID and self._data_by_LID is None:
+                self._data_by_LID = self._open_segments(by_ID=False)
+
+            if by_ID: # ID-ordered array (LIDs are the columns of its transpose)
+                values = gather_rows(self._data_by_ID[k].T, np.arange(self.shape[1]) if iIDs is None else iIDs,
+                                     slice(None) if rows is None else rows)
+                out[index, :] = dequantize(values, self._scales[k]).T
+            else: # LID-ordered array
+                values = gather_rows(self._data_by_LID[k], np.arange(i1 - i0) if rows is None else rows,
+                                     slice(None) if iIDs is None else iIDs)
+                out[index, :] = dequantize(values, self._scales[k])
+
+        return layouts
+
+    def _estimate_pages(self, k, rows, iIDs, by_ID):
+        """
+        Estimate the number of pages touched when reading a segment.
+
+        Parameters
+        ----------
+        k : int
+            Segment index.
+        rows : numpy.ndarray
+            Requested LID indexes within the segment (None for all of them).
+        iIDs : numpy.ndarray
+            Requested ID indexes (None for all of them).
+        by_ID : bool
+            Whether to read the ID-ordered copy or the LID-ordered one.
+
+        Returns
+        -------
+        float
+            Number of pages.
+        """
+        i0, i1 = self._segments[k]
+        itemsize = np.dtype(self.dtype).itemsize
+
+        if by_ID:
+            n_rows, n_cols, row_indexes, col_indexes = self.shape[1], i1 - i0, iIDs, rows
+        else:
+            n_rows, n_cols, row_indexes, col_indexes = i1 - i0, self.shape[1], rows, iIDs
+
+        if not self._compression:
+            return estimate_pages(n_rows, n_cols, itemsize, row_indexes, col_indexes)
+
+        # Compressed blocks are decompressed whole
+        rows_per_block = get_rows_per_block(n_cols, itemsize, self._compression['block_size'])
+
+        if row_indexes is None:
+            n_blocks = -(-n_rows // rows_per_block)
+        else:
+            n_blocks = len(np.unique(row_indexes // rows_per_block))
+
+        return n_blocks * rows_per_block * n_cols * itemsize / PAGE_SIZE
+
+    def _open_segments(self, by_ID):
+        """
+        Map field file segments.
+
+        Parameters
+        ----------
+        by_ID : bool
+            Whether to map ID-ordered segments or LID-ordered ones.
+
+        Returns
+        -------
+        list of numpy.memmap
+            Mapped segments (LID by ID arrays).
         """
+        n_IDs = self.shape[1]
+        itemsize = np.dtype(self.dtype).itemsize
+        segments = list()
+
+        for i0, i1 in self._segments:
+            n_LIDs = i1 - i0
+            offset = 2 * i0 * n_IDs * itemsize
+
+            if by_ID:
+                offset += n_LIDs * n_IDs * itemsize
+
+            segments.append(np.memmap(self.file, dtype=self.dtype, shape=(n_LIDs, n_IDs), mode='r',
+                                      offset=offset, order='F' if by_ID else 'C'))
+
+        return segments
+
+    def _read_blocks(self, out, k, index, rows, iIDs, by_ID):
+        """
+        Read field values of a segment from a compressed field file (only the blocks
+        needed are decompressed, each one once).
+
+        Parameters
+        ----------
+        out : numpy.ndarray
+            A location into which the result is stored.
+        k : int
+            Segment index.
+        index : numpy.ndarray or slice
+            Rows of `out` to be filled.
+        rows : numpy.ndarray
+            Requested LID indexes within the segment (None for all of them).
+        iIDs : numpy.ndarray
+            Requested ID indexes (None for all of them).
+        by_ID : bool
+            Whether to read ID-ordered blocks or LID-ordered ones.
+        """
+        (i0, i1), (LID_offsets, ID_offsets), scale = self._segments[k], self._index[k], self._scales[k]
+        n_IDs = self.shape[1]
+        itemsize = np.dtype(self.dtype).itemsize
+
+        if self._file is None: # Open file (if not already open)
+            self._file = open(self.file, 'rb')
+
+        if rows is None:
+            index, rows = np.arange(i0, i1), np.arange(i1 - i0)
+
+        if iIDs is None:
+            iIDs = np.arange(n_IDs)
+
+        if by_ID: # Blocks of IDs (all the LIDs of the segment)
+            offsets, n_rows, n_cols, items = ID_offsets, n_IDs, i1 - i0, iIDs
+        else: # Blocks of LIDs (all the IDs)
+            offsets, n_rows, n_cols, items = LID_offsets, i1 - i0, n_IDs, rows
+
+        rows_per_block = get_rows_per_block(n_cols, itemsize, self._compression['block_size'])
+        blocks = items // rows_per_block
+        order = np.argsort(blocks, kind='stable')
+        block_list, starts = np.unique(blocks[order], return_index=True)
+
+        for block, selected in zip(block_list, np.split(order, starts[1:])):
+            row0 = block * rows_per_block
+            self._file.seek(offsets[block])
+            data = decompress_block(self._file.read(offsets[block + 1] - offsets[block]),
+                                    (min(rows_per_block, n_rows - row0), n_cols), self.dtype,
+                                    self._compression)
+
+            if by_ID:
+                out[np.ix_(index, selected)] = dequantize(data[items[selected] - row0][:, rows], scale).T
+            else:
+                out[index[selected], :] = dequantize(data[items[selected] - row0][:, iIDs], scale)
+
+
+def estimate_pages(n_rows, n_cols, itemsize, rows=None, columns=None):
+    """
+    Estimate the number of pages touched when reading some rows and columns of a
+    C-ordered array (i.e. a mapped file).
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows of the array.
+    n_cols : int
+        Number of columns of the array.
+    itemsize : int
+        Item size (in bytes).
+    rows : numpy.ndarray, optional
+        Requested rows. By default all rows are read.
+    columns : numpy.ndarray, optional
+        Requested columns. By default all columns are read.
+
+    Returns
+    -------
+    int
+        Number of pages.
+    """
+    row_size = n_cols * itemsize
+
+    if rows is None and row_size < PAGE_SIZE: # The whole array
+        return -(-n_rows * row_size // PAGE_SIZE)
+
+    rows = np.arange(n_rows) if rows is None else np.unique(rows)
+
+    if row_size < PAGE_SIZE: # Several rows within each page (columns are irrelevant)
+        return len(np.unique(np.concatenate((rows * row_size, (rows + 1) * row_size - 1)) // PAGE_SIZE))
+
+    if columns is None:
+        pages_per_row = -(-row_size // PAGE_SIZE)
+    else: # Pages spanned by the requested columns (within a row)
+        pages_per_row = len(np.unique(np.asarray(columns) * itemsize // PAGE_SIZE))
+
+    return len(rows) * pages_per_row
+
+
+def gather_rows(data, rows, columns=slice(None), max_gap=8):
+    """
+    Gather rows of an array (i.e. a mapped file).
+
+    Requested rows are sorted and merged into runs (consecutive rows or separated
+    by small gaps), so each run is read at once. Rows are returned in the
+    requested order.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Array (C-ordered).
+    rows : numpy.ndarray
+        Requested rows (in any order, repeated or not).
+    columns : numpy.ndarray or slice, optional
+        Requested columns. By default all columns are read.
+    max_gap : int, optional
+        Maximum number of rows skipped within a run.
+
+    Returns
+    -------
+    numpy.ndarray
+        Requested values.
+    """
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    n_cols = data[:0, columns].shape[1]
+
+    if not len(unique_rows):
+        return np.empty((0, n_cols), dtype=data.dtype)
+
+    breaks = np.flatnonzero(np.diff(unique_rows) > max_gap + 1) + 1
+    values = np.empty((len(unique_rows), n_cols), dtype=data.dtype)
+
+    for k0, k1 in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(unique_rows)]))):
+        row0, row1 = unique_rows[k0], unique_rows[k1 - 1] + 1
+        run = data[row0:row1]
+
+        if row1 - row0 != k1 - k0: # Skip gaps
+            run = run[unique_rows[k0:k1] - row0]
+
+        values[k0:k1] = run[:, columns]
+
+    if len(unique_rows) == len(rows) and np.all(np.diff(rows) > 0): # Already in order
+        return values
+
+    return values[inverse.ravel()]
+
+
+def get_rows_per_block(n_cols, itemsize, block_size):
+    """
+    Get the number of rows of each compressed block (whole rows of about `block_size` bytes).
+
+    Parameters
+    ----------
+    n_cols : int
+        Number of columns.
+    itemsize : int
+        Item size (in bytes).
+    block_size : int
+        Approximate block size (in bytes, before compression).
+
+    Returns
+    -------
+    int
+        Number of rows.
+    """
+    return max(1, block_size // max(1, n_cols * itemsize))
+
+
+@lru_cache(maxsize=None)
+def get_codec(codec):
+    return pa.Codec(codec)
+
+
+def compress_block(array, compression):
+    """
+    Compress an array (optionally byte-shuffled first, so bytes of the same
+    significance are stored together and compress better).
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        C-contiguous array.
+    compression : dict
+        Compression settings ('codec' and 'shuffle').
+
+    Returns
+    -------
+    bytes
+        Compressed data.
+    """
+    data = array.reshape(-1).view(np.uint8)
+
+    if compression['shuffle']:
+        data = np.ascontiguousarray(data.reshape(-1, array.dtype.itemsize).T)
+
+    return get_codec(compression['codec']).compress(data, asbytes=True)
+
+
+def decompress_block(buffer, shape, dtype, compression):
+    """
+    Decompress an array (see `compress_block`).
+
+    Parameters
+    ----------
+    buffer : bytes
+        Compressed data.
+    shape : tuple of int
+        Array shape.
+    dtype : str
+        Array type.
+    compression : dict
+        Compression settings ('codec' and 'shuffle').
+
+    Returns
+    -------
+    numpy.ndarray
+        Decompressed array (read-only).
+    """
+    itemsize = np.dtype(dtype).itemsize
+    nbytes = int(np.prod(shape)) * itemsize
+    data = np.frombuffer(get_codec(compression['codec']).decompress(buffer, decompressed_size=nbytes),
+                         dtype=np.uint8)
+
+    if compression['shuffle']:
+        data = np.ascontiguousarray(data.reshape(itemsize, -1).T)
+
+    return data.view(dtype).reshape(shape)
+
+
+def get_quantization_scale(max_value, dtype):
+    """
+    Get the scale factor of a quantized segment.
+
+    Parameters
+    ----------
+    max_value : float
+        Largest absolute value of the segment.
+    dtype : str
+        Storage type.
+
+    Returns
+    -------
+    float
+        Scale factor (stored values are multiplied by it when read).
+    """
+
+    if not max_value or not np.isfinite(max_value):
+        return 1.0
+
+    if np.dtype(dtype).kind == 'f': # A power of two (so scaling is exact) keeping values within float16 range
+        return float(2.0 ** np.ceil(np.log2(max_value / 2**15)))
+
+    return float(max_value) / np.iinfo(dtype).max
+
+
+def quantize(array, scale, dtype):
+    """
+    Quantize an array (non-finite values are stored as NaN for floats, or as the
+    lowest integer otherwise).
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        Array to be quantized.
+    scale : float
+        Scale factor (see `get_quantization_scale`).
+    dtype : str
+        Storage type.
+
+    Returns
+    -------
+    numpy.ndarray
+        Quantized array.
+    """
+
+    if np.dtype(dtype).kind == 'f':
+        return (array / scale).astype(dtype)
 
-        # Request all items if not specified
-        LIDs_queried = self._LIDs if LIDs is None else LIDs
-        IDs_queried = self._IDs if IDs is None else IDs
+    values = np.rint(array.astype(np.float64) / scale)
+    values[~np.isfinite(values)] = np.iinfo(dtype).min
+    return values.astype(dtype)
 
-        # Read fields mapped files
-        if len(LIDs_queried) < len(IDs_queried): # Use LID-ordered mapped file (less disk seeks required)
-            iIDs = slice(None) if IDs is None else np.array([self._iIDs[ID] for ID in IDs_queried])
 
-            if self._data_by_LID is None: # Open file (if not already open)
-                self._data_by_LID = np.memmap(self.file, dtype=self.dtype, shape=self.shape, mode='r')
+def dequantize(values, scale):
+    """
+    Restore quantized values (see `quantize`).
 
-            # Read data from mapped file
-            for i, LID in enumerate(LIDs_queried):
-                out[i, :] = self._data_by_LID[self._iLIDs[LID], :][iIDs]
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Stored values.
+    scale : float
+        Scale factor. If None, values are not quantized (and they are returned as they are).
 
-        else: # Use ID-ordered mapped file (less disk seeks required)
-            iLIDs = slice(None) if LIDs is None else np.array([self._iLIDs[LID] for LID in LIDs_queried])
+    Returns
+    -------
+    numpy.ndarray
+        Field values.
+    """
 
-            if self._data_by_ID is None: # Open file (if not already open)
-                self._data_by_ID = np.memmap(self.file, dtype=self.dtype, shape=self.shape, mode='r',
-                                             offset=self._offset, order='F')
+    if scale is None:
+        return values
 
-            # Read data from mapped file
-            for i, ID in enumerate(IDs_queried):
-                out[:, i] = self._data_by_ID[:, self._iIDs[ID]][iLIDs]
+    array = values.astype(np.float32)
+    array *= scale
 
+    if values.dtype.kind == 'i':
+        array[values == np.iinfo(values.dtype).min] = np.nan
 
+    return array
@@ -0,0 +1,194 @@
+import sys
+import time
+from contextlib import contextmanager
+import logging
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+log = logging.getLogger()
+
+
+class BatchMetrics(object):
+    """
+    Gather ingestion metrics of a batch (reporting progress events along the way).
+
+    Each event is a dict with an 'event' key:
+
+        'file': A result file is going to be processed.
+        'subcase': Subcases are being appended to tables (throttled, at most one event
+                   every `interval` seconds, with running counts and throughput).
+        'phase': A phase of the batch is completed ('tables', 'quantize', 'transpose',
+                 'compress' or 'hash').
+        'batch': The batch is completed (all metrics are included).
+
+    Only result files account for the bytes parsed (`nbytes_parsed`), including files
+    followed while being written (as their bytes are read). Batches fed by arrays or
+    tables sent by a client are accounted for by the bytes written to the tables
+    (`nbytes_written`) only.
+    """
+
+    def __init__(self, callback=None, interval=1.0):
+        """
+        Initialize a BatchMetrics instance.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            Function called with each progress event (a dict).
+        interval : float, optional
+            Minimum time (in seconds) between 'subcase' events.
+        """
+        self.callback = callback
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.n_files = 0
+        self.nbytes_parsed = 0
+        self.nbytes_written = 0
+        self.n_subcases = 0
+        self._last_subcase_event = None
+        self.tables = dict()
+        self.phases = dict()
+
+    def emit(self, event, **kwargs):
+        """
+        Report a progress event.
+
+        Parameters
+        ----------
+        event : str
+            Event type.
+        **kwargs
+            Event data.
+        """
+
+        if self.callback:
+            self.callback(dict(kwargs, event=event, elapsed_time=time.perf_counter() - self.start_time))
+
+    def add_file(self, file, nbytes, index, n_files):
+        """
+        Account for a result file (before being processed).
+
+        Parameters
+        ----------
+        file : str
+            File name.
+        nbytes : int
+            File size (in bytes). 0 for files still being written (see `add_bytes`).
+        index : int
+            File index (starting at 0).
+        n_files : int
+            Number of files of the batch (None if not known yet).
+        """
+        self.n_files += 1
+        self.nbytes_parsed += nbytes
+        self.emit('file', file=file, nbytes=nbytes, index=index, n_files=n_files,
+                  nbytes_parsed=self.nbytes_parsed, n_subcases=self.n_subcases)
+
+    def add_bytes(self, nbytes):
+        """
+        Account for bytes read from a result file still being written.
+
+        Parameters
+        ----------
+        nbytes : int
+            Bytes read.
+        """
+        self.nbytes_parsed += nbytes
+
+    def add_subcase(self, table, nbytes, elapsed_time):
+        """
+        Account for a subcase appended to a table.
+
+        Parameters
+        ----------
+        table : str
+            Table name.
+        nbytes : int
+            Bytes written.
+        elapsed_time : float
+            Writing time (in seconds).
+        """
+        self.n_subcases += 1
+        self.nbytes_written += nbytes
+
+        if table not in self.tables:
+            self.tables[table] = {'subcases': 0, 'nbytes': 0, 'seconds': 0.0}
+
+        self.tables[table]['subcases'] += 1
+        self.tables[table]['nbytes'] += nbytes
+        self.tables[table]['seconds'] += elapsed_time
+
+        if self.callback:
+            now = time.perf_counter()
+
+            if self._last_subcase_event is None or now - self._last_subcase_event >= self.interval:
+                self._last_subcase_event = now
+                elapsed_time = now - self.start_time
+                self.emit('subcase', table=table, subcases=self.n_subcases,
+                          table_subcases=self.tables[table]['subcases'], nbytes_written=self.nbytes_written,
+                          nbytes_parsed=self.nbytes_parsed,
+                          **{'MB/s': self.nbytes_written / 1e6 / elapsed_time if elapsed_time else None})
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the batch.
+
+        Parameters
+        ----------
+        name : str
+            Phase name.
+        """
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+            self.emit('phase', phase=name, seconds=self.phases[name])
+
+    def done(self):
+        """
+        Report the batch completion.
+        """
+        self.emit('batch', metrics=self.to_dict())
+
+    @property
+    def peak_memory(self):
+        """
+        Peak memory usage (in bytes) of the current process and its already finished
+        child processes (i.e. parsers). None if not available.
+        """
+
+        if resource is None:
+            return None
+
+        scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in KB on Linux
+        return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    def to_dict(self):
+        """
+        Get all metrics.
+
+        Returns
+        -------
+        dict
+            Batch metrics.
+        """
+        return {
+            'seconds': time.perf_counter() - self.start_time,
+            'files': self.n_files,
+            'nbytes_parsed': self.nbytes_parsed,
+            'nbytes_written': self.nbytes_written,
+            'subcases': self.n_subcases,
+            'tables': {name: dict(table, **{'MB/s': table['nbytes'] / 1e6 / table['seconds'] if
+                                            table['seconds'] else None}) for
+                       name, table in self.tables.items()},
+            'phases': dict(self.phases),
+            'peak_memory': self.peak_memory,
+        }
@@ -1,5 +1,12 @@
 import os
 import hashlib
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+
+log = logging.getLogger()
 
 
 suffixes = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
@@ -18,7 +25,7 @@ def humansize(nbytes):
     return '%s %s' % (f, suffixes[i])
 
 
-def hash_bytestr(file, hasher, blocksize=65536, ashexstr=True):
+def hash_bytestr(file, hasher, blocksize=2**20, ashexstr=True):
 
     for block in file_as_blockiter(file, blocksize):
         hasher.update(block)
@@ -29,6 +36,159 @@ def hash_bytestr(file, hasher, blocksize=65536, ashexstr=True):
         return hasher.digest()
 
 
+def hash_chunks(files, hash_function, chunk_size, n_threads=None):
+    """
+    Hash files split into fixed-size chunks.
+
+    Files are assumed to be append-only or truncated, so the hashes of the chunks
+    lying within the previously hashed bytes of each file are reused.
+
+    Parameters
+    ----------
+    files : list of (str, list of str, int)
+        File path, already known chunk hashes and file size when they were calculated.
+    hash_function : str
+        Hash function.
+    chunk_size : int
+        Chunk size (in bytes).
+    n_threads : int, optional
+        Number of threads (see `hash_files`).
+
+    Returns
+    -------
+    list of list of str
+        Hash of each chunk (for each file).
+    """
+    files_chunk_hashes = list()
+    chunks = list()
+
+    for file, chunk_hashes, size in files:
+        file_size = os.path.getsize(file)
+        n_chunks = min(size, file_size) // chunk_size
+        files_chunk_hashes.append(list(chunk_hashes[:n_chunks]) if chunk_hashes else list())
+        chunks += [(file, offset, chunk_size) for offset in range(n_chunks * chunk_size, file_size, chunk_size)]
+
+    chunk_hashes = iter(hash_files(chunks, hash_function, n_threads))
+
+    for (file, _, _), file_chunk_hashes in zip(files, files_chunk_hashes):
+        file_size = os.path.getsize(file)
+        n_chunks = -(-file_size // chunk_size)
+        file_chunk_hashes += [next(chunk_hashes) for _ in range(n_chunks - len(file_chunk_hashes))]
+
+    return files_chunk_hashes
+
+
+def hash_files(files, hash_function, n_threads=None, blocksize=2**22, progress=False):
+    """
+    Hash several files (or file chunks) at once.
+
+    Files are read and hashed by a pool of threads (hashlib releases the GIL
+    while hashing large blocks).
+
+    Parameters
+    ----------
+    files : list of str or (str, int, int)
+        File path (or file path, offset and size in bytes of a chunk).
+    hash_function : str
+        Hash function.
+    n_threads : int, optional
+        Number of threads. By default as many as CPUs.
+    blocksize : int, optional
+        Read block size (in bytes).
+    progress : bool, optional
+        Whether to log each file once all its chunks are hashed or not.
+
+    Returns
+    -------
+    list of str
+        Hash of each file (or file chunk).
+    """
+    chunks = [(file, 0, None) if isinstance(file, str) else tuple(file) for file in files]
+
+    if not chunks:
+        return list()
+
+    # Pending chunks of each file (for progress reporting)
+    n_chunks = dict()
+
+    for file, _, _ in chunks:
+        n_chunks[file] = n_chunks.get(file, 0) + 1
+
+    lock = threading.Lock()
+    n_files_hashed = 0
+
+    def hash_chunk(chunk):
+        nonlocal n_files_hashed
+        file, offset, size = chunk
+        hasher = get_hasher(hash_function)
+
+        with open(file, 'rb', buffering=0) as f:
+            f.seek(offset)
+
+            while size is None or size > 0:
+                block = f.read(blocksize if size is None else min(blocksize, size))
+
+                if not block:
+                    break
+
+                hasher.update(block)
+
+                if size is not None:
+                    size -= len(block)
+
+        if progress:
+
+            with lock:
+                n_chunks[file] -= 1
+
+                if not n_chunks[file]:
+                    n_files_hashed += 1
+                    name = os.path.join(os.path.basename(os.path.dirname(file)), os.path.basename(file))
+                    log.info(f"'{name}' hashed ({n_files_hashed} of {len(n_chunks)} files)")
+
+        return hasher.hexdigest()
+
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+        return list(executor.map(hash_chunk, chunks))
+
+
+def get_merkle_root(chunk_hashes, hash_function):
+    """
+    Combine chunk hashes into a Merkle tree.
+
+    Parameters
+    ----------
+    chunk_hashes : list of str
+        Hash of each chunk.
+    hash_function : str
+        Hash function.
+
+    Returns
+    -------
+    str
+        Merkle root.
+    """
+    level = [bytes.fromhex(chunk_hash) for chunk_hash in chunk_hashes]
+
+    if not level:
+        return get_hasher(hash_function).hexdigest()
+
+    while len(level) > 1:
+        next_level = list()
+
+        for i in range(0, len(level) - 1, 2):
+            hasher = get_hasher(hash_function)
+            hasher.update(level[i] + level[i + 1])
+            next_level.append(hasher.digest())
+
+        if len(level) % 2: # Odd node goes up unchanged
+            next_level.append(level[-1])
+
+        level = next_level
+
+    return level[0].hex()
+
+
 def file_as_blockiter(file, blocksize):
 
     with file:
@@ -39,6 +199,62 @@ def file_as_blockiter(file, blocksize):
             block = file.read(blocksize)
 
 
+class LazyDict(MutableMapping):
+    """
+    Dict whose values are loaded on first access.
+    """
+
+    _NOT_LOADED = object()
+
+    def __init__(self, keys, load):
+        """
+        Initialize a LazyDict instance.
+
+        Parameters
+        ----------
+        keys : iterable
+            Dict keys.
+        load : callable
+            Function called with a key to get its value.
+        """
+        self._items = dict.fromkeys(keys, self._NOT_LOADED)
+        self._load = load
+
+    def __getitem__(self, key):
+        value = self._items[key]
+
+        if value is self._NOT_LOADED:
+            value = self._items[key] = self._load(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+
+    def __delitem__(self, key):
+        del self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def loaded(self):
+        """
+        Get the values already loaded.
+
+        Returns
+        -------
+        dict
+            Values already loaded.
+        """
+        return {key: value for key, value in self._items.items() if value is not self._NOT_LOADED}
+
+
 def get_hasher(hash_type):
 
     if hash_type == 'md5':
@@ -47,6 +263,8 @@ def get_hasher(hash_type):
         return hashlib.sha1()
     elif hash_type == 'sha256':
         return hashlib.sha256()
+    elif hash_type == 'blake2b':
+        return hashlib.blake2b()
     else:
         raise ValueError(f"Unsupported hash method: {hash_type}")
 
@@ -1,5 +1,32 @@
-from io import StringIO
+import os
+import json
+import time
+import glob
+import mmap
+import gzip
+import bz2
+import lzma
+from collections import deque
 import numpy as np
+from loadit.tables_specs import get_decode_plans
+import logging
+
+
+log = logging.getLogger()
+
+
+# Supported compression formats: (file extension, magic bytes, module)
+COMPRESSIONS = [('.gz', b'\x1f\x8b', gzip), ('.bz2', b'BZh', bz2), ('.xz', b'\xfd7zXZ\x00', lzma)]
+
+# NASTRAN element type codes (as used in OEF tables)
+ELEMENT_TYPES = {1: 'ROD', 2: 'BEAM', 11: 'ELAS1', 12: 'ELAS2', 13: 'ELAS3', 14: 'ELAS4',
+                 33: 'QUAD4', 34: 'BAR', 74: 'TRIA3', 100: 'BARS', 102: 'BUSH'}
+
+# OEF element types with a row for each station (element ID, station distance, bending
+# moments, shears, axial force and torque): station (first or last) and word of each field.
+# Words of the rest of element types follow the .pch layout.
+OP2_STATION_FIELDS = {100: {'M1A': (0, 2), 'M2A': (0, 3), 'V1': (0, 4), 'V2': (0, 5), 'FX': (0, 6), 'T': (0, 7),
+                            'M1B': (-1, 2), 'M2B': (-1, 3)}}
 
 
 class ResultsTable(object):
@@ -16,18 +43,92 @@ class ResultsTable(object):
         self.element_id = element_id
 
 
-def tables_in_pch(file, tables_specs=None):
+def tables_in_file(file, tables_specs=None, **kwargs):
+    """
+    Iterate over the tables of a result file (either .op2 or .pch).
+
+    Parameters
+    ----------
+    file : str
+        Result file path.
+    tables_specs : dict, optional
+        Tables specifications. Only tables included here are decoded.
+    **kwargs
+        Additional .pch parsing options (see `tables_in_pch`).
+
+    Yields
+    ------
+    ResultsTable
+        Table found in the file.
+    """
+
+    if os.path.splitext(file)[1].lower() == '.op2':
+        yield from tables_in_op2(file, tables_specs)
+    else:
+        yield from tables_in_pch(file, tables_specs, **kwargs)
+
+
+def tables_in_pch(file, tables_specs=None, use_mmap=True, n_workers=1, chunk_size=2**27):
+    """
+    Iterate over the tables of a .pch file.
+
+    Parameters
+    ----------
+    file : str or file object
+        .pch file path (or an already opened text file object). Compressed files
+        (gzip, bzip2 or xz) are decompressed on the fly.
+    tables_specs : dict, optional
+        Tables specifications. Only tables included here are decoded.
+    use_mmap : bool, optional
+        Whether to scan the file as a byte buffer (memory-mapped, or streamed for
+        compressed files) or line by line. Only applies when a file path is provided.
+    n_workers : int, optional
+        Number of parsing processes (only for memory-mapped files). Files larger
+        than `chunk_size` are split at table boundaries and parsed in parallel.
+    chunk_size : int, optional
+        Approximate size (in bytes) of each block of tables parsed by a process
+        (or read at once from a compressed file).
+
+    Yields
+    ------
+    ResultsTable
+        Table found in the file.
+    """
+
+    plans = get_decode_plans(tables_specs)
 
     try:
+        compression = get_compression(file)
+    except TypeError: # Already opened file
+        yield from _tables_in_pch(file, plans)
+        return
+
+    if compression:
+
+        with compression.open(file, 'rb' if use_mmap else 'rt') as f:
 
-        with open(file) as f:
-            yield from _tables_in_pch(f, tables_specs)
+            if use_mmap:
+                yield from _tables_in_pch_stream(f, plans, chunk_size)
+            else:
+                yield from _tables_in_pch(f, plans)
+
+        return
+
+    with open(file, 'rb' if use_mmap else 'r') as f:
+
+        if use_mmap:
+            size = os.fstat(f.fileno()).st_size
 
-    except TypeError:
-        yield from _tables_in_pch(file, tables_specs)
+            if n_workers > 1 and size > chunk_size:
+                yield from _tables_in_pch_parallel(f, tables_specs, n_workers, chunk_size)
+            elif size:
+                yield from _tables_in_pch_mmap(f, plans)
+
+        else:
+            yield from _tables_in_pch(f, plans)
 
 
-def _tables_in_pch(file, tables_specs):
+def _tables_in_pch(file, plans):
     is_header = False
     header_row = 0
     table = None
@@ -45,67 +146,941 @@ def _tables_in_pch(file, tables_specs):
                 header_row = 0
 
                 if table:
-                    data.seek(0)
 
-                    if is_format:
-                        table.data = np.genfromtxt(data, names=names, delimiter=widths,
-                                                   usecols=usecols, dtype=dtype)
+                    if plan:
+                        table.data = decode_records(data, plan)
 
                     yield table
 
-                table = ResultsTable(header='', title=line[10:72].strip())
-                data = StringIO()
+                table = ResultsTable(header='')
+                data = list()
                 item_id = ''
-                line_separator = ''
 
             header_row += 1
-            table.header += line
-
-            if line[:9] == '$SUBTITLE':
-                table.subtitle = line[10:72].strip()
-            elif line[:6] == '$LABEL':
-                table.label = line[10:72].strip()
-            elif header_row == 4:
-                table.name = line[1:72].strip()
-            elif line[:11] == '$SUBCASE ID':
-                subcase = line[13:13 + 18]
-                table.subcase = int(subcase.strip())
-            elif line[:13] == '$ELEMENT TYPE':
-                table.element_type = line[27:50].strip()
-                element_number = line[20:27].strip()
-                table.name = f'{table.name} - {table.element_type} ({element_number})'
-
-            if tables_specs and table.name in tables_specs:
-                is_format = True
-                names = [name if name else f'foo{i}' for i, name in
-                         enumerate(name for row in tables_specs[table.name]['pch_format'] for name, _ in row)]
-                widths = [18 for row in tables_specs[table.name]['pch_format'] for _, _ in row]
-                usecols = tables_specs[table.name]['columns']
-                dtype = [tables_specs[table.name]['dtypes'][name] if name in
-                         tables_specs[table.name]['dtypes'] else None for name in names]
-            else:
-                is_format = False
+            read_header_line(table, line, header_row)
 
         else:
-            is_header = False
+
+            if is_header:
+                is_header = False
+                subcase = str(table.subcase).rjust(18)
+                plan = plans.get(table.name)
+
+            if len(line) < 73: # Pad short lines
+                line = line.rstrip('\n').ljust(72)
 
             if line[0] == ' ':
 
                 if item_id == line[:18]:
-                    data.write(line[18:72])
+                    data[-1] += line[18:72]
                 else:
-                    data.write(line_separator + subcase + line[:72])
+                    data.append(subcase + line[:72])
 
                 item_id = line[:18]
-                line_separator = '\n'
             elif line[:6] == '-CONT-':
-                data.write(line[18:72])
+                data[-1] += line[18:72]
 
     if table:
-        data.seek(0)
 
-        if is_format:
-            table.data = np.genfromtxt(data, names=names, delimiter=widths,
-                                       usecols=usecols, dtype=dtype)
+        if is_header:
+            plan = plans.get(table.name)
+
+        if plan:
+            table.data = decode_records(data, plan)
+
+        yield table
+
+
+def _tables_in_pch_mmap(file, plans, start=0, end=None):
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        yield from _tables_in_buffer(buffer, plans, start, end)
+
+
+def _tables_in_pch_stream(file, plans, chunk_size):
+    buffer = b''
+
+    while True:
+        chunk = file.read(chunk_size)
+
+        if chunk: # Only complete tables are processed (up to the last header found)
+            buffer += chunk
+            end = buffer.rfind(b'\n$TITLE', max(len(buffer) - len(chunk) - 7, 0))
+
+            if end == -1:
+                continue
+
+            end += 1
+        else:
+            end = len(buffer)
+
+        yield from _tables_in_buffer(buffer, plans, 0, end)
+
+        if not chunk:
+            break
+
+        buffer = buffer[end:]
+
+
+def _tables_in_buffer(buffer, plans, start=0, end=None):
+
+    if end is None:
+        end = len(buffer)
+
+    position = find_title(buffer, start, end)
+
+    while position != -1:
+        table = ResultsTable(header='')
+        position = read_header(buffer, position, table)
+        next_position = find_title(buffer, position, end)
+        plan = plans.get(table.name)
+
+        if plan:
+            table.data = decode_block(buffer, position, end if next_position == -1 else next_position,
+                                      table, plans, plan)
 
         yield table
+        position = next_position
+
+
+def _tables_in_pch_parallel(file, tables_specs, n_workers, chunk_size):
+    from concurrent.futures import ProcessPoolExecutor
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        blocks = split_blocks(buffer, chunk_size)
+
+    # A parser process dying (i.e. killed by the OOM killer) raises BrokenProcessPool
+    with ProcessPoolExecutor(n_workers) as executor:
+        pending = deque()
+
+        try:
+
+            for start, end in blocks:
+                pending.append(executor.submit(read_tables, file.name, tables_specs, start, end))
+
+                if len(pending) > 2 * n_workers: # Limit the number of parsed blocks waiting in memory
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+        finally:
+
+            for future in pending: # i.e. generator closed early
+                future.cancel()
+
+
+def read_tables(file, tables_specs, start, end):
+    """
+    Read all the tables within a block of a .pch file.
+
+    Parameters
+    ----------
+    file : str
+        .pch file path.
+    tables_specs : dict
+        Tables specifications.
+    start : int
+        Block start position (it must be at the beginning of a table).
+    end : int
+        Block end position (it must be at the beginning of a table or at the end of the file).
+
+    Returns
+    -------
+    list of ResultsTable
+        Tables found (in file order).
+    """
+
+    with open(file, 'rb') as f:
+        return list(_tables_in_pch_mmap(f, get_decode_plans(tables_specs), start, end))
+
+
+def watch_tables(path, tables_specs=None, files=None, pattern='*.pch', poll_interval=1.0,
+                 idle_timeout=60.0, stop_file=None, chunk_size=2**24, metrics=None):
+    """
+    Iterate over the tables of .pch files while they are still being written.
+
+    Either a single growing file or a drop directory is followed (files are processed in
+    order of appearance). Each table is yielded as soon as it is complete (i.e. the next
+    `$TITLE` is found). A file is considered complete once the stop file exists (if
+    provided) or, otherwise, once it has not grown for `idle_timeout` seconds (files
+    appearing meanwhile, e.g. from concurrent runs, are followed afterwards). The run is
+    finished once the stop file exists or, otherwise, no file has grown for
+    `idle_timeout` seconds (only once a file has been found, so the run can take any
+    time to start writing).
+
+    Parameters
+    ----------
+    path : str
+        .pch file or drop directory path.
+    tables_specs : dict, optional
+        Tables specifications. Only tables included here are decoded.
+    files : list, optional
+        Files processed so far (appended as they are found).
+    pattern : str, optional
+        File name pattern (only for drop directories). Compressed files cannot be followed.
+    poll_interval : float, optional
+        Time (in seconds) between checks for new data.
+    idle_timeout : float, optional
+        Time (in seconds) without new data after which a file (or the run, once no file
+        is pending) is considered finished (not counted until a file is found).
+    stop_file : str, optional
+        File created once the run is finished (e.g. by the solver job script).
+    chunk_size : int, optional
+        Maximum size (in bytes) of each read.
+    metrics : BatchMetrics, optional
+        Ingestion metrics (each file followed and the bytes read are accounted for).
+
+    Yields
+    ------
+    ResultsTable
+        Table found.
+    """
+    plans = get_decode_plans(tables_specs)
+
+    if files is None:
+        files = list()
+
+    sizes = dict() # Size and time of last growth of each file
+
+    def watched_files():
+
+        if os.path.isdir(path):
+            return sorted(glob.glob(os.path.join(path, pattern)), key=lambda file: (os.path.getmtime(file), file))
+        elif os.path.exists(path):
+            return [path]
+
+        return list()
+
+    def is_idle(watched):
+        now = time.time()
+        idle = True
+
+        for file in watched:
+            size = os.path.getsize(file)
+
+            if file not in sizes or sizes[file][0] != size:
+                sizes[file] = (size, now)
+
+            if now - sizes[file][1] <= idle_timeout:
+                idle = False
+
+        return idle
+
+    def is_finished(file=None):
+
+        if stop_file:
+            return os.path.exists(stop_file)
+
+        if file:
+            return is_idle([file])
+
+        if not files: # Run not started yet
+            return False
+
+        return is_idle(watched_files())
+
+    while True:
+        pending = [file for file in watched_files() if file not in files]
+
+        if not pending:
+
+            if is_finished():
+                break
+
+            time.sleep(poll_interval)
+            continue
+
+        file = pending[0]
+        files.append(file)
+        log.info(f"Following file {len(files)}: '{os.path.basename(file)}'...")
+
+        if metrics:
+            metrics.add_file(os.path.basename(file), 0, len(files) - 1, None)
+
+        with GrowingFile(file, lambda: is_finished(file), poll_interval, metrics) as f:
+            yield from _tables_in_pch_stream(f, plans, chunk_size)
+
+
+class GrowingFile(object):
+    """
+    Binary file being written by another process (reads wait for new data).
+    """
+
+    def __init__(self, file, is_finished, poll_interval=1.0, metrics=None):
+        """
+        Open a growing file.
+
+        Parameters
+        ----------
+        file : str
+            File path.
+        is_finished : callable
+            Function telling whether the file is complete.
+        poll_interval : float, optional
+            Time (in seconds) between checks for new data.
+        metrics : BatchMetrics, optional
+            Ingestion metrics (bytes read are accounted for).
+        """
+        self.file = open(file, 'rb')
+        self.is_finished = is_finished
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        """
+        Read new data (waiting for it if needed).
+
+        Parameters
+        ----------
+        size : int, optional
+            Maximum number of bytes to read.
+
+        Returns
+        -------
+        bytes
+            Data read (empty only once the file is complete).
+        """
+
+        data = self.file.read(size)
+
+        while not data:
+
+            if self.is_finished():
+                data = self.file.read(size) # Catch up with data written meanwhile
+                break
+
+            time.sleep(self.poll_interval)
+            data = self.file.read(size)
+
+        if self.metrics:
+            self.metrics.add_bytes(len(data))
+
+        return data
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self.file.close()
+
+
+def get_compression(file):
+    """
+    Get the compression format of a file (by file extension or magic bytes).
+
+    Parameters
+    ----------
+    file : str
+        File path.
+
+    Returns
+    -------
+    module or None
+        Decompression module (gzip, bz2 or lzma). None if the file is not compressed.
+    """
+    extension = os.path.splitext(file)[1].lower()
+
+    for compression_extension, _, compression in COMPRESSIONS:
+
+        if extension == compression_extension:
+            return compression
+
+    with open(file, 'rb') as f:
+        magic = f.read(8)
+
+    for _, compression_magic, compression in COMPRESSIONS:
+
+        if magic.startswith(compression_magic):
+            return compression
+
+
+def split_blocks(buffer, chunk_size):
+    """
+    Split a .pch file into blocks of tables.
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .pch file contents.
+    chunk_size : int
+        Approximate block size (in bytes).
+
+    Returns
+    -------
+    list of (int, int)
+        Start and end positions of each block (in file order).
+    """
+    blocks = list()
+    start = find_title(buffer, 0)
+
+    while start != -1:
+        end = buffer.find(b'\n$TITLE', start + chunk_size)
+        end = end if end == -1 else end + 1
+        blocks.append((start, len(buffer) if end == -1 else end))
+        start = end
+
+    return blocks
+
+
+def find_title(buffer, position, end=None):
+    """
+    Find the next table header.
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .pch file contents.
+    position : int
+        Search start position (it must be at the beginning of a line).
+    end : int, optional
+        Search end position. By default the whole buffer is searched.
+
+    Returns
+    -------
+    int
+        Position of the next '$TITLE' line (-1 if not found).
+    """
+
+    if end is None:
+        end = len(buffer)
+
+    if position < end and buffer[position:position + 6] == b'$TITLE':
+        return position
+
+    position = buffer.find(b'\n$TITLE', position, end)
+    return position if position == -1 else position + 1
+
+
+def read_header(buffer, position, table):
+    """
+    Read a table header (all consecutive lines starting with '$').
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .pch file contents.
+    position : int
+        Header start position.
+    table : ResultsTable
+        Table to be filled in.
+
+    Returns
+    -------
+    int
+        Position of the first line after the header.
+    """
+    header_row = 0
+
+    while buffer[position:position + 1] == b'$':
+        end = buffer.find(b'\n', position)
+        end = len(buffer) if end == -1 else end + 1
+        header_row += 1
+        read_header_line(table, buffer[position:end].decode().rstrip('\r\n') + '\n', header_row)
+        position = end
+
+    return position
+
+
+def read_header_line(table, line, header_row):
+    """
+    Read a table header line.
+
+    Parameters
+    ----------
+    table : ResultsTable
+        Table to be filled in.
+    line : str
+        Header line.
+    header_row : int
+        Header line number (starting at 1).
+    """
+    table.header += line
+
+    if header_row == 1:
+        table.title = line[10:72].strip()
+    elif line[:9] == '$SUBTITLE':
+        table.subtitle = line[10:72].strip()
+    elif line[:6] == '$LABEL':
+        table.label = line[10:72].strip()
+    elif header_row == 4:
+        table.name = line[1:72].strip()
+    elif line[:11] == '$SUBCASE ID':
+        table.subcase = int(line[13:13 + 18].strip())
+    elif line[:13] == '$ELEMENT TYPE':
+        table.element_type = line[27:50].strip()
+        element_number = line[20:27].strip()
+        table.name = f'{table.name} - {table.element_type} ({element_number})'
+
+
+def decode_block(buffer, start, end, table, plans, plan):
+    """
+    Decode the data block of a table straight from the file buffer.
+
+    Each line is viewed as a row of a 2D byte array (no copies are made if all the
+    lines of the block have the same length and all the records span the same
+    number of lines). Otherwise, the block is decoded line by line.
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .pch file contents.
+    start : int
+        Data block start position.
+    end : int
+        Data block end position.
+    table : ResultsTable
+        Table (with its header already read).
+    plans : dict of str: DecodePlan
+        Decode plan of each table.
+    plan : DecodePlan
+        Decode plan of the table.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array (one row for each record).
+    """
+    block = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=start)
+    line_ends = np.flatnonzero(block == ord('\n'))
+    records = None
+
+    if len(line_ends) and line_ends[-1] == len(block) - 1 and line_ends[0] >= 72:
+        line_size = line_ends[0] + 1
+
+        if len(block) == line_size * len(line_ends):
+            lines = block.reshape((len(line_ends), line_size))
+
+            if np.all(lines[:, -1] == ord('\n')):
+                records = get_records(lines)
+
+    if records is None: # Irregular block
+        from io import StringIO
+        lines = StringIO(table.header + buffer[start:end].decode(), newline=None)
+        return next(_tables_in_pch(lines, plans)).data
+
+    data = np.empty(len(records), dtype=plan.dtype)
+    n_lines = records.shape[1] if len(records) else 0
+    width = plan.width
+
+    for name, dtype, _, line, position in plan.fields:
+
+        if line is None: # Subcase
+            data[name] = table.subcase
+        elif line < n_lines:
+            field = np.ascontiguousarray(records[:, line, position:position + width])
+            data[name] = decode_field(field.view(f'S{width}').ravel(), dtype, width)
+        else: # Missing field
+            data[name] = get_missing_value(dtype)
+
+    return data
+
+
+def get_records(lines):
+    """
+    Group the data lines of a block into records.
+
+    Parameters
+    ----------
+    lines : numpy.ndarray
+        2D byte array (one row for each line).
+
+    Returns
+    -------
+    numpy.ndarray or None
+        3D byte array (records x lines per record x line size). None if records
+        don't span the same number of lines.
+    """
+    is_item = lines[:, 0] == ord(' ')
+    is_cont = np.all(lines[:, :6] == np.frombuffer(b'-CONT-', dtype=np.uint8), axis=1)
+
+    # Lines starting with the same ID as the previous item line are continuation lines
+    items = np.flatnonzero(is_item)
+    is_new_item = np.ones(len(items), dtype=bool)
+    is_new_item[1:] = np.any(lines[items[1:], :18] != lines[items[:-1], :18], axis=1)
+    is_first = np.zeros(len(lines), dtype=bool)
+    is_first[items[is_new_item]] = True
+
+    used = np.flatnonzero(is_item | is_cont)
+    first = np.flatnonzero(is_first[used])
+
+    if not len(first):
+        return lines[:0].reshape((0, 1, lines.shape[1]))
+
+    n_lines = len(used) // len(first)
+
+    if len(used) != n_lines * len(first) or np.any(first != np.arange(0, len(used), n_lines)):
+        return None
+
+    if len(used) < len(lines):
+        lines = lines[used]
+
+    return lines.reshape((len(first), n_lines, lines.shape[1]))
+
+
+def decode_records(records, plan):
+    """
+    Decode fixed-width records into a structured array.
+
+    All the records are packed into a single byte buffer, which is viewed as a
+    2D array of fixed-width fields. Only the requested columns are converted.
+
+    Parameters
+    ----------
+    records : list of str
+        Records (one string for each item, with all its fields concatenated).
+    plan : DecodePlan
+        Decode plan of the table.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array (one row for each record).
+    """
+
+    if not records:
+        return np.empty(0, dtype=plan.dtype)
+
+    record_width = max(map(len, records))
+
+    if record_width != min(map(len, records)): # Pad shorter records (if any)
+        records = [record.ljust(record_width) for record in records]
+
+    fields = np.frombuffer(''.join(records).encode(), dtype=f'S{plan.width}')
+    fields = fields.reshape((len(records), record_width // plan.width))
+    data = np.empty(len(records), dtype=plan.dtype)
+
+    for name, dtype, index, _, _ in plan.fields:
+
+        if index < fields.shape[1]:
+            data[name] = decode_field(fields[:, index], dtype, plan.width)
+        else: # Missing field
+            data[name] = get_missing_value(dtype)
+
+    return data
+
+
+def decode_field(field, dtype, width=18):
+    """
+    Decode a fixed-width field.
+
+    Parameters
+    ----------
+    field : numpy.ndarray
+        Array of fixed-width byte strings (one for each record).
+    dtype : str
+        Field type.
+    width : int, optional
+        Field width (in characters).
+
+    Returns
+    -------
+    numpy.ndarray
+        Field values. Blank values are set to NaN (0 for integer fields).
+    """
+
+    try:
+        return field.astype(dtype)
+    except ValueError: # Blank values found
+        is_blank = field == b' ' * width
+        values = np.full(len(field), get_missing_value(dtype), dtype=dtype)
+        values[~is_blank] = field[~is_blank].astype(dtype)
+        return values
+
+
+def get_missing_value(dtype):
+    """
+    Get the value of blank or missing fields.
+
+    Parameters
+    ----------
+    dtype : str
+        Field type.
+
+    Returns
+    -------
+    float or int
+        NaN for float fields, 0 otherwise (as blank integer fields read by NASTRAN).
+    """
+    return np.nan if np.dtype(dtype).kind == 'f' else 0
+
+
+def tables_in_op2(file, tables_specs=None):
+    """
+    Iterate over the element forces tables (OEF) of a binary .op2 file.
+
+    Only real results are supported. Each data record is decoded straight
+    into typed arrays, using the same word layout as the .pch format.
+
+    Parameters
+    ----------
+    file : str
+        .op2 file path.
+    tables_specs : dict, optional
+        Tables specifications. Only tables included here are decoded.
+
+    Yields
+    ------
+    ResultsTable
+        Table found in the file (one for each subcase and element type).
+    """
+
+    plans = get_decode_plans(tables_specs)
+
+    with open(file, 'rb') as f:
+
+        if not os.fstat(f.fileno()).st_size:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            byteorder = '<' if int.from_bytes(buffer[:4], 'little') == 4 else '>'
+            records = list(op2_records(buffer, byteorder))
+            table_name = None
+            record_number = 0
+            ident = None
+            data = list()
+
+            for i, (start, nbytes) in enumerate(records):
+
+                if nbytes == 4: # Marker
+                    value = int(np.frombuffer(buffer, dtype=byteorder + 'i4', count=1, offset=start)[0])
+
+                    if value < 0:
+
+                        if ident is not None and data:
+                            yield from op2_tables(buffer, byteorder, table_name, ident, data, plans)
+                            ident = None
+
+                        record_number = -value
+                        data = list()
+
+                    continue
+
+                # Table name (followed by a -1 marker)
+                if (i + 1 < len(records) and records[i + 1][1] == 4 and
+                    int(np.frombuffer(buffer, dtype=byteorder + 'i4', count=1, offset=records[i + 1][0])[0]) == -1):
+
+                    if ident is not None and data:
+                        yield from op2_tables(buffer, byteorder, table_name, ident, data, plans)
+
+                    table_name = buffer[start:start + 8].decode('latin-1').strip()
+                    ident = None
+                    data = list()
+                elif table_name and table_name.startswith('OEF') and record_number >= 3:
+
+                    if record_number % 2: # IDENT record
+                        ident = np.frombuffer(buffer, dtype=byteorder + 'i4', count=nbytes // 4, offset=start)
+                    else: # DATA record (it may span several records)
+                        data.append((start, nbytes))
+
+            if ident is not None and data:
+                yield from op2_tables(buffer, byteorder, table_name, ident, data, plans)
+
+
+def op2_records(buffer, byteorder):
+    """
+    Iterate over the Fortran records of an .op2 file.
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .op2 file contents.
+    byteorder : {'<', '>'}
+        Byte order.
+
+    Yields
+    ------
+    (int, int)
+        Start position and size (in bytes) of each record.
+    """
+    byteorder = 'little' if byteorder == '<' else 'big'
+    position = 0
+
+    while position + 4 <= len(buffer):
+        nbytes = int.from_bytes(buffer[position:position + 4], byteorder, signed=True)
+
+        if nbytes < 0 or position + 8 + nbytes > len(buffer):
+            raise ValueError(f'Corrupted .op2 file (position: {position})')
+
+        yield position + 4, nbytes
+        position += 8 + nbytes
+
+
+def op2_tables(buffer, byteorder, table_name, ident, data, plans):
+    """
+    Decode an OEF subcase (an IDENT record along with its DATA records).
+
+    Parameters
+    ----------
+    buffer : mmap.mmap or bytes
+        .op2 file contents.
+    byteorder : {'<', '>'}
+        Byte order.
+    table_name : str
+        OP2 table name (i.e. 'OEF1X').
+    ident : numpy.ndarray
+        IDENT record words.
+    data : list of (int, int)
+        Start position and size (in bytes) of each DATA record.
+    plans : dict of str: DecodePlan
+        Decode plan of each table.
+
+    Yields
+    ------
+    ResultsTable
+        Table decoded.
+    """
+    _, table_code, element_code, subcase = (int(value) for value in ident[:4])
+    format_code = int(ident[8])
+    n_words = int(ident[9])
+
+    if table_code % 1000 != 4 or format_code != 1 or not n_words: # Only real element forces are supported
+        return
+
+    element_type = ELEMENT_TYPES.get(element_code, str(element_code))
+    text = ident[50:146].tobytes().decode('latin-1')
+    table = ResultsTable(name=f'ELEMENT FORCES - {element_type} ({element_code})',
+                         element_type=element_type, title=text[:128].strip(),
+                         subtitle=text[128:256].strip(), label=text[256:].strip(),
+                         subcase=subcase)
+    plan = plans.get(table.name)
+
+    if plan:
+
+        if len(data) == 1:
+            start, nbytes = data[0]
+            words = np.frombuffer(buffer, dtype=np.uint8, count=nbytes, offset=start)
+        else:
+            words = np.concatenate([np.frombuffer(buffer, dtype=np.uint8, count=nbytes, offset=start) for
+                                    start, nbytes in data])
+
+        words = words[:len(words) - len(words) % (4 * n_words)].view(byteorder + 'i4').reshape((-1, n_words))
+        station_fields = OP2_STATION_FIELDS.get(element_code)
+
+        if station_fields: # Station rows of each element (one after another)
+            EIDs = words[:, 0] // 10
+            first = np.flatnonzero(np.append(True, EIDs[1:] != EIDs[:-1]))
+            stations = (words[first], words[np.append(first[1:], len(words)) - 1]) # First and last stations
+            words = stations[0]
+
+        table.data = np.empty(len(words), dtype=plan.dtype)
+
+        for name, _, index, _, _ in plan.fields:
+
+            if index == 0: # Subcase
+                table.data[name] = subcase
+            elif index == 1: # Element ID (including device code)
+                table.data[name] = words[:, 0] // 10
+            elif station_fields:
+
+                if name in station_fields and station_fields[name][1] < n_words:
+                    station, word = station_fields[name]
+                    table.data[name] = stations[station][:, word].view(byteorder + 'f4')
+                else: # Missing field
+                    table.data[name] = get_missing_value(table.data.dtype[name])
+
+            elif index - 1 < n_words:
+                table.data[name] = words[:, index - 1].view(byteorder + 'f4')
+            else: # Missing field
+                table.data[name] = get_missing_value(table.data.dtype[name])
+
+    yield table
+
+
+def tables_in_arrays(tables, tables_specs):
+    """
+    Iterate over tables given as arrays (a table is yielded for each LID).
+
+    Parameters
+    ----------
+    tables : dict of str: dict, pyarrow.Table or pandas.DataFrame
+        Values of each table. Either a dict of arrays, keyed by column name, holding
+        the LIDs (1-D), the IDs (1-D) and the field values (2-D, one row for each LID)
+        (i.e. {'LID': [...], 'EID': [...], 'NX': [[...], ...], ...}), or a table with
+        a row for each LID/ID pair. Query results (not aggregated) are accepted as well
+        (LIDs and IDs are taken from their metadata). Missing fields are filled with
+        NaNs. An iterable of (table name, values) is also accepted.
+    tables_specs : dict
+        Tables specifications.
+
+    Yields
+    ------
+    ResultsTable
+        Table of each LID.
+    """
+
+    for name, arrays in (tables.items() if isinstance(tables, dict) else tables):
+
+        if name not in tables_specs:
+            raise ValueError(f"'{name}' is not supported!")
+
+        columns = tables_specs[name]['columns']
+        dtype = [(field, tables_specs[name]['dtypes'][field]) for field in columns]
+        LID_label, ID_label = columns[:2]
+
+        by_pair = not isinstance(arrays, dict)
+
+        if by_pair: # Table with a row for each LID/ID pair
+            import pyarrow as pa
+
+            if not isinstance(arrays, (pa.Table, pa.RecordBatch)): # Index (i.e. of filtered DataFrames) left out
+                arrays = pa.Table.from_pandas(arrays, preserve_index=False)
+
+            metadata = arrays.schema.metadata or dict()
+            values = {field: np.asarray(arrays.column(arrays.schema.get_field_index(field))) for
+                      field in arrays.schema.names if not field.startswith('__index_level_')}
+
+            if b'index' in metadata and LID_label not in values: # Query result (LIDs and IDs as metadata)
+
+                if json.loads(metadata[b'index_names']) != [LID_label, ID_label]:
+                    raise ValueError(f"Only not aggregated query results are supported (table: '{name}')")
+
+                by_pair = False
+                LIDs, IDs = json.loads(metadata[b'index'])
+                order = 'C' if metadata[b'sorted_by'] == b'0' else 'F'
+                values = {field: array.reshape((len(LIDs), len(IDs)), order=order) for field, array in values.items()}
+                values[LID_label] = LIDs
+                values[ID_label] = IDs
+
+            arrays = values
+
+        missing_fields = [field for field in (LID_label, ID_label) if field not in arrays]
+        unknown_fields = [field for field in arrays if field not in columns]
+
+        if missing_fields:
+            raise ValueError("Missing field/s: {} (table: '{}')".format(', '.join(missing_fields), name))
+
+        if unknown_fields:
+            raise ValueError("Unknown field/s: {} (table: '{}')".format(', '.join(unknown_fields), name))
+
+        LIDs = np.asarray(arrays[LID_label]).reshape(-1)
+        IDs = np.asarray(arrays[ID_label]).reshape(-1)
+        fields = [(field, np.asarray(arrays[field])) for field in columns[2:] if field in arrays]
+
+        if by_pair: # LIDs are kept in order of appearance
+            LIDs_unique, index = np.unique(LIDs, return_index=True)
+            order = np.argsort(LIDs, kind='stable')
+            bounds = np.append(np.searchsorted(LIDs[order], LIDs_unique), len(LIDs))
+            subcases = [(LIDs_unique[i], order[bounds[i]:bounds[i + 1]]) for i in np.argsort(index)]
+        else: # Field values given as 2-D arrays (LID, ID)
+            fields = [(field, array.reshape(len(LIDs), len(IDs))) for field, array in fields]
+            subcases = [(LID, i) for i, LID in enumerate(LIDs)]
+
+        for LID, rows in subcases:
+            data = np.empty(len(IDs[rows]) if by_pair else len(IDs), dtype)
+            data[LID_label] = LID
+            data[ID_label] = IDs[rows] if by_pair else IDs
+
+            for field in columns[2:]:
+                data[field] = get_missing_value(data.dtype[field])
+
+            for field, array in fields:
+                data[field] = array[rows]
+
+            yield ResultsTable(data=data, name=name, subcase=int(LID))
@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import numpy as np
+from loadit.read_results import tables_in_file, ResultsTable
+from loadit.misc import get_hasher, hash_bytestr, humansize
+import logging
+
+
+log = logging.getLogger()
+
+
+class ResultsCache(object):
+    """
+    Store parsed result files on disk (one .npy file for each table).
+
+    Entries are keyed by the result file contents along with the tables
+    specifications, so any change of either one invalidates them. Least
+    recently used entries are evicted once the cache exceeds its size limit.
+    """
+
+    def __init__(self, path, max_size=10e9, hash_function='sha256'):
+        """
+        Initialize a ResultsCache instance.
+
+        Parameters
+        ----------
+        path : str
+            Cache directory (created if needed).
+        max_size : int, optional
+            Cache size limit (in bytes).
+        hash_function : str, optional
+            Hash function used to identify result files.
+        """
+        self.path = path
+        self.max_size = int(max_size)
+        self.hash_function = hash_function
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_key(self, file, tables_specs):
+        """
+        Get the cache key of a result file.
+
+        Parameters
+        ----------
+        file : str
+            Result file path.
+        tables_specs : dict
+            Tables specifications.
+
+        Returns
+        -------
+        str
+            Cache key.
+        """
+        hasher = get_hasher(self.hash_function)
+        hasher.update(json.dumps(tables_specs, sort_keys=True).encode())
+
+        with open(file, 'rb') as f:
+            hasher.update(hash_bytestr(f, get_hasher(self.hash_function), blocksize=2**20, ashexstr=False))
+
+        return hasher.hexdigest()
+
+    def tables(self, file, tables_specs=None, **kwargs):
+        """
+        Iterate over the tables of a result file (parsing it only if not cached yet).
+
+        Parameters
+        ----------
+        file : str
+            Result file path.
+        tables_specs : dict, optional
+            Tables specifications.
+        **kwargs
+            Additional parsing options (see `tables_in_file`).
+
+        Yields
+        ------
+        ResultsTable
+            Table found in the file.
+        """
+        entry = os.path.join(self.path, self.get_key(file, tables_specs))
+
+        if os.path.exists(entry):
+            log.info(f"Reading '{os.path.basename(file)}' from cache...")
+            os.utime(entry) # Mark entry as recently used
+            yield from self._read_entry(entry)
+            return
+
+        entry_temp = f'{entry}.{os.getpid()}.tmp'
+        os.makedirs(entry_temp)
+
+        try:
+            tables = list()
+
+            for i, table in enumerate(tables_in_file(file, tables_specs, **kwargs)):
+                metadata = dict(table.__dict__, data=None)
+
+                if table.data is not None:
+                    metadata['data'] = f'{i}.npy'
+                    np.save(os.path.join(entry_temp, metadata['data']), table.data)
+
+                tables.append(metadata)
+                yield table
+
+            with open(os.path.join(entry_temp, '#tables.json'), 'w') as f:
+                json.dump(tables, f)
+
+            try:
+                os.rename(entry_temp, entry)
+            except OSError: # Already cached by another process
+                pass
+
+        finally:
+            shutil.rmtree(entry_temp, ignore_errors=True)
+
+        self.evict()
+
+    def _read_entry(self, entry):
+
+        with open(os.path.join(entry, '#tables.json')) as f:
+            tables = json.load(f)
+
+        for metadata in tables:
+            table = ResultsTable(**metadata)
+
+            if table.data is not None:
+                table.data = np.load(os.path.join(entry, table.data))
+
+            yield table
+
+    def entries(self):
+        """
+        Get cache entries (least recently used first).
+
+        Returns
+        -------
+        list of (str, float, int)
+            Entry path, last access time and size (in bytes) of each entry.
+        """
+        entries = list()
+
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+
+            if name.endswith('.tmp') or not os.path.isdir(entry):
+                continue
+
+            size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            entries.append((entry, os.path.getmtime(entry), size))
+
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits within its size limit.
+        """
+        entries = self.entries()
+        size = sum(entry_size for _, _, entry_size in entries)
+
+        for entry, _, entry_size in entries:
+
+            if size <= self.max_size:
+                break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
+
+        log.debug(f'Results cache size: {humansize(size)}')
+
+    def clear(self):
+        """
+        Remove all cache entries (i.e. after changing the tables specifications).
+        """
+
+        for entry, _, _ in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
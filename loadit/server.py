@@ -17,7 +17,7 @@ from loadit.resource_lock import ResourceLock
 from loadit.database import Database, create_database, parse_query
 from loadit.sessions import Sessions
 from loadit.connection import Connection
-from loadit.connection_tools import recv_tables, get_ip, find_free_port
+from loadit.connection_tools import recv_tables, recv_arrays, get_ip, find_free_port
 from loadit.misc import humansize, get_hasher, hash_bytestr
 import loadit.log as log
 
@@ -86,7 +86,7 @@ class CentralQueryHandler(socketserver.BaseRequestHandler):
             if request_type != 'create_database' and query['path'] not in self.server.databases:
                 raise ValueError("Database '{}' not available!".format(query['path']))
 
-            if  request_type in ('create_database', 'new_batch',
+            if  request_type in ('create_database', 'new_batch', 'new_batch_from_arrays',
                                  'restore_database', 'remove_database',
                                  'add_attachment', 'remove_attachment'):
                 node = self.server.server_address[0]
@@ -151,6 +151,7 @@ class WorkerQueryHandler(socketserver.BaseRequestHandler):
             with self.server.database_lock.acquire(query['path'],
                                                    block=(request_type in ('create_database',
                                                                            'new_batch',
+                                                                           'new_batch_from_arrays',
                                                                            'restore_database',
                                                                            'add_attachment',
                                                                            'remove_attachment'))):
@@ -166,13 +167,18 @@ class WorkerQueryHandler(socketserver.BaseRequestHandler):
                     db = Database(path)
 
                 if request_type == 'check':
-                    connection.send({'corrupted_files': db.check(), 'header': None})
+                    connection.send({'corrupted_files': db.check(max_nbytes=query.get('max_nbytes')), 'header': None})
                     return
                 elif request_type == 'query':
                     batch = db.query(**parse_query(query))
                 elif request_type == 'new_batch':
                     connection.send(db._get_tables_specs())
-                    db.new_batch(query['files'], query['batch'], query['comment'], table_generator=recv_tables(connection))
+                    db.new_batch(query['files'], query['batch'], query['comment'], table_generator=recv_tables(connection),
+                                 callback=lambda event: connection.send(event, 'progress'))
+                elif request_type == 'new_batch_from_arrays':
+                    connection.send(db._get_tables_specs())
+                    db.new_batch_from_arrays(recv_arrays(connection), query['batch'], query['comment'],
+                                             callback=lambda event: connection.send(event, 'progress'))
                 elif request_type == 'restore_database':
                     db.restore(query['batch'])
                 elif request_type == 'add_attachment':
@@ -200,9 +206,9 @@ class WorkerQueryHandler(socketserver.BaseRequestHandler):
                     self.server.databases[query['path']] = get_database_hash(os.path.join(path, '##header.json'))
 
                 if request_type in ('header', 'create_database',
-                                    'new_batch', 'restore_database',
+                                    'new_batch', 'new_batch_from_arrays', 'restore_database',
                                     'add_attachment', 'remove_attachment'):
-                    header = db.header.__dict__
+                    header = db.header.to_dict()
                 else:
                     header = None
 
@@ -324,12 +330,12 @@ class DatabaseServer(socketserver.TCPServer):
                                           'sync_databases', 'recv_databases',
                                           'add_session', 'remove_session', 'list_sessions') or
                 query['request_type'] == 'create_database' and not self.current_session['create_allowed'] or
-                query['request_type'] in ('new_batch', 'restore_database', 'remove_database',
-                                          'add_attachment', 'remove_attachment') and
+                query['request_type'] in ('new_batch', 'new_batch_from_arrays', 'restore_database',
+                                          'remove_database', 'add_attachment', 'remove_attachment') and
                 (not self.current_session['databases'] or query('path') not in self.current_session['databases'])):
                 raise PermissionError('Not enough privileges!')
 
-        if query['request_type'] in ('recv_databases', 'new_batch', 'restore_database',
+        if query['request_type'] in ('recv_databases', 'new_batch', 'new_batch_from_arrays', 'restore_database',
                                      'create_database', 'remove_database',
                                      'add_attachment', 'remove_attachment'):
             self.current_session['database_modified'] = True
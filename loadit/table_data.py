@@ -1,10 +1,11 @@
 import numpy as np
 from loadit.field_data import FieldData
+from loadit.array_index import ArrayIndex
 
 
 class TableData(object):
 
-    def __init__(self, fields, LIDs, IDs):
+    def __init__(self, fields, LIDs, IDs, batches=None, compression=None, index=None, quantization=None):
         """
         Initialize a TableData instance.
 
@@ -18,12 +19,23 @@ class TableData(object):
             List of LIDs.
         IDs : list of int
             List of IDs.
+        batches : list of int, optional
+            Number of LIDs after each batch (each batch is stored as a separate segment).
+        compression : dict, optional
+            Compression settings of field files (see `FieldData`).
+        index : dict of str: list, optional
+            Block offsets of each segment of each field (only for compressed field files).
+        quantization : dict of str: dict, optional
+            Quantization settings of each quantized field (see `FieldData`).
         """
         self._LIDs = LIDs
         self._IDs = IDs
-        self._iLIDs = {LID: i for i, LID in enumerate(LIDs)}
-        self._iIDs = {ID: i for i, ID in enumerate(IDs)}
-        self._fields = {name: FieldData(name, dtype, file, LIDs, IDs, self._iLIDs, self._iIDs) for
+        self._iLIDs = ArrayIndex(LIDs)
+        self._iIDs = ArrayIndex(IDs)
+        segments = None if batches is None else list(zip([0] + batches[:-1], batches))
+        self._fields = {name: FieldData(name, dtype, file, LIDs, IDs, self._iLIDs, self._iIDs, segments,
+                                        compression, index[name] if compression else None,
+                                        quantization.get(name) if quantization else None) for
                         name, dtype, file in fields}
 
     @property
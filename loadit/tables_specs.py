@@ -1,4 +1,12 @@
 import sys
+import json
+import copy
+from functools import lru_cache
+
+
+# User-registered tables specifications (see `register_table_specs`)
+_registered_tables_specs = dict()
+_registry_version = 0
 
 
 def get_tables_specs():
@@ -54,13 +62,13 @@ def get_tables_specs():
             'pch_format': [
                 [('LID', 'i8'), ('EID', 'i8'), ('NX', 'f4'), ('NY', 'f4'), ('NXY', 'f4'), ('MX', 'f4'), ('MY', 'f4'), ('MXY', 'f4'), ('QX', 'f4'), ('QY', 'f4'), ('', ''),],
             ],
+        },
         'ELEMENT FORCES - BAR (34)': {
             'columns': ['LID', 'EID', 'M1A', 'M2A', 'M1B', 'M2B', 'V1', 'V2', 'FX', 'T',],
             'pch_format':[
                 [('LID', 'i8'), ('EID', 'i8'), ('M1A', 'f4'), ('M2A', 'f4'), ('M1B', 'f4'), ('M2B', 'f4'), ('V1', 'f4'), ('V2', 'f4'), ('FX', 'f4'), ('T', 'f4'), ('', ''),],
             ],
         },
-        },
         'ELEMENT FORCES - TRIA3 (74)': {
             'columns': ['LID', 'EID', 'NX', 'NY', 'NXY', 'MX', 'MY', 'MXY', 'QX', 'QY',],
             'pch_format': [
@@ -81,9 +89,117 @@ def get_tables_specs():
             ],
         },
     }
+    tables_specs.update(copy.deepcopy(_registered_tables_specs))
 
     for table_type in tables_specs:
         tables_specs[table_type]['dtypes'] = {name: ('<' if sys.byteorder == 'little' else '>') + dtype for
                                               row in tables_specs[table_type]['pch_format'] for name, dtype in row if name}
 
     return tables_specs
+
+
+def register_table_specs(name, columns, pch_format):
+    """
+    Register a new table (or override an already existing one).
+
+    Parameters
+    ----------
+    name : str
+        Table name (i.e. 'ELEMENT FORCES - HEXA (67)').
+    columns : list of str
+        Fields to be stored. The first two ones must be the LID and ID fields.
+    pch_format : list of list of (str, str)
+        Fixed-width fields of each record (field name and type). Fields not stored
+        are labeled as ('', '').
+    """
+    fields = {field for row in pch_format for field, _ in row if field}
+    missing_fields = [field for field in columns if field not in fields]
+
+    if missing_fields:
+        raise ValueError('Missing field/s in pch_format: {}'.format(', '.join(missing_fields)))
+
+    global _registry_version
+    _registered_tables_specs[name] = {
+        'columns': list(columns),
+        'pch_format': [[tuple(field) for field in row] for row in pch_format],
+    }
+    _registry_version += 1
+
+
+def get_registry_version():
+    """
+    Get the version of the registered tables specifications (it changes each time
+    `register_table_specs` is called).
+
+    Returns
+    -------
+    int
+        Registry version.
+    """
+    return _registry_version
+
+
+def get_decode_plans(tables_specs):
+    """
+    Get decode plans of each table (compiled only once for each tables specifications).
+
+    Parameters
+    ----------
+    tables_specs : dict
+        Tables specifications.
+
+    Returns
+    -------
+    dict of str: DecodePlan
+        Decode plan of each table.
+    """
+
+    if not tables_specs:
+        return dict()
+
+    return _compile_tables_specs(json.dumps(tables_specs, sort_keys=True))
+
+
+@lru_cache(maxsize=16)
+def _compile_tables_specs(tables_specs):
+    return {name: DecodePlan(name, table_specs) for name, table_specs in json.loads(tables_specs).items()}
+
+
+class DecodePlan(object):
+    """
+    Precomputed decoding instructions of a table.
+    """
+
+    def __init__(self, name, table_specs, width=18):
+        """
+        Initialize a DecodePlan instance.
+
+        Parameters
+        ----------
+        name : str
+            Table name.
+        table_specs : dict
+            Table specifications.
+        width : int, optional
+            Field width (in characters).
+        """
+        self.name = name
+        self.width = width
+        self.names = [field if field else f'foo{i}' for i, field in
+                      enumerate(field for row in table_specs['pch_format'] for field, _ in row)]
+        self.dtype = [(field, table_specs['dtypes'][field]) for field in table_specs['columns']]
+        self.fields = list()
+
+        # Location of each field: index within the record, line within the record and line position
+        # (1st line: subcase + item ID + 3 fields, continuation lines: 3 fields each)
+        for field, dtype in self.dtype:
+            index = self.names.index(field)
+
+            if index == 0: # Subcase
+                line, position = None, None
+            elif index < 5:
+                line, position = 0, width * (index - 1)
+            else:
+                line, position = 1 + (index - 5) // 3, width * (1 + (index - 5) % 3)
+
+            self.fields.append((field, dtype, index, line, position))
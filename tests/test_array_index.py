@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+from loadit.array_index import ArrayIndex
+
+
+def as_dict(keys):
+    return {key: i for i, key in enumerate(keys)} # Duplicated keys: last position
+
+
+def assert_same_lookups(index, keys, queries):
+    positions = as_dict(keys)
+    expected = [positions.get(key, -1) for key in queries]
+    assert len(index) == len(keys)
+    assert_array_equal(index.find(queries)[0], expected)
+    assert_array_equal(index.find(queries)[1], [key in positions for key in queries])
+    assert_array_equal(index.missing(queries), [key for key in queries if key not in positions])
+
+    for key in queries:
+        assert (key in index) == (key in positions)
+
+
+def test_find():
+    keys = [30, 10, 20, 50, 40]
+    index = ArrayIndex(keys)
+    positions, found = index.find([20, 60, 30, 5, 45, 40])
+    assert_array_equal(positions, [2, -1, 0, -1, -1, 4])
+    assert_array_equal(found, [True, False, True, False, False, True])
+    assert index[50] == 3
+    assert_same_lookups(index, keys, [5, 10, 15, 20, 30, 40, 50, 55])
+
+
+def test_duplicated_keys():
+    keys = [7, 3, 7, 1, 3, 7]
+    index = ArrayIndex(keys)
+    assert_array_equal(index.get_positions([7, 3, 1]), [5, 4, 3])
+    assert_same_lookups(index, keys, [0, 1, 2, 3, 7, 8])
+
+
+def test_get_positions():
+    index = ArrayIndex(np.array([4, 2, 8], dtype='<i8'))
+    assert_array_equal(index.get_positions([8, 4, 4, 2]), [2, 0, 0, 1])
+    assert_array_equal(index.get_positions([]), [])
+
+    with pytest.raises(KeyError) as error:
+        index.get_positions([2, 3, 5])
+
+    assert error.value.args == (3,)
+
+    with pytest.raises(KeyError):
+        index[6]
+
+
+def test_missing():
+    index = ArrayIndex([1, 2, 3])
+    assert_array_equal(index.missing([3, 4, 1, 0, 4]), [4, 0, 4])
+    assert_array_equal(index.missing([2, 1]), [])
+
+
+def test_empty_index():
+    index = ArrayIndex([], dtype='<i8')
+    assert len(index) == 0
+    assert 1 not in index
+    assert_array_equal(index.find([1, 2])[0], [-1, -1])
+    assert_array_equal(index.missing([1, 2]), [1, 2])
+    assert_array_equal(index.get_positions([]), [])
+
+    with pytest.raises(KeyError):
+        index.get_positions([1])
+
+    index.add([5, 3])
+    assert_same_lookups(index, [5, 3], [3, 4, 5])
+
+
+def test_add():
+    keys = [10, 40, 20]
+    index = ArrayIndex(keys, dtype='<i8')
+
+    for new_keys in ([30, 15, 50], [5], [25, 35, 45, 35], [20, 10], []): # Between, before, after and existing keys
+        index.add(new_keys)
+        keys += new_keys
+        assert_same_lookups(index, keys, list(range(0, 60, 5)))
+
+    assert index[35] == 10 # Duplicated within the same keys added
+    assert index[20] == 11 # Duplicated: last position
@@ -0,0 +1,483 @@
+import os
+import json
+import sys
+import shutil
+import time
+import subprocess
+import threading
+import numpy as np
+import pyarrow as pa
+from numpy.testing import assert_array_equal
+import pytest
+import loadit.database
+import loadit.database_creation
+from loadit.database import create_database, Database
+from loadit.field_data import QUANTIZATION_ERRORS
+from loadit.read_results import tables_in_arrays
+from loadit.tables_specs import get_tables_specs
+from loadit.benchmark import write_pch
+
+
+ROD = 'ELEMENT FORCES - ROD (1)'
+BAR = 'ELEMENT FORCES - BAR (34)'
+QUAD4 = 'ELEMENT FORCES - QUAD4 (33)'
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(loadit.database_creation, 'CHUNK_SIZE', 64)
+    path = str(tmp_path / 'database')
+    database = create_database(path)
+    rng = np.random.default_rng(0)
+    database.new_batch_from_arrays({ROD: {'LID': np.arange(1, 11), 'EID': np.arange(1, 21) * 10,
+                                          'FX': rng.standard_normal((10, 20)),
+                                          'T': rng.standard_normal((10, 20))},
+                                    BAR: {'LID': np.arange(1, 6), 'EID': np.arange(1, 9),
+                                          'FX': rng.standard_normal((5, 8))}}, 'batch_0')
+    return path
+
+
+def get_chunks(database, tables=None):
+    chunks = set()
+
+    for name in (database.header.tables if tables is None else tables):
+        header = database.header.tables[name]
+
+        for filename, (size, chunk_hashes) in header['chunks']['files'].items():
+            file = os.path.join(database.path, name, filename)
+            chunks.update((file, i * header['chunks']['size']) for i in range(len(chunk_hashes)))
+
+    return chunks
+
+
+@pytest.fixture
+def chunks_checked(monkeypatch):
+    hash_files = loadit.database.hash_files
+    chunks_checked = list()
+
+    def hash_files_spy(files, *args, **kwargs):
+        chunks_checked.append([(file, offset) for file, offset, size in files if size is not None])
+        return hash_files(files, *args, **kwargs)
+
+    monkeypatch.setattr(loadit.database, 'hash_files', hash_files_spy)
+    return chunks_checked
+
+
+def check_until_done(database_path, chunks, chunks_checked, checked=None, max_nbytes=200):
+    """
+    Check the database (from a new instance each time) until every chunk is checked.
+    """
+    checked = list() if checked is None else checked
+
+    for _ in range(len(chunks)):
+        assert Database(database_path).check(max_nbytes=max_nbytes) == []
+        assert 0 < len(chunks_checked[-1]) <= max_nbytes // 64
+        checked += chunks_checked[-1]
+
+        if set(checked) >= chunks:
+            break
+
+    return checked
+
+
+def test_check_resumes_across_instances(database_path, chunks_checked):
+    chunks = get_chunks(Database(database_path))
+    assert len(chunks) > 20
+
+    # Each chunk is checked once before starting over
+    for _ in range(2):
+        checked = check_until_done(database_path, chunks, chunks_checked)
+        assert sorted(checked) == sorted(chunks)
+
+
+def test_check_resumes_regardless_of_tables(database_path, chunks_checked):
+    database = Database(database_path)
+    chunks = get_chunks(database)
+    chunks_rod = get_chunks(database, [ROD])
+    checked = list()
+
+    for _ in range(3):
+        assert Database(database_path).check([ROD], max_nbytes=200) == []
+        assert set(chunks_checked[-1]) <= chunks_rod
+        checked += chunks_checked[-1]
+
+    check_until_done(database_path, chunks, chunks_checked, checked)
+    assert sorted(checked) == sorted(chunks)
+
+
+def test_watch_metrics(tmp_path):
+    tables_specs = {name: spec for name, spec in get_tables_specs().items() if name in (ROD, BAR)}
+    drop_path = tmp_path / 'drop'
+    drop_path.mkdir()
+    stop_file = str(tmp_path / 'done')
+    files = [str(tmp_path / f'run_{i}.pch') for i in range(2)]
+    contents = list()
+
+    for i, file in enumerate(files):
+        write_pch(file, tables_specs, n_subcases=3, n_IDs=20, seed=i)
+
+        with open(file, 'rb') as f:
+            contents.append(f.read())
+
+    def solver(): # Result files written in two steps each
+        time.sleep(0.1)
+
+        for file, content in zip(files, contents):
+
+            with open(drop_path / os.path.basename(file), 'wb') as f:
+                f.write(content[:len(content) // 2])
+                f.flush()
+                time.sleep(0.2)
+                f.write(content[len(content) // 2:])
+
+            time.sleep(0.1)
+
+        open(stop_file, 'w').close()
+
+    events = list()
+    thread = threading.Thread(target=solver)
+    thread.start()
+    database = create_database(str(tmp_path / 'watched'))
+    metrics = database.watch(str(drop_path), 'batch_0', poll_interval=0.01, stop_file=stop_file,
+                             callback=events.append).to_dict()
+    thread.join()
+
+    assert metrics['files'] == 2
+    assert metrics['nbytes_parsed'] == sum(len(content) for content in contents)
+    assert [event['file'] for event in events if event['event'] == 'file'] == [os.path.basename(file) for
+                                                                               file in files]
+
+    # Same data as a regular batch
+    expected = create_database(str(tmp_path / 'expected'))
+    expected.new_batch(files, 'batch_0')
+
+    for name in (ROD, BAR):
+        assert (database.query(table=name).to_pandas().equals(expected.query(table=name).to_pandas()))
+
+
+def test_watch_late_start(tmp_path):
+    tables_specs = {name: spec for name, spec in get_tables_specs().items() if name in (ROD, BAR)}
+    drop_path = tmp_path / 'drop'
+    drop_path.mkdir()
+    file = str(tmp_path / 'run_0.pch')
+    write_pch(file, tables_specs, n_subcases=2, n_IDs=20, seed=0)
+
+    def solver(): # Nothing written for longer than idle_timeout
+        time.sleep(0.5)
+        shutil.copy(file, drop_path / 'run_0.pch')
+
+    thread = threading.Thread(target=solver)
+    thread.start()
+    database = create_database(str(tmp_path / 'watched'))
+    metrics = database.watch(str(drop_path), 'batch_0', poll_interval=0.01, idle_timeout=0.2).to_dict()
+    thread.join()
+    assert metrics['files'] == 1
+
+    expected = create_database(str(tmp_path / 'expected'))
+    expected.new_batch([file], 'batch_0')
+
+    for name in (ROD, BAR):
+        assert (database.query(table=name).to_pandas().equals(expected.query(table=name).to_pandas()))
+
+
+def test_watch_concurrent_runs(tmp_path):
+    tables_specs = {name: spec for name, spec in get_tables_specs().items() if name in (ROD, BAR)}
+    drop_path = tmp_path / 'drop'
+    drop_path.mkdir()
+    files = [str(tmp_path / f'run_{i}.pch') for i in range(2)]
+
+    for i, file in enumerate(files):
+        write_pch(file, tables_specs, n_subcases=3, n_IDs=20, seed=i)
+
+    with open(files[0], 'rb') as f:
+        content = f.read()
+
+    def solver(): # Second run written while the first one is paused
+        with open(drop_path / 'run_0.pch', 'wb') as f:
+            f.write(content[:len(content) // 2])
+            f.flush()
+            time.sleep(0.2)
+            shutil.copy(files[1], drop_path / 'run_1.pch')
+            time.sleep(0.3)
+            f.write(content[len(content) // 2:])
+
+    thread = threading.Thread(target=solver)
+    thread.start()
+    database = create_database(str(tmp_path / 'watched'))
+    metrics = database.watch(str(drop_path), 'batch_0', poll_interval=0.01, idle_timeout=1.0).to_dict()
+    thread.join()
+    assert metrics['files'] == 2
+    assert metrics['nbytes_parsed'] == len(content) + os.path.getsize(files[1])
+
+    # First file not cut off
+    expected = create_database(str(tmp_path / 'expected'))
+    expected.new_batch(files, 'batch_0')
+
+    for name in (ROD, BAR):
+        assert (database.query(table=name).to_pandas().equals(expected.query(table=name).to_pandas()))
+
+
+def get_files(path):
+    """
+    Contents of every file of a database.
+    """
+    files = dict()
+
+    for root, _, filenames in os.walk(path):
+
+        for filename in filenames:
+            file = os.path.join(root, filename)
+
+            with open(file, 'rb') as f:
+                files[os.path.relpath(file, path)] = f.read()
+
+    return files
+
+
+def new_tables(n_LIDs=4, seed=1):
+    rng = np.random.default_rng(seed)
+    return {ROD: {'LID': np.arange(101, 101 + n_LIDs), 'EID': np.arange(1, 23) * 10,
+                  'FX': rng.standard_normal((n_LIDs, 22))},
+            QUAD4: {'LID': np.arange(101, 101 + n_LIDs), 'EID': np.arange(1, 6),
+                    'NX': rng.standard_normal((n_LIDs, 5))}}
+
+
+@pytest.mark.parametrize('error', [RuntimeError, KeyboardInterrupt])
+def test_failed_batch_rolled_back(database_path, error):
+    files = get_files(database_path)
+    assert '#journal.json' not in files
+    database = Database(database_path)
+    database_specs = database._get_tables_specs()
+
+    def failing_generator():
+        yield from tables_in_arrays(new_tables(), database_specs)
+        assert os.path.exists(os.path.join(database_path, '#journal.json'))
+        raise error()
+
+    with pytest.raises(error):
+        database.new_batch(list(), 'batch_1', table_generator=failing_generator())
+
+    assert get_files(database_path) == files
+    assert [batch[0] for batch in database.header.batches] == ['batch_0']
+    assert set(database.header.tables) == {ROD, BAR}
+    assert os.path.realpath(database_path) not in loadit.database._running_batches
+
+    # The database can be used right away (from the same process)
+    database.new_batch_from_arrays(new_tables(), 'batch_1')
+    assert [batch[0] for batch in Database(database_path).header.batches] == ['batch_0', 'batch_1']
+
+
+KILLED_BATCH = '''
+import sys
+import shutil
+import time
+from loadit.database import Database
+from loadit.read_results import tables_in_arrays
+from test_database import new_tables
+
+database = Database(sys.argv[1])
+
+def stalled_generator():
+    yield from tables_in_arrays(new_tables(), database._get_tables_specs())
+    open(sys.argv[2], 'w').close()
+    time.sleep(60)
+
+database.new_batch(list(), 'batch_1', table_generator=stalled_generator())
+'''
+
+
+def test_killed_batch_rolled_back(database_path, tmp_path):
+    files = get_files(database_path)
+    started_file = str(tmp_path / 'started')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(__file__)] + sys.path))
+    process = subprocess.Popen([sys.executable, '-c', KILLED_BATCH, database_path, started_file], env=env)
+
+    try:
+
+        for _ in range(600):
+
+            if os.path.exists(started_file) or process.poll() is not None:
+                break
+
+            time.sleep(0.1)
+
+        assert os.path.exists(started_file)
+        assert os.path.exists(os.path.join(database_path, '#journal.json'))
+        assert os.path.exists(os.path.join(database_path, QUAD4)) # New table created
+    finally:
+        process.kill()
+        process.wait()
+
+    database = Database(database_path)
+    assert get_files(database_path) == files
+    assert [batch[0] for batch in database.header.batches] == ['batch_0']
+    assert database.check() == []
+
+
+def query_arrays(database, table, fields=None, **kwargs):
+    """
+    Query a table, getting the values of each field as 2-D arrays (LID, ID).
+    """
+    batch = database.query(table=table, fields=fields, **kwargs)
+    LIDs, IDs = json.loads(batch.schema.metadata[b'index'])
+    return LIDs, IDs, {field: batch.column(field).to_numpy(zero_copy_only=False).reshape(len(LIDs), len(IDs)) for
+                       field in batch.schema.names}
+
+
+def storage_batches(seed=2):
+    rng = np.random.default_rng(seed)
+    FX = rng.standard_normal((6, 40)) * 1000
+    FX[2, 3] = np.nan
+    batch_0 = {ROD: {'LID': np.arange(1, 7), 'EID': np.arange(1, 41) * 10, 'FX': FX,
+                     'T': rng.standard_normal((6, 40))},
+               BAR: {'LID': np.arange(1, 4), 'EID': np.arange(1, 9),
+                     'V1': rng.standard_normal((3, 8)), 'V2': rng.standard_normal((3, 8))}}
+    batch_1 = {ROD: {'LID': np.arange(7, 12), 'EID': np.arange(5, 46) * 10, # Some new EIDs
+                     'FX': rng.standard_normal((5, 41)) * 0.001}} # T not specified
+    return batch_0, batch_1
+
+
+@pytest.mark.parametrize('codec', ['lz4', 'zstd'])
+@pytest.mark.parametrize('shuffle', [True, False])
+def test_compression(tmp_path, monkeypatch, codec, shuffle):
+    monkeypatch.setattr(loadit.database, 'BLOCK_SIZE', 256) # Several blocks for each segment
+    databases = [create_database(str(tmp_path / 'plain')),
+                 create_database(str(tmp_path / codec), compression=codec, shuffle=shuffle)]
+
+    for database in databases:
+
+        for i, batch in enumerate(storage_batches()):
+            database.new_batch_from_arrays(batch, f'batch_{i}')
+
+    plain, compressed = databases
+    assert compressed.header.tables[ROD]['compression']['codec'] == codec
+    assert len(compressed.header.tables[ROD]['index']['FX']) == 2
+    assert compressed.header.nbytes < plain.header.nbytes
+
+    def assert_equal_queries():
+
+        for table, LIDs, IDs in ((ROD, [5, 2, 3], [400, 10, 60]), (BAR, [3, 1], [8, 2])):
+
+            for kwargs in (dict(), dict(LIDs=LIDs, IDs=IDs), dict(sort_by_LID=False)):
+                LIDs, IDs, expected = query_arrays(plain, table, **kwargs)
+                LIDs_compressed, IDs_compressed, values = query_arrays(compressed, table, **kwargs)
+                assert (LIDs_compressed, IDs_compressed) == (LIDs, IDs)
+
+                for field in expected:
+                    assert_array_equal(values[field], expected[field])
+
+    assert_equal_queries()
+    assert compressed.check() == []
+
+    for database in databases:
+        database.restore('batch_0')
+
+    assert len(compressed.header.tables[ROD]['index']['FX']) == 1
+    assert_equal_queries()
+    assert compressed.check() == []
+
+
+@pytest.mark.parametrize('storage', ['f2', 'i2', 'i1'])
+def test_quantization(tmp_path, storage):
+    databases = [create_database(str(tmp_path / 'plain')),
+                 create_database(str(tmp_path / storage), quantization={ROD: storage, BAR: {'V1': storage}})]
+
+    for database in databases:
+
+        for i, batch in enumerate(storage_batches()):
+            database.new_batch_from_arrays(batch, f'batch_{i}')
+
+    plain, quantized = databases
+    quantization = quantized.header.tables[ROD]['quantization']
+    assert set(quantization) == {'FX', 'T'}
+    assert len(quantization['FX']['scales']) == 2
+    assert quantized.header.tables[BAR]['quantization']['V1']['storage'] == '<' + storage
+    assert 'V2' not in quantized.header.tables[BAR]['quantization']
+    max_error = QUANTIZATION_ERRORS['<' + storage]
+
+    def assert_within_bounds(batches):
+        batches_LIDs = [batch[ROD]['LID'] for batch in batches]
+
+        for table in (ROD, BAR):
+            LIDs, IDs, expected = query_arrays(plain, table)
+            assert query_arrays(quantized, table)[:2] == (LIDs, IDs)
+            values = query_arrays(quantized, table)[2]
+
+            for field in expected:
+                assert_array_equal(np.isnan(values[field]), np.isnan(expected[field])) # NaNs kept
+
+                if field not in quantized.header.tables[table]['quantization']:
+                    assert_array_equal(values[field], expected[field])
+                    continue
+
+                for batch_LIDs in (batches_LIDs if table == ROD else [LIDs]): # Error relative to each batch
+                    rows = np.isin(LIDs, batch_LIDs)
+
+                    if np.isnan(expected[field][rows]).all(): # i.e. not specified
+                        continue
+
+                    bound = max_error * np.nanmax(np.abs(expected[field][rows]))
+                    error = np.abs(values[field][rows] - expected[field][rows])
+                    assert np.nanmax(error) <= bound * 1.001, (table, field)
+
+    batches = storage_batches()
+    assert_within_bounds(batches)
+
+    for database in databases:
+        database.restore('batch_0')
+
+    assert len(quantized.header.tables[ROD]['quantization']['FX']['scales']) == 1
+    assert_within_bounds(batches[:1])
+    assert quantized.check() == []
+
+
+def test_new_batch_from_arrays(tmp_path):
+    import pandas as pd
+    database = create_database(str(tmp_path / 'database'))
+    rng = np.random.default_rng(3)
+
+    # Dict of arrays (T not specified)
+    FX = rng.standard_normal((3, 4)).astype(np.float32)
+    database.new_batch_from_arrays({ROD: {'LID': [1, 2, 3], 'EID': [10, 20, 30, 40], 'FX': FX}}, 'dict')
+    LIDs, IDs, values = query_arrays(database, ROD)
+    assert (LIDs, IDs) == ([1, 2, 3], [10, 20, 30, 40])
+    assert_array_equal(values['FX'], FX)
+    assert np.isnan(values['T']).all()
+
+    # DataFrame with a row for each (LID, EID) pair: unsorted, interleaved, some pairs missing
+    # and an EID not in the table (ignored)
+    pairs = pd.DataFrame({'LID': [5, 4, 5, 4, 5, 4, 5],
+                          'EID': [40, 30, 10, 10, 50, 40, 30],
+                          'T': np.arange(7, dtype=np.float32)})
+    database.new_batch_from_arrays({ROD: pairs}, 'pairs')
+    LIDs, IDs, values = query_arrays(database, ROD, LIDs=[4, 5])
+    assert (LIDs, IDs) == ([4, 5], [10, 20, 30, 40])
+    assert_array_equal(values['T'], [[3, np.nan, 1, 5],
+                                     [2, np.nan, 6, 0]])
+    assert np.isnan(values['FX']).all()
+
+    # Filtered DataFrame (its index is not a field), either as it is or converted to an Arrow table
+    pairs = pd.DataFrame({'LID': [8, 8, 8, 9, 9, 9], 'EID': [10, 20, 30, 10, 20, 30],
+                          'FX': np.arange(6, dtype=np.float32)})
+    pairs = pairs[pairs.FX != 4]
+    database.new_batch_from_arrays({ROD: pairs[pairs.LID == 8]}, 'filtered')
+    database.new_batch_from_arrays({ROD: pa.Table.from_pandas(pairs[pairs.LID == 9])}, 'filtered_arrow')
+    LIDs, IDs, values = query_arrays(database, ROD, LIDs=[8, 9], IDs=[10, 20, 30])
+    assert_array_equal(values['FX'], [[0, 1, 2],
+                                      [3, np.nan, 5]])
+    assert np.isnan(values['T']).all()
+
+    # Query result (from another database)
+    other = create_database(str(tmp_path / 'other'))
+    other.new_batch_from_arrays({ROD: {'LID': [7, 6], 'EID': [20, 10], 'FX': [[1, 2], [3, 4]],
+                                       'T': [[5, 6], [7, 8]]}}, 'batch_0')
+
+    for sort_by_LID in (True, False):
+        database.new_batch_from_arrays({ROD: other.query(table=ROD, fields=['T'], sort_by_LID=sort_by_LID)},
+                                       f'query_{sort_by_LID}')
+        LIDs, IDs, values = query_arrays(database, ROD, LIDs=[7, 6], IDs=[20, 10])
+        assert_array_equal(values['T'], [[5, 6], [7, 8]])
+        assert np.isnan(values['FX']).all()
+        database.restore('filtered_arrow')
+
+    assert [batch[0] for batch in database.header.batches] == ['dict', 'pairs', 'filtered', 'filtered_arrow']
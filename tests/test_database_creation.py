@@ -0,0 +1,79 @@
+import os
+import signal
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+import loadit.database_creation
+from loadit.database_creation import pipelined_table_generator, transpose
+from loadit.read_results import tables_in_file
+from loadit.tables_specs import get_tables_specs
+from loadit.benchmark import write_pch
+
+
+ROD = 'ELEMENT FORCES - ROD (1)'
+
+
+@pytest.fixture
+def files(tmp_path):
+    tables_specs = {ROD: get_tables_specs()[ROD]}
+    files = [str(tmp_path / f'run_{i}.pch') for i in range(3)]
+
+    for i, file in enumerate(files):
+        write_pch(file, tables_specs, n_subcases=4, n_IDs=10, seed=i)
+
+    return files
+
+
+def killed_parser(file, tables_specs, queue, cache=None): # i.e. by the OOM killer
+
+    if file.endswith('run_1.pch'):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    loadit.database_creation.put_tables(file, tables_specs, queue, cache)
+
+
+def test_pipelined_table_generator(files):
+    tables_specs = {ROD: get_tables_specs()[ROD]}
+    tables = list(pipelined_table_generator(files, tables_specs, n_workers=2, queue_size=2))
+    expected = [table for file in files for table in tables_in_file(file, tables_specs)]
+    assert [(table.name, table.subcase) for table in tables] == [(table.name, table.subcase) for table in expected]
+    assert all(np.array_equal(table.data, table_expected.data) for table, table_expected in zip(tables, expected))
+
+
+def test_pipelined_table_generator_parser_died(files, monkeypatch):
+    tables_specs = {ROD: get_tables_specs()[ROD]}
+    Process = loadit.database_creation.Process
+    monkeypatch.setattr(loadit.database_creation, 'Process',
+                        lambda target, args, daemon: Process(target=killed_parser, args=args, daemon=daemon))
+    tables = list()
+
+    with pytest.raises(RuntimeError, match="'run_1.pch' died"):
+
+        for table in pipelined_table_generator(files, tables_specs, n_workers=2, poll_interval=0.1):
+            tables.append(table)
+
+    assert len(tables) == 4 # Tables of the first file
+
+
+@pytest.mark.parametrize('dtype', ['<f4', '<f8', '<i2'])
+@pytest.mark.parametrize('n_threads', [1, 3])
+@pytest.mark.parametrize('n_cols_per_band', [1, 5, None]) # None: a single band
+def test_transpose(tmp_path, dtype, n_threads, n_cols_per_band):
+    file = str(tmp_path / 'field.bin')
+    n_rows, n_cols = 37, 53
+    array = np.arange(n_rows * n_cols).astype(dtype).reshape(n_rows, n_cols)
+    prefix = b'previous segments' # Array stored at an offset
+
+    with open(file, 'wb') as f:
+        f.write(prefix)
+        array.tofile(f)
+
+    itemsize = np.dtype(dtype).itemsize
+    max_memory = None if n_cols_per_band is None else 2 * (n_threads + 1) * n_rows * itemsize * n_cols_per_band
+    transpose(file, len(prefix), (n_rows, n_cols), dtype, max_memory, n_threads,
+              tile_size=4) # Tiles not dividing the array (nor the bands)
+
+    with open(file, 'rb') as f:
+        assert f.read(len(prefix)) == prefix
+        assert_array_equal(np.fromfile(f, dtype=dtype, count=n_rows * n_cols).reshape(n_rows, n_cols), array)
+        assert_array_equal(np.fromfile(f, dtype=dtype).reshape(n_cols, n_rows), array.T)
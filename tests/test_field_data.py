@@ -0,0 +1,82 @@
+import json
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+from loadit.database import create_database
+from loadit.field_data import gather_rows, estimate_pages, PAGE_SIZE
+
+
+ROD = 'ELEMENT FORCES - ROD (1)'
+
+
+@pytest.fixture
+def data(tmp_path):
+    array = np.arange(200 * 7, dtype=np.float32).reshape(200, 7)
+    file = str(tmp_path / 'data.bin')
+    array.tofile(file)
+    return np.memmap(file, dtype=np.float32, shape=array.shape, mode='r')
+
+
+@pytest.mark.parametrize('rows', [
+    [10, 11, 12, 13],                 # Consecutive
+    [10, 15, 20, 100],                # Gaps below max_gap
+    [10, 19, 28, 37],                 # Gaps equal to max_gap
+    [10, 20, 30, 199],                # Gaps above max_gap
+    [0, 3, 12, 13, 60, 61, 70, 199],  # Several runs
+    [50, 3, 120, 4, 199, 0],          # Unsorted
+    [7, 7, 30, 7, 2, 30],             # Repeated
+    [42],
+    [],
+])
+@pytest.mark.parametrize('columns', [slice(None), np.array([6, 0, 3]), slice(2, 5)])
+def test_gather_rows(data, rows, columns):
+    rows = np.array(rows, dtype=np.int64)
+    values = gather_rows(data, rows, columns, max_gap=8)
+    assert values.shape == np.asarray(data)[rows][:, columns].shape
+    assert_array_equal(values, np.asarray(data)[rows][:, columns])
+
+
+def test_gather_rows_transposed(data):
+    rows = np.array([5, 1, 6, 2])
+    assert_array_equal(gather_rows(data.T, rows, np.array([199, 0, 50])), np.asarray(data).T[rows][:, [199, 0, 50]])
+
+
+def test_estimate_pages():
+    itemsize = 4
+    n_cols = PAGE_SIZE // itemsize // 8 # 8 rows per page
+    assert estimate_pages(64, n_cols, itemsize) == 8
+    assert estimate_pages(64, n_cols, itemsize, rows=np.array([0, 7, 3])) == 1
+    assert estimate_pages(64, n_cols, itemsize, rows=np.array([0, 8, 16, 16])) == 3
+
+    n_cols = PAGE_SIZE // itemsize * 4 # 4 pages per row
+    assert estimate_pages(10, n_cols, itemsize) == 40
+    assert estimate_pages(10, n_cols, itemsize, rows=np.array([1, 5])) == 8
+    assert estimate_pages(10, n_cols, itemsize, rows=np.array([1, 5]), columns=np.array([0, 1, 2])) == 2
+    assert estimate_pages(10, n_cols, itemsize, columns=np.array([0, n_cols - 1])) == 20
+
+
+def test_query_layouts(tmp_path):
+    database = create_database(str(tmp_path / 'database'))
+    rng = np.random.default_rng(0)
+    IDs = np.arange(1, 1201) # ID-ordered rows smaller than a page, LID-ordered rows larger
+    batches = [(np.arange(1, 601), rng.standard_normal((600, len(IDs)))),
+               (np.arange(601, 621), rng.standard_normal((20, len(IDs))))]
+
+    for i, (LIDs, FX) in enumerate(batches):
+        database.new_batch_from_arrays({ROD: {'LID': LIDs, 'EID': IDs, 'FX': FX}}, f'batch_{i}')
+
+    LIDs = np.concatenate(([LID for LID, _ in batches]))
+    FX = np.concatenate(([FX for _, FX in batches])).astype(np.float32)
+
+    # All the LIDs of the first segment (read by ID) and a few of the second one (read by LID)
+    query_LIDs = list(range(600, 0, -1)) + [615, 603]
+    query_IDs = [900, 7, 300] # Within a page of each LID-ordered row
+    batch = database.query(table=ROD, fields=['FX'], LIDs=query_LIDs, IDs=query_IDs)
+    assert json.loads(batch.schema.metadata[b'layouts']) == {'FX': ['ID', 'LID']}
+
+    LIDs_queried, IDs_queried = json.loads(batch.schema.metadata[b'index'])
+    expected = FX[np.searchsorted(LIDs, LIDs_queried)][:, np.searchsorted(IDs, IDs_queried)]
+    values = batch.column('FX').to_numpy().reshape(len(LIDs_queried), len(IDs_queried))
+    assert sorted(LIDs_queried) == sorted(query_LIDs)
+    assert sorted(IDs_queried) == sorted(query_IDs)
+    assert_array_equal(values, expected)
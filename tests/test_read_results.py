@@ -0,0 +1,282 @@
+import gzip
+import bz2
+import lzma
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+from loadit.read_results import tables_in_op2, tables_in_pch, split_blocks, get_compression, decode_field
+from loadit.tables_specs import get_tables_specs
+from loadit.benchmark import write_pch, write_op2
+
+
+def fortran_record(payload, byteorder='<'):
+    nbytes = np.array([len(payload)], dtype=byteorder + 'i4').tobytes()
+    return nbytes + payload + nbytes
+
+
+def marker(value, byteorder='<'):
+    return fortran_record(np.array([value], dtype=byteorder + 'i4').tobytes(), byteorder)
+
+
+def oef_subcase(element_code, subcase, rows, record_number, byteorder='<'):
+    """
+    IDENT and DATA records of an OEF subcase (rows: element ID followed by float words).
+    """
+    ident = np.zeros(146, dtype=byteorder + 'i4')
+    ident[:4] = [11, 4, element_code, subcase]
+    ident[8:10] = [1, len(rows[0])]
+    words = np.array([[EID * 10 + 1] + list(np.array(values, dtype=byteorder + 'f4').view(byteorder + 'i4')) for
+                      EID, *values in rows], dtype=byteorder + 'i4')
+    return (marker(-record_number, byteorder) + fortran_record(ident.tobytes(), byteorder) +
+            marker(-record_number - 1, byteorder) + fortran_record(words.tobytes(), byteorder))
+
+
+@pytest.fixture(params=['<', '>'])
+def op2_file(tmp_path, request):
+    byteorder = request.param
+    file = tmp_path / 'fixture.op2'
+    rod = [(10, 1.0, 2.0), (20, 3.0, 4.0)] # EID, AF, TRQ
+    bars = [(30, 0.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0), # EID, SD, BM1, BM2, TS1, TS2, AF, TRQ
+            (30, 0.5, 21.0, 22.0, 23.0, 24.0, 25.0, 26.0),
+            (30, 1.0, 31.0, 32.0, 33.0, 34.0, 35.0, 36.0),
+            (40, 0.0, 41.0, 42.0, 43.0, 44.0, 45.0, 46.0),
+            (40, 1.0, 51.0, 52.0, 53.0, 54.0, 55.0, 56.0)]
+
+    with open(file, 'wb') as f:
+        f.write(marker(3, byteorder))
+        f.write(fortran_record(b'OEF1X   ', byteorder) + marker(-1, byteorder))
+        f.write(marker(-2, byteorder) + fortran_record(b'OEF1X   ' + bytes(20), byteorder))
+        f.write(oef_subcase(1, 7, rod, 3, byteorder))
+        f.write(oef_subcase(100, 7, bars, 5, byteorder))
+        f.write(marker(-7, byteorder) + marker(0, byteorder))
+
+    return str(file)
+
+
+def test_tables_in_op2(op2_file):
+    tables = {table.name: table for table in tables_in_op2(op2_file, get_tables_specs())}
+    rod = tables['ELEMENT FORCES - ROD (1)'].data
+    bars = tables['ELEMENT FORCES - BARS (100)'].data
+
+    assert list(rod['LID']) == [7, 7]
+    assert list(rod['EID']) == [10, 20]
+    assert list(rod['FX']) == [1.0, 3.0]
+    assert list(rod['T']) == [2.0, 4.0]
+
+    # A row for each element (first and last stations)
+    assert list(bars['EID']) == [30, 40]
+    assert list(bars['M1A']) == [11.0, 41.0]
+    assert list(bars['M2A']) == [12.0, 42.0]
+    assert list(bars['M1B']) == [31.0, 51.0]
+    assert list(bars['M2B']) == [32.0, 52.0]
+    assert list(bars['V1']) == [13.0, 43.0]
+    assert list(bars['FX']) == [15.0, 45.0]
+    assert list(bars['T']) == [16.0, 46.0]
+
+
+def test_write_op2(tmp_path):
+    file = str(tmp_path / 'synthetic.op2')
+    tables_specs = get_tables_specs()
+    names = write_op2(file, tables_specs, n_subcases=2, n_IDs=5)
+    tables = list(tables_in_op2(file, tables_specs))
+
+    assert [table.name for table in tables] == names * 2
+
+    for table in tables:
+        assert list(table.data['EID']) == [10, 20, 30, 40, 50]
+
+        for field in tables_specs[table.name]['columns'][2:]:
+            assert np.isfinite(table.data[field]).all(), (table.name, field)
+
+
+def test_decode_field_blanks():
+    field = np.array([b'                 1', b'                  '])
+    assert list(decode_field(field, '<i8')) == [1, 0]
+    assert np.isnan(decode_field(field, '<f4')[1])
+
+
+PCH_TABLES = ['ELEMENT FORCES - ROD (1)', 'ELEMENT FORCES - BEAM (2)', 'ELEMENT FORCES - QUAD4 (33)',
+              'ELEMENT FORCES - BARS (100)']
+
+
+@pytest.fixture
+def tables_specs():
+    tables_specs = get_tables_specs()
+    return {name: tables_specs[name] for name in PCH_TABLES}
+
+
+@pytest.fixture
+def pch_file(tmp_path, tables_specs):
+    file = str(tmp_path / 'synthetic.pch')
+    write_pch(file, tables_specs, n_subcases=3, n_IDs=7, seed=3)
+    return file
+
+
+def get_pch_values(tables_specs, n_subcases, n_IDs, seed):
+    """
+    Values written by `write_pch` (as printed) for each table and subcase.
+    """
+    random = np.random.RandomState(seed)
+    values = dict()
+
+    for subcase in range(1, n_subcases + 1):
+
+        for name, table_specs in tables_specs.items():
+            fields = [(field, dtype) for row in table_specs['pch_format'] for field, dtype in row][2:]
+            table_values = random.uniform(-1e4, 1e4, (n_IDs, len(fields)))
+            values[name, subcase] = {field: np.array([int(value) if dtype.startswith('i') else
+                                                      float(f'{value:18.6E}') for value in table_values[:, i]])
+                                     for i, (field, dtype) in enumerate(fields) if field}
+
+    return values
+
+
+def assert_same_tables(tables, expected):
+    assert [(table.name, table.subcase) for table in tables] == [(table.name, table.subcase) for table in expected]
+
+    for table, table_expected in zip(tables, expected):
+        assert table.header == table_expected.header
+        assert table.data.dtype == table_expected.data.dtype
+        assert table.data.tobytes() == table_expected.data.tobytes()
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_tables_in_pch(pch_file, tables_specs, use_mmap):
+    tables = list(tables_in_pch(pch_file, tables_specs, use_mmap=use_mmap))
+    values = get_pch_values(tables_specs, n_subcases=3, n_IDs=7, seed=3)
+    assert [(table.name, table.subcase) for table in tables] == list(values)
+
+    for table in tables:
+        assert table.title == f'SYNTHETIC RESULTS (SUBCASE {table.subcase})'
+        assert list(table.data['LID']) == [table.subcase] * 7
+        assert list(table.data['EID']) == [10, 20, 30, 40, 50, 60, 70]
+
+        for field in tables_specs[table.name]['columns'][2:]: # Multi-line records included (BEAM and BARS)
+            assert_array_equal(table.data[field], values[table.name, table.subcase][field].astype(np.float32),
+                               err_msg=f'{table.name}: {field}')
+
+
+PCH_TEXT = '''$TITLE   = HAND WRITTEN RESULTS
+$SUBTITLE=
+$LABEL   = SHORT LINES AND BLANK FIELDS
+$ELEMENT FORCES
+$REAL OUTPUT
+$SUBCASE ID =           12
+$ELEMENT TYPE =           1  ROD
+        10              1.500000E+01     -2.250000E+00
+        20                                3.000000E+00
+        30             -4.000000E+02
+$TITLE   = HAND WRITTEN RESULTS
+$SUBTITLE=
+$LABEL   = SHORT LINES AND BLANK FIELDS
+$ELEMENT FORCES
+$REAL OUTPUT
+$SUBCASE ID =           12
+$ELEMENT TYPE =          33  QUAD4                                               1
+        40              1.000000E+00      2.000000E+00      3.000000E+00         2
+-CONT-                  4.000000E+00                        6.000000E+00
+-CONT-                  7.000000E+00      8.000000E+00
+        50              1.100000E+01     -1.200000E+01      1.300000E+01
+-CONT-                  1.400000E+01      1.500000E+01      1.600000E+01
+-CONT-                                    1.800000E+01      1.900000E+01
+'''
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_tables_in_pch_blank_fields(tmp_path, tables_specs, use_mmap):
+    file = tmp_path / 'hand_written.pch'
+    file.write_text(PCH_TEXT.rstrip('\n')) # No new line at the end of the file
+    rod, quad4 = tables_in_pch(str(file), tables_specs, use_mmap=use_mmap)
+    assert (rod.name, rod.subcase, rod.label) == ('ELEMENT FORCES - ROD (1)', 12, 'SHORT LINES AND BLANK FIELDS')
+    assert list(rod.data['EID']) == [10, 20, 30]
+    assert_array_equal(rod.data['FX'], [15.0, np.nan, -400.0])
+    assert_array_equal(rod.data['T'], [-2.25, 3.0, np.nan])
+
+    assert quad4.name == 'ELEMENT FORCES - QUAD4 (33)'
+    assert list(quad4.data['EID']) == [40, 50]
+    assert list(quad4.data['LID']) == [12, 12]
+    assert_array_equal([list(row) for row in quad4.data[['NX', 'NY', 'NXY', 'MX', 'MY', 'MXY', 'QX', 'QY']]],
+                       [[1, 2, 3, 4, np.nan, 6, 7, 8],
+                        [11, -12, 13, 14, 15, 16, np.nan, 18]])
+
+
+def rewrite_lines(file, new_file, rewrite):
+    with open(file, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+
+    with open(new_file, 'wb') as f:
+        f.writelines(line for i, line in enumerate(lines) for line in rewrite(i, line))
+
+
+@pytest.mark.parametrize('rewrite', [
+    lambda i, line: [line.replace(b'\n', b'\r\n')], # CRLF
+    lambda i, line: [line[:72].rstrip() + b'\n' if i % 3 else line], # Uneven line lengths
+    lambda i, line: [line[:72] + b'\r\n' if i % 2 else line], # Both
+], ids=['crlf', 'uneven', 'mixed'])
+def test_irregular_blocks(pch_file, tmp_path, tables_specs, rewrite):
+    file = str(tmp_path / 'irregular.pch')
+    rewrite_lines(pch_file, file, rewrite)
+    tables = list(tables_in_pch(file, tables_specs, use_mmap=True))
+    assert_same_tables(tables, list(tables_in_pch(file, tables_specs, use_mmap=False)))
+
+    for table, table_expected in zip(tables, tables_in_pch(pch_file, tables_specs)): # Same values
+        assert table.data.tobytes() == table_expected.data.tobytes()
+
+
+def test_records_spanning_different_lines(pch_file, tmp_path, tables_specs):
+    file = str(tmp_path / 'irregular.pch')
+    removed = list()
+
+    def remove_lines(i, line): # Some continuation lines
+
+        if line.startswith(b'-CONT-') and i % 5 == 0:
+            removed.append(i)
+            return []
+
+        return [line]
+
+    rewrite_lines(pch_file, file, remove_lines)
+    assert removed
+    tables = list(tables_in_pch(file, tables_specs, use_mmap=True))
+    assert_same_tables(tables, list(tables_in_pch(file, tables_specs, use_mmap=False)))
+    n_missing = sum(np.count_nonzero(np.isnan(table.data[field])) for table in tables for
+                    field in tables_specs[table.name]['columns'][2:])
+    assert n_missing > 0
+
+
+def test_split_blocks(pch_file):
+
+    with open(pch_file, 'rb') as f:
+        buffer = f.read()
+
+    table_size = buffer.find(b'\n$TITLE') + 1
+    blocks = split_blocks(buffer, table_size // 2)
+    assert len(blocks) == buffer.count(b'$TITLE') # A table for each block
+    assert blocks[0][0] == 0 and blocks[-1][1] == len(buffer)
+    assert all(end == start for (_, end), (start, _) in zip(blocks[:-1], blocks[1:]))
+    assert all(buffer[start:start + 6] == b'$TITLE' for start, _ in blocks)
+
+
+@pytest.mark.parametrize('chunk_size', [100, 2000])
+def test_tables_in_pch_parallel(pch_file, tables_specs, chunk_size):
+    tables = list(tables_in_pch(pch_file, tables_specs, n_workers=3, chunk_size=chunk_size))
+    assert_same_tables(tables, list(tables_in_pch(pch_file, tables_specs))) # Same tables in file order
+
+
+@pytest.mark.parametrize('compression', [gzip, bz2, lzma], ids=['gz', 'bz2', 'xz'])
+@pytest.mark.parametrize('by_extension', [True, False])
+def test_compressed_pch(pch_file, tmp_path, tables_specs, compression, by_extension):
+    extension = {gzip: '.gz', bz2: '.bz2', lzma: '.xz'}[compression]
+    file = str(tmp_path / ('compressed.pch' + (extension if by_extension else ''))) # Otherwise, by magic bytes
+
+    with open(pch_file, 'rb') as f_in, compression.open(file, 'wb') as f_out:
+        f_out.write(f_in.read())
+
+    assert get_compression(file) is compression
+    assert get_compression(pch_file) is None
+    expected = list(tables_in_pch(pch_file, tables_specs))
+
+    for chunk_size in (50, 1000, 2**27): # Chunks smaller than a table, of a few tables and the whole file
+        assert_same_tables(list(tables_in_pch(file, tables_specs, chunk_size=chunk_size)), expected)
+
+    assert_same_tables(list(tables_in_pch(file, tables_specs, use_mmap=False)), expected)
@@ -0,0 +1,119 @@
+import os
+import time
+import numpy as np
+import pytest
+import loadit.results_cache
+from loadit.results_cache import ResultsCache
+from loadit.read_results import tables_in_file
+from loadit.tables_specs import get_tables_specs
+from loadit.benchmark import write_pch
+
+
+ROD = 'ELEMENT FORCES - ROD (1)'
+BAR = 'ELEMENT FORCES - BAR (34)'
+
+
+@pytest.fixture
+def tables_specs():
+    return {name: spec for name, spec in get_tables_specs().items() if name in (ROD, BAR)}
+
+
+@pytest.fixture
+def files(tmp_path, tables_specs):
+    files = [str(tmp_path / f'run_{i}.pch') for i in range(3)]
+
+    for i, file in enumerate(files):
+        write_pch(file, tables_specs, n_subcases=2, n_IDs=20, seed=i)
+
+    return files
+
+
+@pytest.fixture
+def parsed_files(monkeypatch):
+    parsed_files = list()
+
+    def tables_in_file_spy(file, *args, **kwargs):
+        parsed_files.append(file)
+        yield from tables_in_file(file, *args, **kwargs)
+
+    monkeypatch.setattr(loadit.results_cache, 'tables_in_file', tables_in_file_spy)
+    return parsed_files
+
+
+def assert_same_tables(tables, expected):
+    assert len(tables) == len(expected)
+
+    for table, table_expected in zip(tables, expected):
+        assert (table.name, table.subcase) == (table_expected.name, table_expected.subcase)
+
+        if table_expected.data is None: # Not decoded
+            assert table.data is None
+            continue
+
+        assert table.data.dtype == table_expected.data.dtype
+        assert table.data.tobytes() == table_expected.data.tobytes()
+
+
+def test_cache_hit(tmp_path, files, tables_specs, parsed_files):
+    cache = ResultsCache(str(tmp_path / 'cache'))
+    expected = list(tables_in_file(files[0], tables_specs))
+    assert_same_tables(list(cache.tables(files[0], tables_specs)), expected)
+    assert parsed_files == files[:1]
+    assert len(cache.entries()) == 1
+
+    # Not parsed again (even from another cache instance)
+    assert_same_tables(list(ResultsCache(str(tmp_path / 'cache')).tables(files[0], tables_specs)), expected)
+    assert parsed_files == files[:1]
+    assert len(cache.entries()) == 1
+
+
+def test_cache_invalidation(tmp_path, files, tables_specs, parsed_files):
+    cache = ResultsCache(str(tmp_path / 'cache'))
+    list(cache.tables(files[0], tables_specs))
+
+    # Tables specifications changed
+    tables_specs_new = {ROD: tables_specs[ROD]}
+    tables = list(cache.tables(files[0], tables_specs_new))
+    assert {table.name for table in tables if table.data is not None} == {ROD}
+    assert_same_tables(tables, list(tables_in_file(files[0], tables_specs_new)))
+
+    tables_specs[ROD]['dtypes']['FX'] = '<f8'
+    tables = [table for table in cache.tables(files[0], tables_specs) if table.name == ROD]
+    assert tables[0].data.dtype['FX'] == np.dtype('<f8')
+    assert parsed_files == files[:1] * 3
+    assert len(cache.entries()) == 3
+
+    # Result file changed
+    with open(files[1], 'rb') as f:
+        content = f.read()
+
+    with open(files[0], 'wb') as f:
+        f.write(content)
+
+    assert_same_tables(list(cache.tables(files[0], tables_specs)), list(tables_in_file(files[1], tables_specs)))
+    assert parsed_files == files[:1] * 4
+
+
+def test_cache_eviction(tmp_path, files, tables_specs, parsed_files):
+    cache = ResultsCache(str(tmp_path / 'cache'))
+    entries = dict()
+    now = time.time()
+
+    for i, file in enumerate(files[:2]):
+        list(cache.tables(file, tables_specs))
+        entries[file] = os.path.join(cache.path, cache.get_key(file, tables_specs))
+        os.utime(entries[file], (now - 30 + i, now - 30 + i))
+
+    size = max(entry_size for _, _, entry_size in cache.entries())
+    cache.max_size = 2 * size + size // 2 # Two entries fit
+
+    list(cache.tables(files[0], tables_specs)) # Cache hit (most recently used now)
+    list(cache.tables(files[2], tables_specs)) # Least recently used evicted
+    assert parsed_files == [files[0], files[1], files[2]]
+    assert os.path.exists(entries[files[0]])
+    assert not os.path.exists(entries[files[1]])
+    assert len(cache.entries()) == 2
+
+    list(cache.tables(files[1], tables_specs)) # Parsed again
+    assert parsed_files == [files[0], files[1], files[2], files[1]]
+    assert not os.path.exists(entries[files[0]])